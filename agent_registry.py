@@ -0,0 +1,225 @@
+import os
+import time
+import uuid
+import sqlite3
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# What every agent is doing right now, shared by the app, agent_runner.py
+# processes (windows, pool workers) and the coordinator for remote workers.
+# Runs live in agent_activity, one row per task being worked on; the agent's
+# totals (busy time, tasks done) and its agents.status text are kept on the
+# agents row. Every change is one or two small statements, and iteration
+# updates touch only the rows of the run.
+
+# Runs an agent may have going at once before the scheduler stops giving it work
+# (local runs only; every remote worker brings its own capacity)
+AGENT_MAX_RUNS = int(os.getenv("AGENT_MAX_RUNS", 1))
+
+STATUS_VERBS = {"CodingAgent": "Coding", "ReviewerAgent": "Reviewing", "GeneratorAgent": "Generating"}
+
+# agent_runner.py --remote has no access to the board's database
+ENABLED = True
+
+def init_agent_registry_schema(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS agent_activity (
+            task_id INTEGER PRIMARY KEY,
+            agent_id INTEGER,
+            run_id TEXT,
+            worker_id TEXT,
+            title TEXT,
+            iteration INTEGER,
+            max_iterations INTEGER,
+            started_at REAL,
+            updated_at REAL,
+            FOREIGN KEY (task_id) REFERENCES tasks (id),
+            FOREIGN KEY (agent_id) REFERENCES agents (id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_agent_activity_agent ON agent_activity (agent_id)')
+    try: cursor.execute('ALTER TABLE agents ADD COLUMN busy_seconds REAL DEFAULT 0')
+    except: pass
+    try: cursor.execute('ALTER TABLE agents ADD COLUMN tasks_done INTEGER DEFAULT 0')
+    except: pass
+    try: cursor.execute('ALTER TABLE agents ADD COLUMN stats_since REAL')
+    except: pass
+
+def _default_db():
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    conn = sqlite3.connect(os.path.join(base_dir, 'ralphboard.db'))
+    conn.row_factory = sqlite3.Row
+    return conn
+
+_get_conn = _default_db
+
+def configure(get_conn):
+    # Use the caller's get_db so activity lands in the same database
+    global _get_conn
+    _get_conn = get_conn
+
+def _status_text(role, runs):
+    verb = STATUS_VERBS.get(role, "Working")
+    if not runs:
+        return "Idle"
+    if len(runs) > 1:
+        return f"{verb} {len(runs)} tasks"
+    run = runs[0]
+    text = f"{verb}: {run['title']}"
+    if run['iteration']:
+        text += f" (Iter {run['iteration']}/{run['max_iterations']})"
+    return text
+
+def _refresh_status(conn, agent_ids):
+    # agents.status, as shown to anyone reading the agents table
+    for agent_id in {a for a in agent_ids if a is not None}:
+        agent = conn.execute('SELECT role FROM agents WHERE id = ?', (agent_id,)).fetchone()
+        if agent is None:
+            continue
+        rows = conn.execute('''
+            SELECT run_id, COUNT(*) AS tasks, MIN(title) AS title, MAX(iteration) AS iteration, MAX(max_iterations) AS max_iterations
+            FROM agent_activity WHERE agent_id = ? GROUP BY run_id
+        ''', (agent_id,)).fetchall()
+        runs = [{"title": row[2] if row[1] == 1 else f"{row[1]} tasks", "iteration": row[3], "max_iterations": row[4]} for row in rows]
+        conn.execute('UPDATE agents SET status = ? WHERE id = ?', (_status_text(agent[0], runs), agent_id))
+
+def started(conn, agent_id, task_ids, worker_id=None, now=None):
+    """
+    Records that `agent_id` took `task_ids` (one run; several for a batch
+    review). Doesn't commit.
+    """
+    if not ENABLED or agent_id is None:
+        return None
+    now = time.time() if now is None else now
+    task_ids = [int(t) for t in (task_ids if isinstance(task_ids, (list, tuple)) else [task_ids])]
+    run_id = uuid.uuid4().hex[:16]
+    titles = {row[0]: row[1] for row in conn.execute(
+        f'SELECT id, title FROM tasks WHERE id IN ({",".join("?" for _ in task_ids)})', task_ids)}
+    conn.executemany('''
+        INSERT OR REPLACE INTO agent_activity (task_id, agent_id, run_id, worker_id, title, started_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [(t, int(agent_id), run_id, worker_id, titles.get(t), now, now) for t in task_ids])
+    conn.execute('UPDATE agents SET stats_since = COALESCE(stats_since, ?) WHERE id = ?', (now, int(agent_id)))
+    _refresh_status(conn, [int(agent_id)])
+    return run_id
+
+def progress(agent_id, task_ids, iteration, max_iterations):
+    """
+    Called by the agents at the start of every iteration, from whichever
+    process runs them. Failures are printed and swallowed.
+    """
+    if not ENABLED or agent_id is None:
+        return
+    task_ids = [int(t) for t in (task_ids if isinstance(task_ids, (list, tuple)) else [task_ids]) if t is not None]
+    if not task_ids:
+        return
+    try:
+        conn = _get_conn()
+        try:
+            conn.execute(f'''
+                UPDATE agent_activity SET iteration = ?, max_iterations = ?, updated_at = ?
+                WHERE task_id IN ({",".join("?" for _ in task_ids)})
+            ''', [iteration, max_iterations, time.time(), *task_ids])
+            _refresh_status(conn, [int(agent_id)])
+            conn.commit()
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"Agent activity update failed: {e}")
+
+def finished(conn, task_ids, now=None, started_before=None):
+    """
+    Ends the runs holding `task_ids` and adds them to their agents' busy time
+    and tasks done. Finishing a task twice is harmless, and with
+    `started_before` (when the caller's run was launched) a later run of the
+    same task is left alone. Doesn't commit.
+    """
+    if not ENABLED:
+        return
+    now = time.time() if now is None else now
+    task_ids = [int(t) for t in (task_ids if isinstance(task_ids, (list, tuple)) else [task_ids])]
+    if not task_ids:
+        return
+    since = "" if started_before is None else "AND started_at <= ?"
+    rows = conn.execute(f'''
+        DELETE FROM agent_activity WHERE task_id IN ({",".join("?" for _ in task_ids)}) {since}
+        RETURNING agent_id, run_id, started_at
+    ''', task_ids + ([] if started_before is None else [started_before])).fetchall()
+    if not rows:
+        return
+
+    tasks_done, runs = {}, {}
+    for agent_id, run_id, started_at in rows:
+        tasks_done[agent_id] = tasks_done.get(agent_id, 0) + 1
+        runs[run_id] = (agent_id, started_at)
+    busy = {}
+    for run_id, (agent_id, started_at) in runs.items():
+        # A batch review is busy time once, when its last task is done
+        if not conn.execute('SELECT 1 FROM agent_activity WHERE run_id = ? LIMIT 1', (run_id,)).fetchone():
+            busy[agent_id] = busy.get(agent_id, 0) + max(0.0, now - (started_at or now))
+    conn.executemany('''
+        UPDATE agents SET busy_seconds = COALESCE(busy_seconds, 0) + ?, tasks_done = COALESCE(tasks_done, 0) + ? WHERE id = ?
+    ''', [(busy.get(agent_id, 0), count, agent_id) for agent_id, count in tasks_done.items()])
+    _refresh_status(conn, tasks_done)
+
+def reconcile(conn, local_only=False):
+    """
+    Finishes runs whose task is no longer in progress (dragged away, or the
+    result is in but its runner didn't report), or with local_only every
+    local run (at startup, when the processes that ran them are gone).
+    Returns the task ids. Doesn't commit.
+    """
+    where = "a.worker_id IS NULL" if local_only else "t.is_inprogress IS NOT 1"
+    task_ids = [row[0] for row in conn.execute(f'''
+        SELECT a.task_id FROM agent_activity a LEFT JOIN tasks t ON t.id = a.task_id WHERE {where}
+    ''')]
+    finished(conn, task_ids)
+    return task_ids
+
+def running(conn, agent_id):
+    # Local runs the agent has going
+    return conn.execute('SELECT COUNT(DISTINCT run_id) FROM agent_activity WHERE agent_id = ? AND worker_id IS NULL',
+                        (int(agent_id),)).fetchone()[0]
+
+def idle_capacity(conn):
+    """
+    {agent_id: runs it can still take} for active agents.
+    """
+    rows = conn.execute('''
+        SELECT a.id, (SELECT COUNT(DISTINCT run_id) FROM agent_activity WHERE agent_id = a.id AND worker_id IS NULL)
+        FROM agents a WHERE a.is_active = 1 ORDER BY a.id
+    ''').fetchall()
+    return {row[0]: max(0, AGENT_MAX_RUNS - row[1]) for row in rows}
+
+def snapshot(conn, now=None):
+    """
+    Per agent: its runs (task, iteration, elapsed), busy and idle seconds
+    since it first worked, utilization and tasks per hour.
+    """
+    now = time.time() if now is None else now
+    runs = {}
+    for row in conn.execute('SELECT * FROM agent_activity ORDER BY started_at'):
+        run = dict(row)
+        run['elapsed_seconds'] = round(now - (run['started_at'] or now), 1)
+        runs.setdefault(run['agent_id'], []).append(run)
+
+    agents = {}
+    for row in conn.execute('SELECT id, status, busy_seconds, tasks_done, stats_since FROM agents'):
+        agent_id, status, busy, done, since = row[0], row[1], row[2] or 0.0, row[3] or 0, row[4]
+        current = runs.get(agent_id, [])
+        # Time of the runs still going, once per run
+        busy += sum(now - started for started in {r['run_id']: r['started_at'] or now for r in current}.values())
+        span = now - since if since else 0.0
+        agents[agent_id] = {
+            "status": status or "Idle",
+            "runs": current,
+            "busy": bool(current),
+            "capacity": max(0, AGENT_MAX_RUNS - len({r['run_id'] for r in current if r['worker_id'] is None})),
+            "busy_seconds": round(busy, 1),
+            "idle_seconds": round(max(0.0, span - busy), 1),
+            "utilization": round(min(1.0, busy / span), 4) if span > 0 else 0.0,
+            "tasks_done": done,
+            "tasks_per_hour": round(done / (span / 3600), 2) if span > 0 else 0.0,
+        }
+    return agents
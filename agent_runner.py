@@ -1,145 +1,292 @@
 import sys
-import sqlite3
+import time
 import json
 import traceback
 import os
 from agents import CodingAgent, ReviewerAgent, GeneratorAgent
 from prompts import SYSTEM_PROMPTS
+from metrics import TimedConnection
+import run_trace
+import agent_registry
+import process_registry
+import task_state
+import coordinator
+import storage
+from verification import verify_task, format_report
 from dotenv import load_dotenv
 
 load_dotenv()
 
+AGENT_CLASSES = {
+    "CodingAgent": CodingAgent,
+    "ReviewerAgent": ReviewerAgent,
+    "GeneratorAgent": GeneratorAgent
+}
+
 # Replicate DB connection from app.py
 def get_db():
     base_dir = os.path.dirname(os.path.abspath(__file__))
     db_path = os.path.join(base_dir, 'ralphboard.db')
     print(f"DEBUG: Connecting to DB at {db_path}")
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return storage.connect(db_path, factory=TimedConnection)
 
-def main():
-    if len(sys.argv) < 3:
-        print("Usage: python agent_runner.py <task_id> <agent_id>")
-        input("Press Enter to exit...")
-        return
+run_trace.configure(get_db)
+agent_registry.configure(get_db)
+process_registry.configure(get_db)
 
-    task_id = sys.argv[1]
-    agent_id = sys.argv[2]
+def load_task_and_agent(conn, task_id, agent_id):
+    """
+    Returns (task, agent_data) records (see models.py), or (None, None) if
+    either is missing. The task carries the project's working_dir.
+    """
+    store = storage.SQLiteStorage(conn)
+    task = store.load_task(task_id)
+    if not task:
+        print(f"Error: Task {task_id} not found.")
+        return None, None
 
-    print(f"--- Agent Runner Starting for Task {task_id} (Agent {agent_id}) ---")
-    
-    try:
-        conn = get_db()
-        cursor = conn.cursor()
+    agent_data = store.load_agent(agent_id)
+    if not agent_data:
+        print(f"Error: Agent {agent_id} not found.")
+        return None, None
+    return task, agent_data
 
-        # 1. Get Task
-        cursor.execute('SELECT * FROM tasks WHERE id = ?', (task_id,))
-        task_row = cursor.fetchone()
-        if not task_row:
-            print(f"Error: Task {task_id} not found.")
-            conn.close()
-            return
-        task = dict(task_row)
-
-        # Get Project Working Directory
-        if task.get('project_id'):
-            cursor.execute('SELECT working_dir FROM projects WHERE id = ?', (task['project_id'],))
-            project_row = cursor.fetchone()
-            if project_row:
-                task['working_dir'] = project_row['working_dir']
-
-        # 2. Get Agent
-        cursor.execute('SELECT * FROM agents WHERE id = ?', (agent_id,))
-        agent_row = cursor.fetchone()
-        if not agent_row:
-            print(f"Error: Agent {agent_id} not found.")
+def build_agent(agent_data, show_window=True):
+    class_name = agent_data.get('role', 'CodingAgent')
+    AgentClass = AGENT_CLASSES.get(class_name, CodingAgent)
+    system_prompt = SYSTEM_PROMPTS.get(agent_data.get('system_prompt_key'), "")
+    if not system_prompt:
+         # Fallback if key not found or empty
+         system_prompt = "You are an AI assistant."
+
+    agent = AgentClass(agent_data['name'], system_prompt, show_window=show_window)
+    # Iteration progress goes to agent_registry under this id
+    agent.agent_id = agent_data['id']
+    return agent
+
+def get_agent(agent_data, agent_cache=None, show_window=True):
+    # Agents are reused while their config is unchanged
+    class_name = agent_data.get('role', 'CodingAgent')
+    cache_key = (agent_data['id'], agent_data['name'], class_name, agent_data.get('system_prompt_key'))
+    agent = agent_cache.get(cache_key) if agent_cache is not None else None
+    if agent is None:
+        agent = build_agent(agent_data, show_window=show_window)
+        if agent_cache is not None:
+            agent_cache[cache_key] = agent
+    return agent
+
+def result_transition(task, class_name, result):
+    """
+    Maps an agent's result to a task_state event: (task_id, event, params).
+    Successful coding runs go through the automated checks first.
+    """
+    task_id = int(task['id'])
+    params = {"role": class_name, "iterations": result.get('iterations')}
+
+    if result['success']:
+        print("\nSUCCESS!")
+        if class_name == "ReviewerAgent":
+            print(f"DEBUG: Task {task_id} approved and marked complete.")
+            return task_id, "review_approved", params
+        # Coding Agent success -> automated checks -> Review
+        report = verify_task(task)
+        if report and not report['passed']:
+            return task_id, "checks_failed", {**params, "feedback": format_report(report)}
+        print(f"DEBUG: Task {task_id} implementation success. Moving to review.")
+        return task_id, "coding_succeeded", params
+
+    print("\nFAILURE.")
+    feedback = result.get('message', 'Unknown error')
+    print(f"Reason: {feedback}")
+    if class_name == "ReviewerAgent":
+        return task_id, "review_rejected", {**params, "feedback": feedback}
+    return task_id, "coding_failed", params
+
+def apply_result(conn, task, class_name, result):
+    return task_state.apply_transitions(conn, [result_transition(task, class_name, result)])[0]
+
+def mark_task_failed(task_id, conn=None):
+    # Attempt to set task to failed so it doesn't hang in progress
+    own_conn = conn is None
+    try:
+        if own_conn:
+            conn = get_db()
+        task_state.try_transition(conn, task_id, "fail")
+    except:
+        pass
+    finally:
+        if own_conn and conn is not None:
             conn.close()
-            return
-        agent_data = dict(agent_row)
+
+def stop_orphans(owner_pid):
+    # opencode sessions left running by a runner window or pool worker that died
+    conn = get_db()
+    try:
+        stopped = process_registry.kill_owned_by(conn, owner_pid)
+        conn.commit()
+    finally:
         conn.close()
+    if stopped:
+        print(f"DEBUG: Stopped {stopped} process(es) left behind by {owner_pid}.")
+    return stopped
+
+def run_task(task_id, agent_id, conn=None, agent_cache=None, show_window=True):
+    """
+    Runs one task with one agent and writes the outcome back to the DB.
 
-        # 3. Instantiate Agent
-        AGENT_CLASSES = {
-            "CodingAgent": CodingAgent,
-            "ReviewerAgent": ReviewerAgent,
-            "GeneratorAgent": GeneratorAgent
-        }
-        
+    `conn` and `agent_cache` let a long-lived worker (see worker_pool.py) keep
+    its DB connection and agent objects warm between tasks. Without them a
+    fresh connection and agent are created, as in the one-shot window mode.
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db()
+
+    try:
+        task, agent_data = load_task_and_agent(conn, task_id, agent_id)
+        if not task:
+            return {"success": False, "message": f"Task {task_id} or Agent {agent_id} not found."}
+        if not task['is_inprogress']:
+            # Moved off In Progress (cancelled) while the run was waiting to start
+            print(f"Task {task_id} is no longer in progress. Skipping.")
+            return {"success": False, "cancelled": True, "message": f"Task {task_id} is no longer in progress."}
+
+        # 3. Instantiate Agent (reused while its config is unchanged)
         class_name = agent_data.get('role', 'CodingAgent')
-        AgentClass = AGENT_CLASSES.get(class_name, CodingAgent)
-        system_prompt = SYSTEM_PROMPTS.get(agent_data.get('system_prompt_key'), "")
-        if not system_prompt:
-             # Fallback if key not found or empty
-             system_prompt = "You are an AI assistant."
+        agent = get_agent(agent_data, agent_cache, show_window)
 
-        agent = AgentClass(agent_data['name'], system_prompt, show_window=True)
         print(f"Agent: {agent.name} ({class_name})")
         print(f"Task: {task['title']}")
         print("-" * 40)
 
         # 4. Run Task
         # Note: Task status is already 'In Progress' set by app.py before launching this
+        # Work a remote worker pushed for it has to be in this checkout first
+        coordinator.sync_local_checkout(conn, task)
+        started = time.time()
         result = agent.work_on_task(task)
-        
-        # 5. Update DB based on result
+
+        # 5. Update DB based on result, unless the board took the task back meanwhile
+        if result.get('cancelled') or process_registry.cancelled_tasks(task_id, started):
+            print(f"Task {task_id} was cancelled. Result dropped.")
+            return {**result, "success": False, "cancelled": True}
+        apply_result(conn, task, class_name, result)
+        print("-" * 40)
+        return result
+
+    except Exception as e:
+        print(f"\nCRITICAL ERROR: {e}")
+        traceback.print_exc()
+        mark_task_failed(task_id, conn)
+        return {"success": False, "message": str(e)}
+    finally:
+        if own_conn:
+            conn.close()
+
+def run_review_batch(task_ids, agent_id, conn=None, agent_cache=None, show_window=True):
+    """
+    Reviews several tasks of one project in one reviewer session and applies
+    each task's verdict through apply_result, like run_task does for one.
+    Falls back to run_task per task for agents that can't batch.
+    """
+    own_conn = conn is None
+    if own_conn:
         conn = get_db()
-        cursor = conn.cursor()
-        
-        if result['success']:
-            print("\nSUCCESS!")
-            if class_name == "ReviewerAgent":
-                # Review passed!
-                cursor.execute('UPDATE tasks SET is_inprogress = 0, is_review = 0, is_complete = 1, is_failed = 0 WHERE id = ?', (int(task_id),))
-                print(f"DEBUG: Task {task_id} approved and marked complete.")
-            else:
-                # Coding Agent success -> Review
-                cursor.execute('UPDATE tasks SET is_inprogress = 0, is_review = 1, is_failed = 0 WHERE id = ?', (int(task_id),))
-                print(f"DEBUG: Task {task_id} implementation success. Moving to review.")
+
+    tasks = []
+    applied = set()
+    try:
+        agent_data = None
+        for task_id in task_ids:
+            task, agent_data = load_task_and_agent(conn, task_id, agent_id)
+            if task and task['is_inprogress']:
+                tasks.append(task)
+            elif task:
+                # Cancelled before the review started
+                applied.add(int(task_id))
+        if not tasks:
+            return {"success": False, "message": f"Tasks {task_ids} (in progress) or Agent {agent_id} not found."}
+
+        class_name = agent_data.get('role', 'CodingAgent')
+        agent = get_agent(agent_data, agent_cache, show_window)
+        if not hasattr(agent, 'review_batch') or len(tasks) == 1:
+            results = {}
+            for task in tasks:
+                results[int(task['id'])] = run_task(task['id'], agent_id, conn=conn, agent_cache=agent_cache, show_window=show_window)
+                applied.add(int(task['id']))
         else:
-            print("\nFAILURE.")
-            feedback = result.get('message', 'Unknown error')
-            print(f"Reason: {feedback}")
-            
-            if class_name == "ReviewerAgent":
-                # Review failed!
-                current_reviews = task.get('review_count', 0)
-                if current_reviews is None: current_reviews = 0
-                
-                new_count = current_reviews + 1
-                max_reviews = int(os.getenv("MAX_REVIEW_ATTEMPTS", 3))
-                
-                if new_count >= max_reviews:
-                    print(f"Task {task_id} failed review {new_count} times. Marking as FAILED.")
-                    cursor.execute('UPDATE tasks SET is_inprogress = 0, is_review = 0, is_complete = 0, is_failed = 1, review_count = ? WHERE id = ?', (new_count, int(task_id)))
-                else:
-                    print(f"Task {task_id} failed review {new_count}. Returning to TODO.")
-                    # Prepend feedback to description
-                    new_desc = f"__REVIEW FEEDBACK ({new_count})__:\n{feedback}\n\n" + (task['description'] or "")
-                    cursor.execute('UPDATE tasks SET is_inprogress = 0, is_review = 0, is_complete = 0, is_failed = 0, review_count = ?, description = ? WHERE id = ?', 
-                                  (new_count, new_desc, int(task_id)))
-            else:
-                # Coding Agent failed
-                cursor.execute('UPDATE tasks SET is_inprogress = 0, is_failed = 1 WHERE id = ?', (int(task_id),))
-                
-        conn.commit()
-        conn.close()
-        print("-" * 40)
+            print(f"Agent: {agent.name} ({class_name})")
+            print(f"Tasks: {', '.join(task['title'] for task in tasks)}")
+            print("-" * 40)
+            for task in tasks:
+                coordinator.sync_local_checkout(conn, task)
+
+            started = time.time()
+            results = agent.review_batch(tasks)
+            cancelled = process_registry.cancelled_tasks([task['id'] for task in tasks], started)
+            # All verdicts land in one transaction; tasks cancelled on the board keep where they were moved
+            task_state.apply_transitions(conn, [result_transition(task, class_name, results[int(task['id'])]) for task in tasks
+                                                if int(task['id']) not in cancelled and not results[int(task['id'])].get('cancelled')])
+            applied.update(int(task['id']) for task in tasks)
+            print("-" * 40)
+
+        approved = sum(1 for r in results.values() if r.get('success'))
+        return {"success": approved == len(tasks), "message": f"{approved}/{len(tasks)} tasks approved.",
+                "results": {str(task_id): r.get('success') for task_id, r in results.items()}}
 
     except Exception as e:
         print(f"\nCRITICAL ERROR: {e}")
         traceback.print_exc()
-        try:
-            # Attempt to set task to failed so it doesn't hang in progress
-            conn = get_db()
-            conn.execute('UPDATE tasks SET is_inprogress = 0, is_failed = 1 WHERE id = ?', (task_id,))
-            conn.commit()
+        # Verdicts already written stand; only the rest would hang in progress
+        for task_id in task_ids:
+            if int(task_id) not in applied:
+                mark_task_failed(task_id, conn)
+        return {"success": False, "message": str(e)}
+    finally:
+        if own_conn:
             conn.close()
-        except:
-            pass
-    
+
+def remote_main(argv):
+    import argparse
+    from remote_worker import RemoteWorker
+    parser = argparse.ArgumentParser(description="Run agents on this machine for a RalphBoard coordinator.")
+    parser.add_argument("--remote", required=True, metavar="URL", help="Coordinator API, e.g. http://board-host:8765")
+    parser.add_argument("--agent", required=True, type=int, help="Agent id whose queues and role to use")
+    parser.add_argument("--worker-id", help="Name shown on the board (default: host-pid)")
+    parser.add_argument("--once", action="store_true", help="Run at most one task, then exit")
+    args = parser.parse_args(argv)
+    # remote_worker imports this module by name; don't load it a second time
+    sys.modules.setdefault("agent_runner", sys.modules[__name__])
+    # Run traces belong in the coordinator's database, which isn't reachable from here
+    run_trace.RUN_TRACE_ENABLED = False
+    agent_registry.ENABLED = False
+    process_registry.ENABLED = False
+    RemoteWorker(args.remote, args.agent, worker_id=args.worker_id).run(once=args.once)
+
+def main():
+    if "--remote" in sys.argv:
+        remote_main(sys.argv[1:])
+        return
+
+    if len(sys.argv) < 3:
+        print("Usage: python agent_runner.py <task_id>[,<task_id>...] <agent_id>")
+        print("       python agent_runner.py --remote <url> --agent <agent_id> [--worker-id NAME] [--once]")
+        input("Press Enter to exit...")
+        return
+
+    task_id = sys.argv[1]
+    agent_id = sys.argv[2]
+
+    print(f"--- Agent Runner Starting for Task {task_id} (Agent {agent_id}) ---")
+
+    if "," in task_id:
+        # Batch review
+        run_review_batch([t for t in task_id.split(",") if t], agent_id)
+    else:
+        run_task(task_id, agent_id)
+
     print("\nSession Finished.")
-    
+
     # Check for DEBUG flag to keep window open
     if os.getenv("DEBUG", "").lower() == "true":
         input("Press Enter to close window (DEBUG mode)...")
@@ -7,9 +7,24 @@ from dotenv import load_dotenv
 
 from dotenv import load_dotenv
 import re
+from rate_limiter import get_limiter, estimate_tokens, PRIORITY_AGENT, EST_COMPLETION_TOKENS, SESSION_LEASE_TTL
+import metrics
+import run_trace
+import agent_registry
+import process_registry
+from prompts import ralph_prompt, ralph_followup_prompt, review_prompt, batch_review_prompt
+from workspace import WorkspaceIndex, changed_files, describe_changes
 
 load_dotenv()
 
+# Keep one opencode session per coding run and send only a short follow-up
+# each iteration instead of the full prompt (falls back to a fresh session)
+OPENCODE_SESSION_REUSE = os.getenv("OPENCODE_SESSION_REUSE", "false").lower() == "true"
+# Start a fresh session after this many turns so the context doesn't grow unbounded
+OPENCODE_SESSION_MAX_TURNS = int(os.getenv("OPENCODE_SESSION_MAX_TURNS", 6))
+# Running `opencode serve` to attach to, e.g. http://127.0.0.1:4096 (skips per-run startup)
+OPENCODE_ATTACH_URL = os.getenv("OPENCODE_ATTACH_URL", "")
+
 def remove_ansi(text):
     ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
     return ansi_escape.sub('', text)
@@ -58,6 +73,10 @@ class BaseAgent:
         self.system_prompt = system_prompt
         self.show_window = show_window
         self.status = "Idle"
+        # The agents row this agent runs as, if any (see agent_registry.py)
+        self.agent_id = None
+        # Position in the shared model-endpoint queue (lower = sooner)
+        self.request_priority = PRIORITY_AGENT
         
         # Configure OpenAI
         api_key = os.getenv("OPENAI_API_KEY", "no-key-required")
@@ -83,13 +102,123 @@ class BaseAgent:
             
             if response_format:
                 completion_args["response_format"] = response_format
-                
-            response = self.client.chat.completions.create(**completion_args)
+
+            # Wait for a slot on the shared endpoint
+            est_tokens = estimate_tokens(self.system_prompt) + estimate_tokens(user_msg) + EST_COMPLETION_TOKENS
+            started = time.perf_counter()
+            with get_limiter().acquire(priority=self.request_priority, tokens=est_tokens) as lease:
+                metrics.LLM_WAIT_SECONDS.observe(time.perf_counter() - started, (type(self).__name__,))
+                response = self.client.chat.completions.create(**completion_args)
+                usage = getattr(response, "usage", None)
+                if usage is not None and getattr(usage, "total_tokens", None):
+                    lease.record_usage(usage.total_tokens)
+            metrics.LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, (type(self).__name__,))
             return response.choices[0].message.content
         except Exception as e:
             print(f"Error in agent {self.name}: {e}")
             return None
 
+    def run_opencode(self, prompt, working_dir, primer_msg, session_id=None, track_session=False, task_ids=None):
+        """
+        Runs one opencode session in working_dir with the prompt on stdin,
+        echoing its output. Returns (returncode, output, session_id).
+
+        With track_session, output is requested as JSON events so the
+        session id can be picked up; pass it back as session_id to continue
+        that session. The process is registered under `task_ids` so
+        cancelling a task stops it (process_registry.py). The session holds
+        one rate limiter slot while it runs, so LLM_MAX_INFLIGHT also caps
+        concurrent sessions across windows and pool workers.
+        """
+        print(f"[{self.name}] Working Directory: {working_dir}")
+
+        # Setup auto-approve config
+        env_updates = ensure_opencode_config(working_dir)
+        proc_env = os.environ.copy()
+        proc_env.update(env_updates)
+
+        cmd = ["opencode.cmd", "run"]
+        if OPENCODE_ATTACH_URL:
+            cmd += ["--attach", OPENCODE_ATTACH_URL]
+        if track_session:
+            cmd += ["--format", "json"]
+        if session_id:
+            cmd += ["--session", session_id]
+        cmd.append(primer_msg)
+
+        # opencode talks to the endpoint itself; one slot covers the whole session
+        started, waiting_since = time.perf_counter(), time.time()
+        lease = get_limiter().acquire(priority=self.request_priority, tokens=estimate_tokens(prompt), ttl=SESSION_LEASE_TTL)
+        metrics.LLM_WAIT_SECONDS.observe(time.perf_counter() - started, (type(self).__name__,))
+        with lease.keep_alive(SESSION_LEASE_TTL):
+            if task_ids and process_registry.cancelled_tasks(task_ids, waiting_since):
+                # Cancelled while waiting for the slot; the caller sees the flag
+                return -1, "", None
+            return self._run_opencode_process(cmd, prompt, working_dir, proc_env, track_session, task_ids)
+
+    def _run_opencode_process(self, cmd, prompt, working_dir, proc_env, track_session, task_ids):
+        process = subprocess.Popen(
+            cmd,
+            cwd=working_dir,
+            env=proc_env,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            encoding='utf-8',
+            errors='replace',
+            shell=True,
+            **process_registry.popen_kwargs()
+        )
+        process_registry.register(task_ids, process)
+
+        output = ""
+        seen_session = None
+        try:
+            # Prompt goes over stdin to avoid Windows argument length/parsing issues
+            try:
+                process.stdin.write(prompt)
+                process.stdin.close()
+            except OSError:
+                # Killed before it read the prompt (cancelled)
+                pass
+
+            for line in process.stdout:
+                if track_session:
+                    text, line_session = parse_opencode_event(line)
+                    seen_session = seen_session or line_session
+                    line = text
+                print(line, end='')
+                output += line
+
+            process.wait()
+        finally:
+            process_registry.unregister(process)
+        return process.returncode, output, seen_session
+
+def parse_opencode_event(line):
+    """
+    Returns (text, session_id) for one line of `opencode run --format json`.
+    Only text and errors are kept; lines that aren't JSON events pass through.
+    """
+    try:
+        event = json.loads(line)
+    except ValueError:
+        return line, None
+    if not isinstance(event, dict):
+        return line, None
+    part = event.get("part") if isinstance(event.get("part"), dict) else {}
+    session_id = event.get("sessionID") or part.get("sessionID")
+    if event.get("type") == "text":
+        text = part.get("text") or event.get("text") or ""
+        return (text if text.endswith("\n") else text + "\n"), session_id
+    if event.get("type") == "error":
+        error = event.get("error")
+        if isinstance(error, dict):
+            error = (error.get("data") or {}).get("message") or error.get("name")
+        return f"Error: {error}\n", session_id
+    return "", session_id
+
 class CodingAgent(BaseAgent):
     def __init__(self, name, system_prompt, show_window=False):
         super().__init__(name, "Coder", system_prompt, show_window)
@@ -104,114 +233,117 @@ class CodingAgent(BaseAgent):
     def work_on_task(self, task):
         self.status = f"Coding: {task['title']}"
         result = self.ralph_loop(task)
+        if result.get("cancelled"):
+            return {"success": False, "cancelled": True, "message": f"CANCELLED task: {task['title']}", "iterations": result.get("iterations")}
         if result.get("success"):
-            return {"success": True, "message": f"Completed task: {task['title']}\nOutput: {result.get('output')}"}
+            return {"success": True, "message": f"Completed task: {task['title']}\nOutput: {result.get('output')}", "iterations": result.get("iterations")}
         else:
-            return {"success": False, "message": f"FAILED task: {task['title']}\nReason: {result.get('error')}"}
+            return {"success": False, "message": f"FAILED task: {task['title']}\nReason: {result.get('error')}", "iterations": result.get("iterations")}
 
     def ralph_loop(self, task):
         max_iterations = int(os.getenv("MAX_ITERATIONS", 15))
         iteration_count = 1
         failure_log = []
+        trace = run_trace.start_run(task, self.name, type(self).__name__, max_iterations)
+        # Cancellations from before this run are an earlier run's
+        run_started = time.time()
+
+        # Give up early when opencode stops touching the working directory
+        max_stalled = int(os.getenv("MAX_STALLED_ITERATIONS", 3))
+        stalled = 0
+        workspace = None
+        if task.get('working_dir') and os.path.isdir(task['working_dir']):
+            workspace = WorkspaceIndex(task['working_dir'])
+            workspace.scan()
         
-        task_prompt = f"""Task Title: {task['title']}
-Description: {task.get('description', '')}
-Success Criteria: {task.get('success_criteria', '')}"""
+        # Persistent opencode session (OPENCODE_SESSION_REUSE)
+        session_id = None
+        session_turns = 0
 
         while iteration_count <= max_iterations:
-            # Construct the Ralph Prompt (Similar to example)
-            failure_context = ""
-            if failure_log:
-                failure_context = "\n\n## Previous Failed Attempts Log:\n" + "\n".join(failure_log)
-            
-            ralph_prompt = f"""
-# Ralph Wiggum Loop - Iteration {iteration_count} / {max_iterations}
-
-You are in an iterative development loop. Work on the task below until you can genuinely complete it.
-
-## Your Task
-{task_prompt}
-
-{failure_context}
-
-## Instructions
-1. Read the current state of files to understand what's been done.
-2. Make progress on the task.
-3. Run tests/verification if applicable.
-4. When the task is GENUINELY COMPLETE, output:
-   <promise>COMPLETE</promise>
-
-## Critical Rules
-- ONLY output <promise>COMPLETE</promise> when the task is truly done.
-- Do NOT lie or output false promises to exit the loop.
-- If you failed in previous iterations, analyze the failure log and TRY A DIFFERENT APPROACH.
-- The loop will continue until you succeed or we run out of iterations.
-
-Now, work on the task. Good luck!
-"""
+            if process_registry.cancelled_tasks(task.get('id'), run_started):
+                # Dragged away, cancelled or preempted on the board
+                print(f"[{self.name}] Task cancelled. Stopping.")
+                trace.finish("cancelled")
+                return {"success": False, "cancelled": True, "iterations": iteration_count - 1}
+            if session_id and session_turns < OPENCODE_SESSION_MAX_TURNS:
+                # The session already holds the task and earlier attempts; only send what's new
+                prompt = ralph_followup_prompt(failure_log[-1] if failure_log else "", iteration_count, max_iterations)
+            else:
+                session_id = None
+                session_turns = 0
+                prompt = ralph_prompt(task, failure_log, iteration_count, max_iterations)
             self.status = f"Coding: {task['title']} (Iter {iteration_count}/{max_iterations})"
-            print(f"[{self.name}] Starting Iteration {iteration_count}...")
+            agent_registry.progress(self.agent_id, task.get('id'), iteration_count, max_iterations)
+            print(f"[{self.name}] Starting Iteration {iteration_count}{' (continuing session)' if session_id else ''}...")
             
             # Execute Opencode CLI
             full_output = ""
+            trace.iteration_started(iteration_count, prompt)
             try:
                 # Use a primer message as arg and pass the full context via stdin
-                # This avoids Windows argument length/parsing issues with multiline strings
                 primer_msg = "Please follow the iterative development instructions provided in the input below."
-                
-                
-                working_dir = task.get('working_dir')
-                print(f"[{self.name}] Working Directory: {working_dir}")
-                
-                # Setup auto-approve config
-                env_updates = ensure_opencode_config(working_dir)
-                proc_env = os.environ.copy()
-                proc_env.update(env_updates)
-
-                process = subprocess.Popen(
-                    ["opencode.cmd", "run", primer_msg],
-                    cwd=working_dir,
-                    env=proc_env,
-                    stdin=subprocess.PIPE,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.STDOUT,
-                    text=True,
-                    encoding='utf-8',
-                    errors='replace',
-                    shell=True
+                returncode, full_output, new_session = self.run_opencode(
+                    prompt, task.get('working_dir'), primer_msg,
+                    session_id=session_id, track_session=OPENCODE_SESSION_REUSE, task_ids=task.get('id')
                 )
-
-
-                # Write prompt to stdin and close
-                process.stdin.write(ralph_prompt)
-                process.stdin.close()
-
-                for line in process.stdout:
-                    print(line, end='')
-                    full_output += line
-                
-                process.wait()
+                changes = workspace.scan() if workspace else None
+                trace.iteration_finished(returncode, full_output,
+                                         files_changed=len(changed_files(changes)) if changes is not None else None)
+
+                if OPENCODE_SESSION_REUSE:
+                    if returncode == 0 and new_session and full_output.strip():
+                        session_id = new_session
+                        session_turns += 1
+                    else:
+                        # Unhealthy session: next iteration starts fresh with the full prompt
+                        if session_id:
+                            print(f"[{self.name}] Session {session_id} unhealthy (exit {returncode}). Starting a fresh session.")
+                        session_id = None
                 
             except Exception as e:
+                changes = workspace.scan() if workspace else None
+                trace.iteration_finished(None, full_output, error=str(e))
                 print(f"[{self.name}] | Execution Error: {e}")
                 failure_log.append(f"Iteration {iteration_count} Execution Error: {e}")
+                session_id = None
                 iteration_count += 1
                 time.sleep(1)
                 continue
 
+            if process_registry.cancelled_tasks(task.get('id'), run_started):
+                # Its opencode was stopped mid-iteration; don't count that as an attempt
+                print(f"[{self.name}] Task cancelled. Stopping.")
+                trace.finish("cancelled")
+                return {"success": False, "cancelled": True, "iterations": iteration_count}
+
             # Check for completion promise
             if "<promise>COMPLETE</promise>" in full_output:
                 print(f"[{self.name}] Completion promise detected in Iteration {iteration_count}!")
-                return {"success": True, "output": full_output}
+                trace.finish("success")
+                return {"success": True, "output": full_output, "iterations": iteration_count}
             
-            log_entry = f"Iteration {iteration_count} Result: Did not complete. Output snippet: {full_output[-200:]}..."
+            change_summary = describe_changes(changes)
+            print(f"[{self.name}] {change_summary}")
+            log_entry = f"Iteration {iteration_count} Result: Did not complete. {change_summary}. Output snippet: {full_output[-200:]}..."
             failure_log.append(log_entry)
+
+            if changes is not None and not changed_files(changes):
+                stalled += 1
+                if max_stalled and stalled >= max_stalled:
+                    print(f"[{self.name}] No workspace changes in {stalled} iterations. Stopping.")
+                    trace.finish("stalled")
+                    return {"success": False, "error": f"Stalled: no changes in the working directory for {stalled} consecutive iterations.",
+                            "iterations": iteration_count}
+            else:
+                stalled = 0
             
             iteration_count += 1
             time.sleep(1) # Brief pause
 
         # If we exit the loop, we failed
-        return {"success": False, "error": "Max iterations reached without completion promise."}
+        trace.finish("failure")
+        return {"success": False, "error": "Max iterations reached without completion promise.", "iterations": max_iterations}
 
 class ReviewerAgent(BaseAgent):
     def __init__(self, name, system_prompt, show_window=False):
@@ -231,93 +363,37 @@ class ReviewerAgent(BaseAgent):
         max_iterations = int(os.getenv("MAX_REVIEW_ITERATIONS", 5))
         iteration_count = 1
         full_log = []
+        trace = run_trace.start_run(task, self.name, type(self).__name__, max_iterations)
         
-        task_info = f"""Task Title: {task['title']}
-Description: {task.get('description', '')}
-Success Criteria: {task.get('success_criteria', '')}"""
-
         working_dir = task.get('working_dir')
-        
+        run_started = time.time()
 
         while iteration_count <= max_iterations:
-            previous_context = ""
-            if full_log:
-                previous_context = "\n\n## Review Progress Log:\n" + "\n".join(full_log[-3:])
-
-            review_prompt = f"""
-# Task Review - Iteration {iteration_count} / {max_iterations}
-
-You are a strict QA Reviewer. Your job is to verify if the following task has been completed correctly.
-
-## The Task
-{task_info}
-
-{previous_context}
-
-## Instructions
-1. Explore the codebase (list files, read files) to verify the implementation.
-2. Check if the Success Criteria are met. in the working directory: {working_dir}
-3. If you need more information, use tools to get it.
-4. If the task is GENUINELY COMPLETE and meets all criteria:
-   - Output: <promise>COMPLETE</promise>
-5. If there are issues, bugs, or missing requirements:
-   - List the specific issues clearly.
-   - Output: <promise>REJECTED</promise> (This acts as the fail signal)
-
-## Critical Rules
-- You MUST explicitly output <promise>COMPLETE</promise> or <promise>REJECTED</promise> when you have made a decision.
-- Do NOT just stop without a decision.
-- If you run out of iterations, the review defaults to REJECTED.
-
-Begin your review step.
-"""
+            if process_registry.cancelled_tasks(task.get('id'), run_started):
+                print(f"[{self.name}] Review cancelled. Stopping.")
+                trace.finish("cancelled")
+                return {"success": False, "cancelled": True, "message": "Review cancelled", "iterations": iteration_count - 1}
+            prompt = review_prompt(task, working_dir, full_log, iteration_count, max_iterations)
             print(f"[{self.name}] Starting Review Iteration {iteration_count}...")
+            agent_registry.progress(self.agent_id, task.get('id'), iteration_count, max_iterations)
             
+            current_output = ""
+            trace.iteration_started(iteration_count, prompt)
             try:
-                primer_msg = "Please continue the review process."
-                
-                
-                
-                
-                print(f"[{self.name}] Working Directory: {working_dir}")
-                
-                # Setup auto-approve config
-                env_updates = ensure_opencode_config(working_dir)
-                proc_env = os.environ.copy()
-                proc_env.update(env_updates)
-
-                process = subprocess.Popen(
-                    ["opencode.cmd", "run", primer_msg],
-                    cwd=working_dir,
-                    env=proc_env,
-                    stdin=subprocess.PIPE,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.STDOUT,
-                    text=True,
-                    encoding='utf-8',
-                    errors='replace',
-                    shell=True
-                )
-
-
-                process.stdin.write(review_prompt)
-                process.stdin.close()
-
-                current_output = ""
-                for line in process.stdout:
-                    print(line, end='')
-                    current_output += line
-                
-                process.wait()
+                returncode, current_output, _ = self.run_opencode(prompt, working_dir, "Please continue the review process.",
+                                                                  task_ids=task.get('id'))
+                trace.iteration_finished(returncode, current_output)
                 
                 if "<promise>COMPLETE</promise>" in current_output:
                     print(f"[{self.name}] Task Approved!")
-                    return {"success": True, "message": "Task Approved by Reviewer"}
+                    trace.finish("success")
+                    return {"success": True, "message": "Task Approved by Reviewer", "iterations": iteration_count}
                 
                 if "<promise>REJECTED</promise>" in current_output:
                     print(f"[{self.name}] Task Rejected.")
+                    trace.finish("rejected")
                     clean_msg = remove_ansi(current_output)
-                    return {"success": False, "message": clean_msg}
+                    return {"success": False, "message": clean_msg, "iterations": iteration_count}
                 
                 log_entry = f"Iteration {iteration_count} Output Snippet: {current_output[-300:]}..."
                 full_log.append(log_entry)
@@ -327,9 +403,101 @@ Begin your review step.
 
             except Exception as e:
                 print(f"[{self.name}] Review execution error: {e}")
-                return {"success": False, "message": f"Review execution error: {e}"}
+                trace.iteration_finished(None, current_output, error=str(e))
+                trace.finish("error")
+                return {"success": False, "message": f"Review execution error: {e}", "iterations": iteration_count}
+
+        trace.finish("failure")
+        return {"success": False, "message": "Reviewer timed out (max iterations reached) without a clear decision. Defaulting to Rejection.", "iterations": max_iterations}
+
+    def review_batch(self, tasks):
+        """
+        Reviews several tasks of one project in a single opencode session.
+        Each task needs its own <verdict task="ID"> block; tasks left without
+        one are reviewed again next iteration, then default to rejection.
+        Returns {task_id: result} with the same result dicts as work_on_task.
+        """
+        tasks = {int(task['id']): task for task in tasks}
+        self.status = f"Reviewing {len(tasks)} tasks"
+        print(f"[{self.name}] Starting batch review for tasks: {', '.join(str(t) for t in tasks)}")
+
+        max_iterations = int(os.getenv("MAX_REVIEW_ITERATIONS", 5))
+        working_dir = next(iter(tasks.values())).get('working_dir')
+        traces = {task_id: run_trace.start_run(task, self.name, type(self).__name__, max_iterations)
+                  for task_id, task in tasks.items()}
+        results = {}
+        full_log = []
+        iteration_count = 1
+        run_started = time.time()
 
-        return {"success": False, "message": "Reviewer timed out (max iterations reached) without a clear decision. Defaulting to Rejection."}
+        while iteration_count <= max_iterations:
+            # Tasks cancelled on the board drop out; the rest go on
+            for task_id in process_registry.cancelled_tasks([t for t in tasks if t not in results], run_started):
+                print(f"[{self.name}] Task {task_id} cancelled.")
+                traces[task_id].finish("cancelled")
+                results[task_id] = {"success": False, "cancelled": True, "message": "Review cancelled", "iterations": iteration_count - 1}
+            pending = [task_id for task_id in tasks if task_id not in results]
+            if not pending:
+                break
+
+            prompt = batch_review_prompt(tasks, pending, working_dir, full_log, iteration_count, max_iterations)
+            print(f"[{self.name}] Starting Batch Review Iteration {iteration_count} ({len(pending)} tasks)...")
+            agent_registry.progress(self.agent_id, pending, iteration_count, max_iterations)
+
+            current_output = ""
+            for task_id in pending:
+                traces[task_id].iteration_started(iteration_count, prompt)
+            try:
+                returncode, current_output, _ = self.run_opencode(prompt, working_dir, "Please continue the review process.",
+                                                                  task_ids=pending)
+            except Exception as e:
+                print(f"[{self.name}] Review execution error: {e}")
+                for task_id in pending:
+                    traces[task_id].iteration_finished(None, current_output, error=str(e))
+                    traces[task_id].finish("error")
+                    results[task_id] = {"success": False, "message": f"Review execution error: {e}", "iterations": iteration_count}
+                return results
+
+            verdicts = parse_verdicts(remove_ansi(current_output))
+            for task_id in pending:
+                verdict = verdicts.get(task_id)
+                traces[task_id].iteration_finished(returncode, current_output, marker=verdict[0] if verdict else None)
+                if verdict is None:
+                    continue
+                decision, details = verdict
+                if decision == "COMPLETE":
+                    print(f"[{self.name}] Task {task_id} Approved!")
+                    traces[task_id].finish("success")
+                    results[task_id] = {"success": True, "message": "Task Approved by Reviewer", "iterations": iteration_count}
+                else:
+                    print(f"[{self.name}] Task {task_id} Rejected.")
+                    traces[task_id].finish("rejected")
+                    results[task_id] = {"success": False, "message": details or "Rejected by reviewer (no details given).",
+                                        "iterations": iteration_count}
+
+            full_log.append(f"Iteration {iteration_count}: verdicts for {sorted(set(verdicts) & set(pending)) or 'none'}. "
+                            f"Output Snippet: {current_output[-300:]}...")
+            iteration_count += 1
+            time.sleep(1)
+
+        for task_id in tasks:
+            if task_id not in results:
+                traces[task_id].finish("failure")
+                results[task_id] = {"success": False, "message": "Reviewer timed out (max iterations reached) without a clear decision. Defaulting to Rejection.",
+                                    "iterations": max_iterations}
+        return results
+
+VERDICT_RE = re.compile(r'<verdict\s+task\s*=\s*["\']?(\d+)["\']?\s*>\s*(COMPLETE|REJECTED)\b(.*?)</verdict>', re.DOTALL | re.IGNORECASE)
+
+def parse_verdicts(output):
+    """
+    Returns {task_id: ("COMPLETE" | "REJECTED", details)} from batch review
+    output. If a task has several verdicts the last one wins.
+    """
+    verdicts = {}
+    for match in VERDICT_RE.finditer(output or ""):
+        verdicts[int(match.group(1))] = (match.group(2).upper(), match.group(3).strip())
+    return verdicts
 
 class GeneratorAgent(BaseAgent):
     def __init__(self, name, system_prompt, show_window=False):
@@ -1,13 +1,29 @@
 import eel
 import os
 import json
-import sqlite3
 from openai import OpenAI
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
-from prompts import SYSTEM_PROMPTS
+from prompts import SYSTEM_PROMPTS, INTERNAL_PROMPTS
 from agents import GeneratorAgent, CodingAgent, ReviewerAgent
+from scheduler import pick_review_batch, preemption_candidates, fair_share, AgentLoop, REVIEW_BATCH_SIZE
+from rate_limiter import get_limiter, PRIORITY_INTERACTIVE, PRIORITY_BATCH
+import search_index
+import archive
+import board_io
+import metrics
+import profiling
+import run_trace
+import verification
+import dependencies
+import task_state
+import agent_runner
+import coordinator
+import agent_registry
+import process_registry
+import storage
 
 # Load environment variables
 load_dotenv()
@@ -22,91 +38,63 @@ client = OpenAI(
     base_url=base_url
 )
 
+# Max concurrent model calls when expanding many tasks at once
+EXPANSION_CONCURRENCY = int(os.getenv("EXPANSION_CONCURRENCY", 8))
+# Project descriptions longer than this (characters) are planned in two levels:
+# epics first, then every epic's tasks in parallel (see generate_project_tasks)
+GENERATION_EPIC_THRESHOLD = int(os.getenv("GENERATION_EPIC_THRESHOLD", 6000))
+
+# Run agent scheduling in the backend instead of the browser's polling loop.
+# Always on in headless mode (daemon.py).
+BACKEND_SCHEDULER = os.getenv("BACKEND_SCHEDULER", "false").lower() == "true"
+
+# A daemon's API (e.g. http://board-host:8765) for the UI to use instead of
+# running a backend of its own. If unset, the UI still looks for a daemon
+# on the local DAEMON_PORT.
+DAEMON_URL = os.getenv("DAEMON_URL", "")
+
 # SQLite Setup
 DB_FILE = "ralphboard.db"
 
 def get_db():
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return storage.connect(DB_FILE, factory=profiling.connection_factory)
+
+def get_store():
+    # Projects, tasks and agents go through the repository layer (storage.py)
+    return storage.SQLiteStorage(get_db(), fair_share)
 
 def init_db():
     conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS projects (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            description TEXT,
-            working_dir TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS tasks (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            project_id INTEGER,
-            title TEXT NOT NULL,
-            description TEXT,
-            success_criteria TEXT,
-            is_inprogress INTEGER DEFAULT 0,
-            is_review INTEGER DEFAULT 0,
-            is_complete INTEGER DEFAULT 0,
-            is_failed INTEGER DEFAULT 0,
-            dependency_id INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (project_id) REFERENCES projects (id),
-            FOREIGN KEY (dependency_id) REFERENCES tasks (id)
-        )
-    ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS agents (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            role TEXT,
-            system_prompt_key TEXT,
-            status TEXT DEFAULT 'Idle',
-            show_window INTEGER DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    try: cursor.execute('ALTER TABLE projects ADD COLUMN status TEXT DEFAULT "active"')
-    except: pass
-    try: cursor.execute('ALTER TABLE tasks ADD COLUMN description TEXT')
-    except: pass
-    try: cursor.execute('ALTER TABLE tasks ADD COLUMN success_criteria TEXT')
-    except: pass
-    try: cursor.execute('ALTER TABLE tasks ADD COLUMN is_failed INTEGER DEFAULT 0')
-    except: pass
-    try: cursor.execute('ALTER TABLE agents ADD COLUMN show_window INTEGER DEFAULT 0')
-    except: pass
-    try: cursor.execute('ALTER TABLE agents ADD COLUMN is_active INTEGER DEFAULT 0')
-    except: pass
-    try: cursor.execute('ALTER TABLE agents ADD COLUMN target_queues TEXT')
-    except: pass
-    try: cursor.execute('ALTER TABLE tasks ADD COLUMN review_count INTEGER DEFAULT 0')
-    except: pass
+    storage.init_schema(conn)
+    conn.commit()
+    conn.close()
+
+def reset_session_state():
+    # Only for the process that owns the backend (see acquire_backend_lock)
+    conn = get_db()
+    # A project left 'planning' was being generated when the app stopped
+    conn.execute("UPDATE projects SET status = 'active' WHERE status = 'planning'")
+    # Local runs of a previous session ended with its processes
+    agent_registry.reconcile(conn, local_only=True)
+    process_registry.clear(conn)
+    # Critical-path ranks for boards from before task_dependencies
+    storage.refresh_critical_paths(conn)
     conn.commit()
     conn.close()
 
 init_db()
+run_trace.configure(get_db)
+agent_registry.configure(get_db)
+process_registry.configure(get_db)
 
 @eel.expose
 def get_board_data():
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Get all tasks with project names and dependency info, filtering out completed projects
-    cursor.execute('''
-        SELECT t.*, p.name as project_name, p.working_dir,
-               dt.title as dependency_title, dt.is_complete as dep_is_complete
-        FROM tasks t 
-        JOIN projects p ON t.project_id = p.id
-        LEFT JOIN tasks dt ON t.dependency_id = dt.id
-        WHERE p.status != 'completed'
-    ''')
-    rows = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+    # Tasks of the projects that aren't completed, with their parents
+    store = get_store()
+    try:
+        rows = store.board_tasks()
+    finally:
+        store.close()
     
     # Calculate statuses
     tasks = []
@@ -114,7 +102,16 @@ def get_board_data():
         status = 'todo'
         
         # Check dependencies
-        if t['dependency_id'] and not t['dep_is_complete']:
+        deps = t.pop('dependencies')
+        open_deps = [d for d in deps if not d['is_complete']]
+        t['dependency_ids'] = [d['id'] for d in deps]
+        # Shown on the card: the blockers, or the (complete) parents
+        shown = open_deps or deps
+        t['dependency_title'] = None
+        if shown:
+            t['dependency_title'] = shown[0]['title'] + (f" (+{len(shown) - 1} more)" if len(shown) > 1 else "")
+        t['dep_is_complete'] = 0 if open_deps else 1
+        if open_deps:
             status = 'backlog'
             
         # Overrides (Order: inprogress, review, complete)
@@ -132,167 +129,176 @@ def get_board_data():
 
 @eel.expose
 def get_projects():
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Get projects with stats
-    cursor.execute('''
-        SELECT p.*,
-               COUNT(t.id) as total_tasks,
-               SUM(CASE WHEN t.is_complete = 1 THEN 1 ELSE 0 END) as completed_tasks
-        FROM projects p
-        LEFT JOIN tasks t ON p.id = t.project_id
-        GROUP BY p.id
-        ORDER BY p.created_at DESC
-    ''')
-    
-    projects = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+    # Projects with stats, newest first
+    store = get_store()
+    try:
+        projects = store.list_projects(stats=True)
+    finally:
+        store.close()
+    projects.sort(key=lambda p: (p['created_at'] or '', p['id']), reverse=True)
     return projects
 
 @eel.expose
-def update_project(project_id, name, description, working_dir, status):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE projects
-        SET name = ?, description = ?, working_dir = ?, status = ?
-        WHERE id = ?
-    ''', (name, description, working_dir, status, project_id))
-    conn.commit()
-    conn.close()
+def update_project(project_id, name, description, working_dir, status, weight=None):
+    fields = {"name": name, "description": description, "working_dir": working_dir, "status": status}
+    if weight is not None:
+        # Fair-share weight of this project against the others
+        fields["weight"] = float(weight)
+    store = get_store()
+    try:
+        store.update_project(project_id, **fields)
+    finally:
+        store.close()
     return True
 
 @eel.expose
 def delete_project(project_id):
-    conn = get_db()
-    cursor = conn.cursor()
-    # Delete tasks first (foreign key might cascade but let's be safe)
-    cursor.execute('DELETE FROM tasks WHERE project_id = ?', (project_id,))
-    cursor.execute('DELETE FROM projects WHERE id = ?', (project_id,))
-    conn.commit()
-    conn.close()
+    store = get_store()
+    try:
+        # Stop the project's runs before their tasks disappear
+        running = [t['id'] for t in store.list_tasks(project_id) if t['is_inprogress']]
+        agent_registry.finished(store.conn, running)
+        process_registry.cancel(store.conn, running, "deleted")
+        store.delete_project(project_id)
+    finally:
+        store.close()
+    fair_share.forget(project_id)
     return True
 
-def check_and_update_project_completion(project_id):
-    if not project_id: return
-    
+@eel.expose
+def archive_project(project_id, force=False):
+    """
+    Move a completed project (tasks, feedback and all) out of the hot tables.
+    """
     conn = get_db()
-    cursor = conn.cursor()
-    
-    # Check if ANY task is incomplete
-    cursor.execute('SELECT COUNT(*) FROM tasks WHERE project_id = ? AND is_complete = 0', (project_id,))
-    incomplete_count = cursor.fetchone()[0]
-    
-    new_status = 'active'
-    if incomplete_count == 0:
-        # Check if there are ANY tasks at all (don't autocomplete empty projects?)
-        cursor.execute('SELECT COUNT(*) FROM tasks WHERE project_id = ?', (project_id,))
-        total = cursor.fetchone()[0]
-        if total > 0:
-            new_status = 'completed'
-            
-    # Update project status
-    # We only update if it changed to avoid redundant writes/logs, though SQL handles it fine.
-    # But strictly: If all complete -> Completed. If Any incomplete -> Active.
-    cursor.execute('UPDATE projects SET status = ? WHERE id = ?', (new_status, project_id))
-    conn.commit()
-    conn.close()
+    try:
+        row = conn.execute('SELECT status FROM projects WHERE id = ?', (project_id,)).fetchone()
+        if row and row['status'] != 'completed' and not force:
+            return {"success": False, "message": "Only completed projects can be archived"}
+        result = archive.archive_project(conn, project_id)
+        if result.get("success"):
+            fair_share.forget(project_id)
+        return result
+    except Exception as e:
+        print(f"Error archiving project: {e}")
+        return {"success": False, "message": str(e)}
+    finally:
+        conn.close()
+
+@eel.expose
+def restore_archived_project(project_id):
+    conn = get_db()
+    try:
+        return archive.restore_project(conn, project_id)
+    except Exception as e:
+        print(f"Error restoring project: {e}")
+        return {"success": False, "message": str(e)}
+    finally:
+        conn.close()
+
+@eel.expose
+def archive_completed_projects(older_than_days=0):
+    conn = get_db()
+    try:
+        archived = archive.archive_completed_projects(conn, older_than_days)
+        for project_id in archived:
+            fair_share.forget(project_id)
+        return {"success": True, "archived": archived}
+    finally:
+        conn.close()
+
+@eel.expose
+def get_archived_projects():
+    conn = get_db()
+    try:
+        return archive.list_archived_projects(conn)
+    finally:
+        conn.close()
+
+@eel.expose
+def get_archived_project_tasks(project_id):
+    conn = get_db()
+    try:
+        return archive.get_archived_tasks(conn, project_id)
+    finally:
+        conn.close()
 
 @eel.expose
 def update_task_state_from_drag(task_id, new_status):
+    # Explicit drags override whatever state the task was in; the project's
+    # status is updated in the same transaction
     conn = get_db()
-    cursor = conn.cursor()
-    
-    # Get project_id for auto-complete check
-    cursor.execute('SELECT project_id FROM tasks WHERE id = ?', (task_id,))
-    row = cursor.fetchone()
-    project_id = row['project_id'] if row else None
-
-    # Reset all overrides
-    cursor.execute('''
-        UPDATE tasks 
-        SET is_inprogress = 0, is_review = 0, is_complete = 0, is_failed = 0
-        WHERE id = ?
-    ''', (task_id,))
-    
-    # If moving to review, maybe reset review count? Or keep it? keeping it is safer for history.
-    # If explicitly dragging, we assume user overrides state.
-    
-    # Set the appropriate override
-    if new_status == 'inprogress':
-        cursor.execute('UPDATE tasks SET is_inprogress = 1 WHERE id = ?', (task_id,))
-    elif new_status == 'review':
-        cursor.execute('UPDATE tasks SET is_review = 1 WHERE id = ?', (task_id,))
-    elif new_status == 'complete':
-        cursor.execute('UPDATE tasks SET is_complete = 1 WHERE id = ?', (task_id,))
-    elif new_status == 'triage':
-        cursor.execute('UPDATE tasks SET is_failed = 1 WHERE id = ?', (task_id,))
-        
-    conn.commit()
-    conn.close()
-    
-    # Auto-complete/activate project
-    if project_id:
-        check_and_update_project_completion(project_id)
-        
+    try:
+        row = conn.execute('SELECT is_inprogress FROM tasks WHERE id = ?', (task_id,)).fetchone()
+        task_state.transition(conn, task_id, "move", status=new_status)
+        if row and row[0] and new_status != "inprogress":
+            # Dragged out of In Progress: whatever runs it is abandoned work
+            agent_registry.finished(conn, [task_id])
+            process_registry.cancel(conn, [task_id], "moved")
+    except task_state.InvalidTransition as e:
+        return {"success": False, "message": str(e)}
+    finally:
+        conn.close()
     return True
 
 @eel.expose
-def update_task_details(task_id, title, description, success_criteria, dependency_id, is_inprogress, is_review, is_complete, is_failed, review_count):
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Get project_id for auto-complete check
-    cursor.execute('SELECT project_id FROM tasks WHERE id = ?', (task_id,))
-    row = cursor.fetchone()
-    project_id = row['project_id'] if row else None
-    
-    cursor.execute('''
-        UPDATE tasks 
-        SET title = ?, description = ?, success_criteria = ?, dependency_id = ?, 
-            is_inprogress = ?, is_review = ?, is_complete = ?, is_failed = ?, review_count = ?
-        WHERE id = ?
-    ''', (title, description, success_criteria, dependency_id if dependency_id else None, 
-          1 if is_inprogress else 0, 1 if is_review else 0, 1 if is_complete else 0, 1 if is_failed else 0,
-          review_count,
-          task_id))
-    conn.commit()
-    conn.close()
-    
-    # Auto-complete/activate project
-    if project_id:
-        check_and_update_project_completion(project_id)
+def update_task_details(task_id, title, description, success_criteria, dependency_id, is_inprogress, is_review, is_complete, is_failed, review_count, priority=None, checks=None):
+    # checks=None leaves them unchanged, an empty value clears them
+    if checks is not None:
+        try:
+            checks_json = verification.dump_checks(checks)
+        except ValueError as e:
+            return {"success": False, "message": str(e)}
+    # dependency_id may be one id or a list of ids (task_dependencies)
+    try:
+        depends_on_ids = dependencies.parse_ids(dependency_id)
+    except ValueError:
+        return {"success": False, "message": f"Invalid dependency {dependency_id!r}"}
+
+    fields = {"title": title, "description": description, "success_criteria": success_criteria, "review_count": review_count}
+    if priority is not None:
+        fields["priority"] = int(priority)
+    if checks is not None:
+        fields["checks"] = checks_json
+
+    store = get_store()
+    try:
+        store.set_dependencies(task_id, depends_on_ids)
+        store.update_task(task_id, **fields)
+        # The status checkboxes are a manual move; it also refreshes the project
+        status = task_state.status_from_flags(is_inprogress, is_review, is_complete, is_failed)
+        store.transition(task_id, "move", status=status)
+    except (dependencies.DependencyCycleError, task_state.InvalidTransition) as e:
+        return {"success": False, "message": str(e)}
+    finally:
+        store.close()
 
     return True
 
 @eel.expose
-def create_task(project_id, title, description="", success_criteria="", expand_with_ai=False):
+def create_task(project_id, title, description="", success_criteria="", expand_with_ai=False, priority=0, checks=None):
     """
     Create a new task manually. Optionally expand with AI to generate subtasks.
+    `checks` are optional machine-checkable criteria (see verification.py).
     """
     try:
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        # Validate project exists
-        cursor.execute('SELECT id, working_dir FROM projects WHERE id = ?', (project_id,))
-        project = cursor.fetchone()
-        if not project:
-            conn.close()
-            return {"success": False, "message": "Project not found"}
-        
-        working_dir = project['working_dir']
-        
-        # Create the main task
-        cursor.execute('''
-            INSERT INTO tasks (project_id, title, description, success_criteria)
-            VALUES (?, ?, ?, ?)
-        ''', (project_id, title, description, success_criteria))
-        
-        main_task_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        checks = verification.dump_checks(checks)
+    except ValueError as e:
+        return {"success": False, "message": str(e)}
+
+    try:
+        store = get_store()
+        try:
+            # Validate project exists
+            project = store.get_project(project_id)
+            if not project:
+                return {"success": False, "message": "Project not found"}
+            working_dir = project['working_dir']
+
+            # Create the main task
+            main_task_id = store.create_task(project_id, title, description, success_criteria, priority, checks=checks)
+        finally:
+            store.close()
         
         # If AI expansion requested, generate subtasks
         if expand_with_ai and description:
@@ -309,6 +315,83 @@ def create_task(project_id, title, description="", success_criteria="", expand_w
         print(f"Error creating task: {e}")
         return {"success": False, "message": str(e)}
 
+def _generate_subtasks(main_task, description, priority=PRIORITY_INTERACTIVE):
+    """
+    Asks the model to break one task down. Returns a list of subtask dicts, or None on failure.
+    """
+    # Use GeneratorAgent with a specialized prompt
+    agent = GeneratorAgent("TaskExpander", SYSTEM_PROMPTS["task_generator"])
+    agent.request_priority = priority
+    
+    expansion_prompt = f"""Analyze this task and break it down into concrete subtasks:
+
+Task Title: {main_task['title']}
+Description: {description}
+Success Criteria: {main_task.get('success_criteria', 'N/A')}
+
+Generate 3-7 specific subtasks that would be needed to complete this main task. Each subtask should be actionable and have clear success criteria.
+Use 'dependency_indices' (0-based, within the subtask list) only where a subtask really needs another one finished first, so independent subtasks can run in parallel."""
+    
+    # Generate subtasks
+    response_format = {"type": "json_object"}
+    agent.system_prompt = agent.system_prompt + "\nWrap your response in a json object with a 'tasks' key containing an array of subtasks."
+    result = agent.chat(expansion_prompt, response_format)
+    
+    if not result:
+        return None
+    
+    data = json.loads(result)
+    return data.get("tasks", [])
+
+def _insert_subtasks(cursor, main_task, subtasks):
+    # Subtasks may depend on each other (dependency_indices); those that
+    # don't depend on a sibling wait for the main task
+    created_subtasks = []
+    for subtask_data in subtasks:
+        cursor.execute('''
+            INSERT INTO tasks (project_id, title, description, success_criteria, checks)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (
+            main_task['project_id'],
+            subtask_data.get('title', 'Untitled Subtask'),
+            subtask_data.get('description', ''),
+            subtask_data.get('success_criteria', ''),
+            _generated_checks(subtask_data)
+        ))
+        created_subtasks.append(cursor.lastrowid)
+
+    _link_generated(cursor.connection, subtasks, created_subtasks, default_parent=main_task['id'])
+    dependencies.update_critical_path(cursor.connection, main_task['project_id'])
+    return created_subtasks
+
+def _generated_dependencies(task_data):
+    # 'dependency_indices': [0, 2] or the older single 'dependency_index': 0
+    indices = task_data.get('dependency_indices')
+    if indices is None:
+        indices = [task_data.get('dependency_index')]
+    if not isinstance(indices, list):
+        indices = [indices]
+    return [i for i in indices if isinstance(i, int)]
+
+def _sibling_dependencies(task_data, i):
+    # The usable dependency_indices of task_data[i]
+    return [j for j in _generated_dependencies(task_data[i]) if 0 <= j < len(task_data) and j != i]
+
+def _link_generated(conn, task_data, created_ids, default_parent=None):
+    """
+    Adds dependency edges between freshly generated tasks (indices into
+    task_data). Edges that are out of range or would form a cycle are skipped.
+    """
+    for i, t in enumerate(task_data):
+        parents = [created_ids[j] for j in _sibling_dependencies(task_data, i)]
+        if not parents and default_parent is not None:
+            parents = [default_parent]
+        for parent in parents:
+            try:
+                dependencies.add_dependency(conn, created_ids[i], parent)
+            except dependencies.DependencyCycleError as e:
+                print(f"Skipping generated dependency: {e}")
+
 @eel.expose
 def expand_task_with_ai(task_id, description, working_dir):
     """
@@ -322,47 +405,12 @@ def expand_task_with_ai(task_id, description, working_dir):
         cursor.execute('SELECT * FROM tasks WHERE id = ?', (task_id,))
         main_task = dict(cursor.fetchone())
         
-        # Use GeneratorAgent with a specialized prompt
-        agent = GeneratorAgent("TaskExpander", SYSTEM_PROMPTS["task_generator"])
-        
-        expansion_prompt = f"""Analyze this task and break it down into concrete subtasks:
-
-Task Title: {main_task['title']}
-Description: {description}
-Success Criteria: {main_task.get('success_criteria', 'N/A')}
-
-Generate 3-7 specific subtasks that would be needed to complete this main task. Each subtask should be actionable and have clear success criteria."""
-        
-        # Generate subtasks
-        response_format = {"type": "json_object"}
-        system_msg = agent.system_prompt + "\nWrap your response in a json object with a 'tasks' key containing an array of subtasks."
-        
-        original_prompt = agent.system_prompt
-        agent.system_prompt = system_msg
-        result = agent.chat(expansion_prompt, response_format)
-        agent.system_prompt = original_prompt
-        
-        if not result:
+        subtasks = _generate_subtasks(main_task, description)
+        if subtasks is None:
             conn.close()
             return {"success": False, "message": "AI generation failed"}
         
-        data = json.loads(result)
-        subtasks = data.get("tasks", [])
-        
-        # Create subtasks with dependency on main task
-        created_subtasks = []
-        for subtask_data in subtasks:
-            cursor.execute('''
-                INSERT INTO tasks (project_id, title, description, success_criteria, dependency_id)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (
-                main_task['project_id'],
-                subtask_data.get('title', 'Untitled Subtask'),
-                subtask_data.get('description', ''),
-                subtask_data.get('success_criteria', ''),
-                task_id  # All subtasks depend on the main task
-            ))
-            created_subtasks.append(cursor.lastrowid)
+        created_subtasks = _insert_subtasks(cursor, main_task, subtasks)
         
         conn.commit()
         conn.close()
@@ -374,10 +422,239 @@ Generate 3-7 specific subtasks that would be needed to complete this main task.
         return {"success": False, "message": str(e)}
 
 @eel.expose
-def generate_project_tasks(project_title, description, working_dir):
+def expand_tasks_with_ai(task_ids, max_concurrency=None):
+    """
+    Expand many tasks at once. Model calls run concurrently (at most
+    max_concurrency / EXPANSION_CONCURRENCY at a time, and still subject to the
+    shared rate limiter), progress is pushed to the UI as each one returns,
+    and all subtasks are inserted in a single transaction at the end.
+    """
+    try:
+        task_ids = [int(t) for t in task_ids]
+        if not task_ids:
+            return {"success": True, "results": {}, "subtasks_created": 0}
+        limit = int(max_concurrency or EXPANSION_CONCURRENCY)
+
+        conn = get_db()
+        cursor = conn.cursor()
+        placeholders = ','.join('?' for _ in task_ids)
+        cursor.execute(f'SELECT * FROM tasks WHERE id IN ({placeholders})', task_ids)
+        main_tasks = {row['id']: dict(row) for row in cursor.fetchall()}
+        conn.close()
+
+        results = {}
+        generated = {}
+        total = len(main_tasks)
+
+        with ThreadPoolExecutor(max_workers=max(1, min(limit, total or 1))) as executor:
+            futures = {
+                executor.submit(_generate_subtasks, t, t.get('description') or t['title'], PRIORITY_BATCH): task_id
+                for task_id, t in main_tasks.items()
+            }
+            for future in as_completed(futures):
+                task_id = futures[future]
+                try:
+                    subtasks = future.result()
+                    error = None if subtasks is not None else "AI generation failed"
+                except Exception as e:
+                    subtasks, error = None, str(e)
+
+                if subtasks is not None:
+                    generated[task_id] = subtasks
+                results[task_id] = {"success": error is None, "subtasks": len(subtasks or []), "message": error}
+
+                try:
+                    eel.expansionProgress({"task_id": task_id, "done": len(results), "total": total, **results[task_id]})
+                except Exception:
+                    pass
+
+        # One transaction for every subtask
+        conn = get_db()
+        cursor = conn.cursor()
+        created = 0
+        for task_id, subtasks in generated.items():
+            ids = _insert_subtasks(cursor, main_tasks[task_id], subtasks)
+            results[task_id]["subtask_ids"] = ids
+            created += len(ids)
+        conn.commit()
+        conn.close()
+
+        missing = [t for t in task_ids if t not in main_tasks]
+        for task_id in missing:
+            results[task_id] = {"success": False, "subtasks": 0, "message": "Task not found"}
+
+        return {"success": True, "results": results, "subtasks_created": created}
+
+    except Exception as e:
+        print(f"Error expanding tasks with AI: {e}")
+        return {"success": False, "message": str(e)}
+
+def _generated_checks(task_data):
+    # Model-suggested checks are kept only if they are well formed, and only
+    # the file checks: commands would run unreviewed on this machine
     try:
+        return verification.dump_checks(task_data.get('checks'), authored=False)
+    except ValueError as e:
+        print(f"Ignoring generated checks for {task_data.get('title')}: {e}")
+        return None
+
+def _insert_generated(cursor, project_id, task_data):
+    # Generated tasks and the dependencies among them; returns their ids
+    created_ids = []
+    for t in task_data:
+        cursor.execute('''
+            INSERT INTO tasks (project_id, title, description, success_criteria, checks) 
+            VALUES (?, ?, ?, ?, ?)
+        ''', (project_id, t.get('title', 'Untitled Task'), t.get('description'), t.get('success_criteria'), _generated_checks(t)))
+        created_ids.append(cursor.lastrowid)
+    _link_generated(cursor.connection, task_data, created_ids)
+    return created_ids
+
+def _generate_epics(project_title, description, working_dir):
+    """
+    First level of hierarchical generation: the project split into epics.
+    Returns a list of epic dicts, or None on failure.
+    """
+    agent = GeneratorAgent("EpicPlanner", SYSTEM_PROMPTS["epic_planner"])
+    agent.request_priority = PRIORITY_INTERACTIVE
+    agent.system_prompt = agent.system_prompt + "\nWrap your response in a json object with an 'epics' key."
+    result = agent.chat(f"Project Title: {project_title}\nProject Context/Description: {description}\nWorking Directory: {working_dir}",
+                        {"type": "json_object"})
+    if not result:
+        return None
+    epics = json.loads(result).get("epics")
+    return [e for e in epics if isinstance(e, dict) and e.get('title')] if isinstance(epics, list) else None
+
+def _generate_epic_tasks(project_title, description, working_dir, epics, index):
+    """
+    Second level: the tasks of epics[index]. Returns a list of task dicts, or None on failure.
+    """
+    epic = epics[index]
+    agent = GeneratorAgent("EpicExpander", SYSTEM_PROMPTS["task_generator"])
+    agent.request_priority = PRIORITY_INTERACTIVE
+    agent.system_prompt = agent.system_prompt + "\nWrap your response in a json object with a 'tasks' key."
+
+    outline = "\n".join(f"{i}. {e['title']}" for i, e in enumerate(epics))
+    prerequisites = ", ".join(epics[j]['title'] for j in _sibling_dependencies(epics, index)) or "none"
+    # Project first and the epic last, so the calls for all epics share a prefix
+    prompt = f"""Project Title: {project_title}
+Project Context/Description: {description}
+Working Directory: {working_dir}
+
+The project is split into these epics, each broken down into tasks separately:
+{outline}
+
+Break down epic {index} into tasks:
+Epic Title: {epic['title']}
+Description: {epic.get('description', '')}
+Success Criteria: {epic.get('success_criteria', 'N/A')}
+Builds on: {prerequisites}
+
+Only generate tasks for this epic; the epics it builds on are done before it starts.
+Use 'dependency_indices' (0-based, within this epic's task list) only where a task really needs another one finished first."""
+
+    result = agent.chat(prompt, {"type": "json_object"})
+    if not result:
+        return None
+    return json.loads(result).get("tasks")
+
+def _link_epics(conn, epics, epic_tasks, epic_task_ids):
+    """
+    Cross-epic dependencies, once every epic is in: the first tasks of an epic
+    (no dependency inside it) wait for the last tasks (nothing inside depends
+    on them) of each epic it depends on.
+    """
+    for i, epic in enumerate(epics):
+        data = epic_tasks.get(i)
+        if not data:
+            continue
+        first = [epic_task_ids[i][k] for k in range(len(data)) if not _sibling_dependencies(data, k)]
+        for j in _sibling_dependencies(epics, i):
+            if not epic_tasks.get(j):
+                continue
+            depended_on = {d for k in range(len(epic_tasks[j])) for d in _sibling_dependencies(epic_tasks[j], k)}
+            last = [task_id for k, task_id in enumerate(epic_task_ids[j]) if k not in depended_on]
+            for task_id in first:
+                for parent in last:
+                    try:
+                        dependencies.add_dependency(conn, task_id, parent)
+                    except dependencies.DependencyCycleError as e:
+                        print(f"Skipping cross-epic dependency: {e}")
+
+def _generate_hierarchical(project_title, description, working_dir, max_concurrency=None):
+    """
+    Plans a large project in two levels: one call for the epics, then one call
+    per epic for its tasks, run concurrently (at most max_concurrency /
+    EXPANSION_CONCURRENCY at a time, under the shared rate limiter). Each
+    epic's tasks are saved as soon as they arrive; the project stays
+    'planning' (ignored by the scheduler) until the dependencies between
+    epics are added at the end.
+    """
+    epics = _generate_epics(project_title, description, working_dir)
+    if not epics:
+        return False
+    limit = int(max_concurrency or EXPANSION_CONCURRENCY)
+    print(f"Planning {project_title!r} as {len(epics)} epics")
+
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO projects (name, description, working_dir, status) VALUES (?, ?, ?, 'planning')",
+                   (project_title, description, working_dir))
+    project_id = cursor.lastrowid
+    conn.commit()
+
+    epic_tasks, epic_task_ids = {}, {}
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(limit, len(epics)))) as executor:
+            futures = {
+                executor.submit(_generate_epic_tasks, project_title, description, working_dir, epics, i): i
+                for i in range(len(epics))
+            }
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    tasks = future.result()
+                except Exception as e:
+                    print(f"Error expanding epic {epics[i]['title']!r}: {e}")
+                    tasks = None
+                if not tasks:
+                    # Keep the epic on the board as one task rather than lose it
+                    print(f"Epic {epics[i]['title']!r} wasn't expanded; adding it as a single task.")
+                    tasks = [{k: epics[i].get(k) for k in ('title', 'description', 'success_criteria')}]
+
+                epic_tasks[i] = tasks
+                epic_task_ids[i] = _insert_generated(cursor, project_id, tasks)
+                conn.commit()
+                try:
+                    eel.generationProgress({"project_id": project_id, "epic": epics[i]['title'],
+                                            "tasks": len(tasks), "done": len(epic_tasks), "total": len(epics)})
+                except Exception:
+                    pass
+
+        _link_epics(conn, epics, epic_tasks, epic_task_ids)
+    finally:
+        cursor.execute("UPDATE projects SET status = 'active' WHERE id = ?", (project_id,))
+        dependencies.update_critical_path(conn, project_id)
+        conn.commit()
+        conn.close()
+    return True
+
+@eel.expose
+def generate_project_tasks(project_title, description, working_dir, hierarchical=None):
+    """
+    Creates a project and its tasks from a description. Descriptions longer
+    than GENERATION_EPIC_THRESHOLD (or hierarchical=True) are planned epic
+    by epic, see _generate_hierarchical.
+    """
+    try:
+        if hierarchical is None:
+            hierarchical = len(description or "") > GENERATION_EPIC_THRESHOLD
+        if hierarchical:
+            return _generate_hierarchical(project_title, description, working_dir)
+
         # Use the GeneratorAgent automatically
         agent = GeneratorAgent("AutoGenerator", SYSTEM_PROMPTS["task_generator"])
+        agent.request_priority = PRIORITY_INTERACTIVE
         data = agent.generate_tasks(project_title, description, working_dir)
         
         if not data:
@@ -394,24 +671,9 @@ def generate_project_tasks(project_title, description, working_dir):
                        (project_title, description, working_dir))
         project_id = cursor.lastrowid
         
-        # 2. Create Tasks (First Pass: Create basic records)
-        temp_id_to_real_id = {}
-        batch_tasks = []
-        for i, t in enumerate(task_data):
-            cursor.execute('''
-                INSERT INTO tasks (project_id, title, description, success_criteria) 
-                VALUES (?, ?, ?, ?)
-            ''', (project_id, t['title'], t.get('description'), t.get('success_criteria')))
-            real_id = cursor.lastrowid
-            temp_id_to_real_id[i] = real_id
-            batch_tasks.append({**t, "id": real_id})
-            
-        # 3. Update Dependencies
-        for i, t in enumerate(batch_tasks):
-            dep_idx = t.get("dependency_index")
-            if dep_idx is not None and dep_idx in temp_id_to_real_id:
-                dep_real_id = temp_id_to_real_id[dep_idx]
-                cursor.execute('UPDATE tasks SET dependency_id = ? WHERE id = ?', (dep_real_id, t["id"]))
+        # 2. Tasks and their dependencies, then critical-path ranks
+        _insert_generated(cursor, project_id, task_data)
+        dependencies.update_critical_path(conn, project_id)
             
         conn.commit()
         conn.close()
@@ -422,46 +684,122 @@ def generate_project_tasks(project_title, description, working_dir):
         return False
 
 @eel.expose
-def get_agents():
+def add_task_dependency(task_id, depends_on_id):
+    """
+    Makes task_id wait for depends_on_id (a task can have several). Refused if
+    it would create a cycle.
+    """
+    store = get_store()
+    try:
+        # A new edge only changes the new parent and its ancestors
+        store.add_dependency(task_id, depends_on_id)
+        return {"success": True}
+    except ValueError as e:
+        return {"success": False, "message": str(e)}
+    finally:
+        store.close()
+
+@eel.expose
+def remove_task_dependency(task_id, depends_on_id):
+    store = get_store()
+    try:
+        store.set_dependencies(task_id, [d for d in store.get_dependencies(task_id) if d != int(depends_on_id)])
+        return {"success": True}
+    finally:
+        store.close()
+
+@eel.expose
+def export_board(path, project_ids=None):
+    """
+    Stream projects, tasks and agents to a JSON Lines file.
+    """
     conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM agents ORDER BY created_at DESC')
-    rows = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+    try:
+        with open(path, "w", encoding="utf-8") as f:
+            counts = board_io.export_board(conn, f, project_ids)
+        return {"success": True, "counts": counts}
+    except Exception as e:
+        print(f"Error exporting board: {e}")
+        return {"success": False, "message": str(e)}
+    finally:
+        conn.close()
+
+@eel.expose
+def import_board(path):
+    conn = get_db()
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            counts = board_io.import_board(conn, f)
+        storage.refresh_critical_paths(conn)
+        conn.commit()
+        return {"success": True, "counts": counts}
+    except Exception as e:
+        print(f"Error importing board: {e}")
+        return {"success": False, "message": str(e)}
+    finally:
+        conn.close()
+
+@eel.expose
+def get_agents():
+    store = get_store()
+    try:
+        rows = store.list_agents()
+        # Current runs, busy/idle time and throughput (agent_registry.py)
+        activity = agent_registry.snapshot(store.conn)
+    finally:
+        store.close()
+    rows.sort(key=lambda a: (a['created_at'] or '', a['id']), reverse=True)
+    for row in rows:
+        row['activity'] = activity.get(row['id'])
     return rows
 
 @eel.expose
 def create_agent(name, role, system_prompt_key, show_window):
-    conn = get_db()
-    cursor = conn.cursor()
-    
     # Default queues based on role
-    default_queues = "[]"
+    default_queues = []
     if role == "CodingAgent":
-        default_queues = '["todo"]'
+        default_queues = ["todo"]
     elif role == "ReviewerAgent":
-        default_queues = '["review"]'
-        
-    cursor.execute('''
-        INSERT INTO agents (name, role, system_prompt_key, show_window, is_active, target_queues) 
-        VALUES (?, ?, ?, ?, 0, ?)
-    ''', (name, role, system_prompt_key, 1 if show_window else 0, default_queues))
-    conn.commit()
-    conn.close()
+        default_queues = ["review"]
+
+    store = get_store()
+    try:
+        store.create_agent(name, role, system_prompt_key, target_queues=default_queues, is_active=False, show_window=show_window)
+    finally:
+        store.close()
     return True
 
 @eel.expose
 def delete_agent(agent_id):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM agents WHERE id = ?', (agent_id,))
-    conn.commit()
-    conn.close()
+    store = get_store()
+    try:
+        store.delete_agent(agent_id)
+    finally:
+        store.close()
     return True
 
+@eel.expose
+def search(query, page=1, page_size=20, kinds=None):
+    """
+    Full-text search over tasks, projects and reviewer feedback.
+    Snippets mark matches with <mark>…</mark>.
+    """
+    conn = get_db()
+    try:
+        return search_index.search(conn, query, page, page_size, kinds)
+    except Exception as e:
+        print(f"Search error: {e}")
+        return {"results": [], "total": 0, "page": page, "page_size": page_size, "message": str(e)}
+    finally:
+        conn.close()
+
+@eel.expose
+def get_rate_limiter_stats():
+    return get_limiter().get_stats()
+
 @eel.expose
 def get_available_prompts():
-    return list(SYSTEM_PROMPTS.keys())
+    return [key for key in SYSTEM_PROMPTS if key not in INTERNAL_PROMPTS]
 
 @eel.expose
 def get_agent_classes():
@@ -469,57 +807,136 @@ def get_agent_classes():
 
 import subprocess
 import sys
+import urllib.request
+from worker_pool import WorkerPool, POOL_SIZE
 
-# ... (existing imports)
-
-def monitor_process(process, task_id, agent_name):
+def monitor_process(process, task_id, agent_name, launched_at=None):
     print(f"DEBUG: Monitoring process for Agent {agent_name} (Task {task_id})")
     process.wait()
     print(f"DEBUG: Process Agent {agent_name} finished. Triggering refresh.")
+    process_registry.unregister(process)
+    # A window closed mid-run leaves its opencode behind (own process group)
+    agent_runner.stop_orphans(process.pid)
     # Brief pause to ensure DB lock is released if any
     time.sleep(0.5) 
-    
-    # Auto-complete check after process finishes (since it might have updated DB externally? 
-    # No, external process updates DB directly likely? 
-    # If agent_runner.py uses same DB, yes.
-    # But wait, agent_runner.py DOES NOT update DB for success/fail?
-    # Actually, let's check `run_task_agent` logic. 
-    # If running in separate window, `agent_runner.py` is responsible for updates?
-    # I need to check agent_runner.py.
-    # BUT, `run_task_agent` also has in-process logic.
-    
+    on_run_finished(task_id, started_at=launched_at)
+
+def launch_runner_window(task_ids, agent_id):
+    """
+    Starts agent_runner.py for `task_ids` in a console window of its own and
+    in its own process group, registered so cancel_task can stop it.
+    Returns the process.
+    """
+    task_ids = task_ids if isinstance(task_ids, (list, tuple)) else [task_ids]
+    # CREATE_NEW_CONSOLE = 0x00000010 (Windows only)
+    process = subprocess.Popen(
+        [sys.executable, 'agent_runner.py', ",".join(str(t) for t in task_ids), str(agent_id)],
+        close_fds=True,
+        **process_registry.popen_kwargs(creationflags=16)
+    )
+    process_registry.register(task_ids, process, kind="runner")
+    return process
+
+def on_run_finished(task_id, reply=None, started_at=None):
+    # A window or pool run ended (or crashed): its agent is free again, unless
+    # the task was cancelled and is already running again elsewhere
     conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT project_id FROM tasks WHERE id = ?', (task_id,))
-    row = cursor.fetchone()
-    project_id = row['project_id'] if row else None
-    conn.close()
-    
-    if project_id:
-        check_and_update_project_completion(project_id)
+    try:
+        agent_registry.finished(conn, task_id, started_before=started_at)
+        conn.commit()
+    except Exception as e:
+        print(f"Error updating agent activity: {e}")
+    finally:
+        conn.close()
+    on_external_task_finished(task_id, reply)
 
+def on_external_task_finished(task_id, reply=None):
+    # agent_runner.py (window or pool worker) has already written the task result
+    # and the project status to the DB (task_state.py); we only refresh the UI.
     try:
         eel.refreshBoardFromBackend()
     except Exception as e:
         print(f"Error triggering frontend refresh: {e}")
 
+_worker_pool = None
+_worker_pool_lock = threading.Lock()
+
+def get_worker_pool():
+    """
+    Returns the shared WorkerPool, or None if AGENT_POOL_SIZE is 0.
+    """
+    global _worker_pool
+    if POOL_SIZE <= 0:
+        return None
+    with _worker_pool_lock:
+        if _worker_pool is None:
+            _worker_pool = WorkerPool(on_task_done=on_run_finished)
+            _worker_pool.start()
+    return _worker_pool
+
 @eel.expose
-def run_task_agent(task_id, agent_id=None):
+def get_worker_pool_stats():
+    pool = get_worker_pool()
+    if not pool:
+        return {"size": 0, "queued": 0, "workers": []}
+    return pool.stats()
+
+# --- Remote workers (agent_runner.py --remote, see coordinator.py) ---
+
+@eel.expose
+def remote_claim(worker_id, agent_id):
     conn = get_db()
-    cursor = conn.cursor()
-    
-    # 1. Get Task
-    cursor.execute('SELECT * FROM tasks WHERE id = ?', (task_id,))
-    task = dict(cursor.fetchone())
-    project_id = task.get('project_id') # Save for later
-
-    # Get Project Working Directory
-    if task.get('project_id'):
-        cursor.execute('SELECT working_dir FROM projects WHERE id = ?', (task['project_id'],))
-        project_row = cursor.fetchone()
-        if project_row:
-            task['working_dir'] = project_row['working_dir']
-    
+    try:
+        result = coordinator.claim(conn, worker_id, agent_id)
+    finally:
+        conn.close()
+    if result.get("success"):
+        on_external_task_finished(result["task"]["id"])
+    return result
+
+@eel.expose
+def remote_heartbeat(lease_id, progress=None):
+    conn = get_db()
+    try:
+        return coordinator.heartbeat(conn, lease_id, progress)
+    finally:
+        conn.close()
+
+@eel.expose
+def remote_submit(lease_id, event, params=None, progress=None):
+    conn = get_db()
+    try:
+        result = coordinator.submit(conn, lease_id, event, params, progress)
+    finally:
+        conn.close()
+    if result.get("success"):
+        on_external_task_finished(result["task_id"])
+    return result
+
+@eel.expose
+def get_remote_workers():
+    conn = get_db()
+    try:
+        coordinator.expire_leases(conn)
+        return coordinator.list_leases(conn)
+    finally:
+        conn.close()
+
+@eel.expose
+def get_task_progress(task_id, after=0):
+    # Output streamed by the remote worker running the task, newest last
+    return coordinator.progress_log.since(task_id, int(after))
+
+@eel.expose
+def run_task_agent(task_id, agent_id=None):
+    store = get_store()
+
+    # 1. Get Task (with the project's working directory)
+    task = store.load_task(task_id)
+    if task is None:
+        store.close()
+        return {"success": False, "message": f"Task {task_id} not found."}
+
     # 2. Get Agent
     AGENT_CLASSES = {
         "CodingAgent": CodingAgent,
@@ -529,25 +946,36 @@ def run_task_agent(task_id, agent_id=None):
     
     agent = None
     if agent_id:
-        cursor.execute('SELECT * FROM agents WHERE id = ?', (agent_id,))
-        agent_data = dict(cursor.fetchone())
+        agent_data = store.load_agent(agent_id)
         class_name = agent_data.get('role', 'CodingAgent')
         AgentClass = AGENT_CLASSES.get(class_name, CodingAgent)
         agent = AgentClass(agent_data['name'], SYSTEM_PROMPTS.get(agent_data['system_prompt_key'], ""))
         # Explicitly set show_window from DB
         agent.show_window = bool(agent_data.get('show_window', 0))
+        agent.agent_id = agent_data['id']
     else:
+        class_name = "CodingAgent"
         agent = CodingAgent("Ralph", SYSTEM_PROMPTS.get("coding_agent", "You are a coding agent."))
         agent.show_window = False
 
-    conn.close()
+    store.close()
     
     try:
         # Mark In Progress
         conn = get_db()
-        conn.execute('UPDATE tasks SET is_inprogress = 1, is_failed = 0 WHERE id = ?', (task_id,))
-        conn.commit()
-        conn.close()
+        try:
+            task_state.transition(conn, task_id, "start")
+            agent_registry.started(conn, agent_id, [task_id])
+            conn.commit()
+        finally:
+            conn.close()
+        launched_at = time.time()
+
+        pool = get_worker_pool() if agent_id else None
+        if pool:
+            # Hand off to a warm worker process, returns immediately
+            pool.submit(task_id, agent_id)
+            return {"success": True, "message": f"Agent {agent.name} dispatched to worker pool."}
 
         if agent.show_window and agent_id:
              # Spawn separate window
@@ -555,18 +983,11 @@ def run_task_agent(task_id, agent_id=None):
              # cmd /c allows window to close, but we want to track the process. 
              # On Windows, we can use creationflags to open a new console.
              try:
-                 # CREATE_NEW_CONSOLE = 0x00000010
-                 CREATE_NEW_CONSOLE = 16
-                 
                  # Launch agent_runner directly with python
-                 process = subprocess.Popen(
-                     [sys.executable, 'agent_runner.py', str(task_id), str(agent_id)],
-                     creationflags=CREATE_NEW_CONSOLE,
-                     close_fds=True
-                 )
+                 process = launch_runner_window(task_id, agent_id)
                  
                  # Helper thread to wait for process exit and trigger refresh
-                 thread = threading.Thread(target=monitor_process, args=(process, task_id, agent.name))
+                 thread = threading.Thread(target=monitor_process, args=(process, task_id, agent.name, launched_at))
                  thread.daemon = True
                  thread.start()
                  
@@ -576,191 +997,451 @@ def run_task_agent(task_id, agent_id=None):
                  # We'll return error so UI shows it (if UI shows result).
                  return {"success": False, "message": f"Launch Error: {e}"}
         else:
-            # Run In-Process
+            # Run In-Process, on the code a remote worker pushed for it if any
+            conn = get_db()
+            try:
+                coordinator.sync_local_checkout(conn, task)
+            finally:
+                conn.close()
             result = agent.work_on_task(task)
-            
+
+            # Same transitions as agent_runner.py; project status included.
+            # A cancelled run's task and agent were already taken back.
+            if result.get("cancelled") or process_registry.cancelled_tasks(task_id, launched_at):
+                return {**result, "success": False, "cancelled": True}
             conn = get_db()
-            
-            if result['success']:
-                # Success Logic
-                if class_name == "ReviewerAgent":
-                    # Review passed!
-                    conn.execute('UPDATE tasks SET is_inprogress = 0, is_review = 0, is_complete = 1, is_failed = 0 WHERE id = ?', (task_id,))
-                else:
-                    # Coding Agent success -> Review
-                    conn.execute('UPDATE tasks SET is_inprogress = 0, is_review = 1, is_failed = 0 WHERE id = ?', (task_id,))
-            else:
-                # Failure Logic
-                if class_name == "ReviewerAgent":
-                    # Review failed!
-                    current_reviews = task.get('review_count', 0)
-                    if current_reviews is None: current_reviews = 0
-                    
-                    new_count = current_reviews + 1
-                    max_reviews = int(os.getenv("MAX_REVIEW_ATTEMPTS", 3))
-                    
-                    if new_count >= max_reviews:
-                        print(f"Task {task_id} failed review {new_count} times. Marking as FAILED.")
-                        conn.execute('UPDATE tasks SET is_inprogress = 0, is_review = 0, is_complete = 0, is_failed = 1, review_count = ? WHERE id = ?', (new_count, task_id))
-                    else:
-                        print(f"Task {task_id} failed review {new_count}. Returning to TODO.")
-                        # Append feedback to description or just rely on the output logging? 
-                        # Ideally we append to a log. For now, let's prepend to description so Coder sees it.
-                        feedback = result.get('message', 'Review Failed')
-                        new_desc = f"__REVIEW FEEDBACK ({new_count})__:\n{feedback}\n\n" + (task['description'] or "")
-                        conn.execute('UPDATE tasks SET is_inprogress = 0, is_review = 0, is_complete = 0, is_failed = 0, review_count = ?, description = ? WHERE id = ?', 
-                                    (new_desc, task_id))
-                
-                else:
-                    # Coding Agent failed (fatal error in loop)
-                    conn.execute('UPDATE tasks SET is_inprogress = 0, is_failed = 1 WHERE id = ?', (task_id,))
-                
-            conn.commit()
-            conn.close()
-            
-            # Check for project completion (In-Process)
-            if project_id:
-                check_and_update_project_completion(project_id)
-                
+            try:
+                agent_runner.apply_result(conn, task, class_name, result)
+                agent_registry.finished(conn, [task_id])
+                conn.commit()
+            finally:
+                conn.close()
             return result
 
     except Exception as e:
         print(f"Agent Execution Error: {e}")
         conn = get_db()
-        conn.execute('UPDATE tasks SET is_inprogress = 0, is_failed = 1 WHERE id = ?', (task_id,))
+        try:
+            task_state.try_transition(conn, task_id, "fail")
+            agent_registry.finished(conn, [task_id])
+            conn.commit()
+        finally:
+            conn.close()
+        return {"success": False, "message": str(e)}
+
+@eel.expose
+def run_review_batch_agent(task_ids, agent_id):
+    """
+    Reviews several review-ready tasks of one project in a single reviewer
+    session. Dispatched like run_task_agent: worker pool, window or in-process.
+    """
+    task_ids = [int(t) for t in task_ids]
+    store = get_store()
+    conn = store.conn
+    agent_data = store.load_agent(agent_id)
+    if not agent_data or not task_ids:
+        conn.close()
+        return {"success": False, "message": f"Agent {agent_id} not found or no tasks given."}
+
+    # Mark In Progress
+    try:
+        task_state.apply_transitions(conn, [(t, "start") for t in task_ids])
+        agent_registry.started(conn, agent_id, task_ids)
         conn.commit()
+    finally:
         conn.close()
+    launched_at = time.time()
+
+    try:
+        pool = get_worker_pool()
+        if pool:
+            pool.submit(task_ids, agent_id)
+            return {"success": True, "message": f"Agent {agent_data['name']} dispatched to worker pool with {len(task_ids)} reviews."}
+
+        if agent_data.get('show_window'):
+            process = launch_runner_window(task_ids, agent_id)
+            thread = threading.Thread(target=monitor_process, args=(process, task_ids, agent_data['name'], launched_at))
+            thread.daemon = True
+            thread.start()
+            return {"success": True, "message": f"Agent {agent_data['name']} started in new window with {len(task_ids)} reviews."}
+
+        # Run In-Process
+        conn = get_db()
+        try:
+            result = agent_runner.run_review_batch(task_ids, agent_id, conn=conn, show_window=False)
+        finally:
+            conn.close()
+        on_run_finished(task_ids, started_at=launched_at)
+        return result
+
+    except Exception as e:
+        print(f"Batch Review Error: {e}")
+        conn = get_db()
+        try:
+            task_state.apply_transitions(conn, [(t, "fail") for t in task_ids])
+            agent_registry.finished(conn, task_ids)
+            conn.commit()
+        finally:
+            conn.close()
         return {"success": False, "message": str(e)}
 
+def _claim_review_batch(conn, agent, task_id):
+    """
+    For reviewer agents with REVIEW_BATCH_SIZE > 1: claims further review-ready
+    tasks of the same project to go with the already claimed `task_id`.
+    """
+    if REVIEW_BATCH_SIZE <= 1 or agent.get('role') != "ReviewerAgent":
+        return [task_id]
+    cursor = conn.cursor()
+    cursor.execute('SELECT is_review FROM tasks WHERE id = ?', (task_id,))
+    row = cursor.fetchone()
+    if not row or not row['is_review']:
+        return [task_id]
+
+    # Candidates another agent took meanwhile are skipped
+    claims = task_state.apply_transitions(conn, [(c, "claim_review") for c in pick_review_batch(conn, task_id)[1:]])
+    return [task_id] + [c["task_id"] for c in claims if c["success"]]
+
+def _take_back(task_ids, reason, status=None):
+    """
+    Takes running tasks away from their agents: back to the queue they came
+    from (or to `status`), agents freed, processes stopped (process_registry.py).
+    """
+    task_ids = [int(t) for t in task_ids]
+    if status:
+        transitions = [(t, "move", {"status": status}) for t in task_ids]
+    else:
+        transitions = [(t, "release") for t in task_ids]
+    conn = get_db()
+    try:
+        results = task_state.apply_transitions(conn, transitions, commit=False)
+        taken = [r["task_id"] for r in results if r["success"]]
+        if not taken:
+            conn.rollback()
+            return {"success": False, "message": results[0]["message"] if results else "No tasks given."}
+        agent_registry.finished(conn, taken)
+        stopped = process_registry.cancel(conn, taken, reason)
+    finally:
+        conn.close()
+    on_external_task_finished(taken[0])
+    return {"success": True, "task_ids": taken, "stopped": stopped,
+            "message": f"Task {', '.join(str(t) for t in taken)} {reason} ({stopped} process(es) stopped)."}
+
+@eel.expose
+def cancel_task(task_id, status=None):
+    """
+    Stops the run working on a task, whole process tree included, and puts
+    the task back in its queue, or in `status` (e.g. "triage").
+    """
+    return _take_back([task_id], "cancelled", status)
+
+@eel.expose
+def preempt_task(task_id):
+    """
+    Stops a running task to free its agent for other work. The task goes back
+    to its queue with its rank, and is picked up again like any other.
+    """
+    return _take_back([task_id], "preempted")
+
+def _preempt_for_waiting_work(conn, agent_id=None):
+    # PREEMPT_PRIORITY_GAP: stop runs that better-ranked waiting work should have
+    preempted = False
+    for run_agent_id, task_ids, waiting_id in preemption_candidates(conn):
+        if agent_id is not None and run_agent_id != agent_id:
+            continue
+        print(f"Preempting tasks {task_ids} of agent {run_agent_id}: task {waiting_id} ranks well ahead.")
+        preempted = _take_back(task_ids, "preempted").get("success") or preempted
+    return preempted
+
+@eel.expose
+def get_agent_processes():
+    # Local processes working on tasks (runner windows and opencode sessions)
+    conn = get_db()
+    try:
+        return process_registry.list_processes(conn)
+    finally:
+        conn.close()
+
 @eel.expose
 def update_agent_config(agent_id, is_active, target_queues):
     # target_queues should be a JSON string list of statuses
-    conn = get_db()
-    conn.execute('UPDATE agents SET is_active = ?, target_queues = ? WHERE id = ?', 
-                 (1 if is_active else 0, target_queues, agent_id))
-    conn.commit()
-    conn.close()
+    store = get_store()
+    try:
+        store.update_agent(agent_id, is_active=1 if is_active else 0, target_queues=target_queues)
+    finally:
+        store.close()
     return True
 
 @eel.expose
 def edit_agent(agent_id, name, role, system_prompt_key, show_window, target_queues):
-    conn = get_db()
-    conn.execute('''
-        UPDATE agents 
-        SET name = ?, role = ?, system_prompt_key = ?, show_window = ?, target_queues = ?
-        WHERE id = ?
-    ''', (name, role, system_prompt_key, 1 if show_window else 0, target_queues, agent_id))
-    conn.commit()
-    conn.close()
+    store = get_store()
+    try:
+        store.update_agent(agent_id, name=name, role=role, system_prompt_key=system_prompt_key,
+                           show_window=1 if show_window else 0, target_queues=target_queues)
+    finally:
+        store.close()
     return True
 
 @eel.expose
 def agent_find_work(agent_id):
-    conn = get_db()
-    cursor = conn.cursor()
-    
+    store = get_store()
+    conn = store.conn
+
     # 1. Get Agent Config
-    cursor.execute('SELECT * FROM agents WHERE id = ?', (agent_id,))
-    agent_row = cursor.fetchone()
-    if not agent_row:
-        conn.close()
+    agent = store.load_agent(agent_id)
+    if not agent:
+        store.close()
         return False
-        
-    agent = dict(agent_row)
     
     # If not active, do nothing
-    if not agent.get('is_active'):
-        conn.close()
+    if not agent.is_active:
+        store.close()
         return False
         
     # Get Queues
-    try:
-        queues = json.loads(agent.get('target_queues') or "[]")
-    except:
-        queues = []
-        
+    queues = agent.queues
     if not queues:
-        conn.close()
+        store.close()
         return False
         
-    # 2. Find eligible task (FIFO)
-    # Status match AND no one else working on it (is_inprogress=0)
-    # strict status match based on our override logic
-    
-    # We need to construct a query that checks matches.
-    # Since our status logic is complex (computed), we might filter in python or do a complex query.
-    # Complex query is better for concurrency but we are single user.
-    # Let's do a simple query for candidates then filter.
-    
-    placeholders = ','.join('?' for _ in queues)
-    query = f'''
-        SELECT * FROM tasks 
-        WHERE is_inprogress = 0 
-        AND is_review = 0 
-        AND is_complete = 0 
-        AND is_failed = 0
-    '''
-    
-    # We need to adapt the query based on what "queue" means.
-    # "todo" -> default state (all 0s, and dep met)
-    # "review" -> is_review=1
-    # "triage" -> is_failed=1
-    # "inprogress" -> usually agent doesn't pick up inprogress unless resuming? Let's assume new work only.
-    
-    # Actually, simpler: Get ALL candidates that MIGHT be relevant, then use python helper to determine "status".
-    # Or, map queues to DB columns:
-    # 'review' -> is_review = 1
-    # 'triage' -> is_failed = 1
-    # 'todo' -> is_review=0 AND is_complete=0 AND is_failed=0 AND is_inprogress=0 (and deps met)
-    
-    candidates = []
-    
-    # If looking for review
-    if 'review' in queues:
-        cursor.execute('SELECT * FROM tasks WHERE is_review = 1 AND is_inprogress = 0')
-        candidates.extend([dict(r) for r in cursor.fetchall()])
-        
-    # If looking for triage
-    if 'triage' in queues:
-        cursor.execute('SELECT * FROM tasks WHERE is_failed = 1 AND is_inprogress = 0')
-        candidates.extend([dict(r) for r in cursor.fetchall()])
-        
-    # If looking for todo
-    if 'todo' in queues:
-        # Fetch potentials: not complete, not review, not failed, not inprogress
-        cursor.execute('''
-            SELECT * FROM tasks 
-            WHERE is_complete = 0 AND is_review = 0 AND is_failed = 0 AND is_inprogress = 0
-        ''')
-        potential_todos = [dict(r) for r in cursor.fetchall()]
-        
-        # Check dependencies
-        for t in potential_todos:
-            if t['dependency_id']:
-                # Check if dependency is complete
-                cursor.execute('SELECT is_complete FROM tasks WHERE id = ?', (t['dependency_id'],))
-                dep = cursor.fetchone()
-                if dep and dep['is_complete']:
-                    candidates.append(t)
-            else:
-                candidates.append(t)
+    # Tasks of remote workers that went silent go back to their queues first
+    coordinator.expire_leases(conn)
 
-    if not candidates:
-        conn.close()
+    # One run at a time per agent (AGENT_MAX_RUNS); runs whose task was moved away don't count,
+    # and a run that better-ranked waiting work should have gives way (PREEMPT_PRIORITY_GAP)
+    if agent_registry.reconcile(conn):
+        conn.commit()
+    if agent_registry.running(conn, agent.id) >= agent_registry.AGENT_MAX_RUNS and not _preempt_for_waiting_work(conn, agent.id):
+        store.close()
         return False
-        
-    # Pick first one
-    target_task = candidates[0]
-    conn.close()
+
+    # 2. Find and claim an eligible task
+    # Queues are served by weighted fair share across projects, and tasks within
+    # a queue by priority with aging (see scheduler.py). Another agent (or the UI
+    # loop and the backend loop) may have raced us to it.
+    target_task_id = store.claim_next(queues)
+    if not target_task_id:
+        store.close()
+        return False
+
+    batch = _claim_review_batch(conn, agent, target_task_id)
+    title = store.get_task(target_task_id)['title']
+    store.close()
     
     # 3. Trigger Agent
-    print(f"Agent {agent['name']} picking up task {target_task['title']}")
-    return run_task_agent(target_task['id'], agent_id)
+    if len(batch) > 1:
+        print(f"Agent {agent.name} picking up {len(batch)} reviews: {batch}")
+        return run_review_batch_agent(batch, agent_id)
+    print(f"Agent {agent.name} picking up task {title}")
+    return run_task_agent(target_task_id, agent_id)
+
+def list_active_agent_ids():
+    # Active agents with idle capacity, after preemptions (PREEMPT_PRIORITY_GAP)
+    conn = get_db()
+    try:
+        if agent_registry.reconcile(conn):
+            conn.commit()
+        _preempt_for_waiting_work(conn)
+        return [agent_id for agent_id, free in agent_registry.idle_capacity(conn).items() if free > 0]
+    finally:
+        conn.close()
+
+_agent_loop = None
+
+def start_backend_scheduler():
+    global _agent_loop
+    if _agent_loop is None:
+        _agent_loop = AgentLoop(list_active_agent_ids, agent_find_work)
+        _agent_loop.start()
+    return _agent_loop
+
+@eel.expose
+def get_runtime_info():
+    # The UI skips its own polling loop when the backend schedules agents
+    return {"backend_scheduler": _agent_loop is not None}
+
+# Metrics: task events and board gauges are read from the DB at scrape time
+WORKER_POOL_SIZE = metrics.registry.gauge("ralph_worker_pool_size", "Worker pool processes")
+WORKER_POOL_BUSY = metrics.registry.gauge("ralph_worker_pool_busy", "Worker pool processes running a task")
+WORKER_POOL_QUEUED = metrics.registry.gauge("ralph_worker_pool_queued", "Tasks waiting for a pool worker")
+AGENT_LOOP_BUSY = metrics.registry.gauge("ralph_agent_loop_busy", "Agents the backend loop is currently running")
+
+def _runtime_gauges():
+    # Don't start the pool just because someone scraped
+    stats = _worker_pool.stats() if _worker_pool else {}
+    WORKER_POOL_SIZE.set(stats.get("size", 0))
+    WORKER_POOL_BUSY.set(sum(1 for w in stats.get("workers", []) if w.get("task_id")))
+    WORKER_POOL_QUEUED.set(stats.get("queued", 0))
+    AGENT_LOOP_BUSY.set(len(_agent_loop.busy) if _agent_loop else 0)
+
+metrics.registry.add_collector(metrics.EventFolder(get_db))
+metrics.registry.add_collector(metrics.board_gauges(get_db))
+metrics.registry.add_collector(_runtime_gauges)
+
+@eel.expose
+def get_metrics():
+    return metrics.registry.snapshot()
+
+@eel.btl.route('/metrics')
+def prometheus_metrics():
+    eel.btl.response.content_type = 'text/plain; version=0.0.4; charset=utf-8'
+    return metrics.registry.render_prometheus()
+
+@eel.expose
+def get_run_stats(since_days=None):
+    # Time per stage and iterations-to-success per agent, for tuning MAX_ITERATIONS,
+    # and how much of each prompt repeats the previous iteration's (prefix caching)
+    conn = get_db()
+    try:
+        return {
+            "stages": run_trace.time_per_stage(conn, since_days),
+            "agents": run_trace.iterations_to_success(conn, since_days),
+            "prompt_prefix": run_trace.prompt_prefix_reuse(conn, since_days)
+        }
+    finally:
+        conn.close()
+
+@eel.expose
+def get_task_runs(task_id):
+    conn = get_db()
+    try:
+        return run_trace.get_task_runs(conn, task_id)
+    finally:
+        conn.close()
+
+@eel.expose
+def get_profiling_stats():
+    if not profiling.ENABLED:
+        return {"enabled": False, "functions": [], "slow_queries": []}
+    return {"enabled": True, "functions": profiling.get_stats(), "slow_queries": profiling.get_slow_queries()}
+
+@eel.expose
+def reset_profiling_stats():
+    profiling.reset_stats()
+    return True
+
+@eel.expose
+def profile_next_call(function_name, mode="cprofile"):
+    # Profiles the next call of an exposed function (mode: 'cprofile' or 'sample')
+    if not profiling.ENABLED:
+        return {"success": False, "message": "Profiling is disabled (set PROFILING=true)"}
+    if function_name not in eel._exposed_functions:
+        return {"success": False, "message": f"Unknown function {function_name}"}
+    try:
+        profiling.arm(function_name, mode)
+    except ValueError as e:
+        return {"success": False, "message": str(e)}
+    return {"success": True, "message": f"Next call of {function_name} will be profiled ({mode})."}
+
+@eel.expose
+def get_last_profile(function_name):
+    return profiling.get_last_profile(function_name)
+
+_backend_lock = None
+
+def acquire_backend_lock():
+    """
+    Takes an exclusive lock on DB_FILE + ".lock" for the life of the
+    process. Only its holder runs the scheduler, worker pool and agents for
+    the database. Returns False if another process (a daemon or another UI)
+    holds it. The OS drops the lock when the holder exits, even on a crash.
+    """
+    global _backend_lock
+    if _backend_lock is not None:
+        return True
+    f = open(DB_FILE + ".lock", "a+")
+    try:
+        if sys.platform == "win32":
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return False
+    _backend_lock = f
+    return True
+
+def find_daemon():
+    """
+    URL of the daemon the UI should use: DAEMON_URL, or a daemon answering
+    on the local DAEMON_PORT. None if there is none.
+    """
+    if DAEMON_URL:
+        return DAEMON_URL.rstrip("/")
+    url = f"http://127.0.0.1:{int(os.getenv('DAEMON_PORT', 8765))}"
+    try:
+        with urllib.request.urlopen(f"{url}/health", timeout=1) as response:
+            return url if json.loads(response.read()).get("success") else None
+    except (OSError, ValueError):
+        return None
+
+def use_daemon(url):
+    """
+    Turns this process into a client of the daemon at `url`: every exposed
+    function forwards its call to the daemon's API, so the browser talks to
+    the daemon's backend and this process runs none of its own.
+    """
+    from remote_worker import CoordinatorClient, CoordinatorError
+    client = CoordinatorClient(url, timeout=None)
+
+    def forward(name):
+        def call(*args):
+            try:
+                return client.call(name, *args)
+            except CoordinatorError as e:
+                print(f"Daemon call failed: {e}")
+                return {"success": False, "message": f"Daemon unreachable: {e}"}
+        return call
+
+    for name in list(eel._exposed_functions):
+        eel._exposed_functions[name] = forward(name)
+    print(f"Using the RalphBoard daemon at {url}")
+
+def startup(backend_scheduler=BACKEND_SCHEDULER):
+    if not acquire_backend_lock():
+        raise RuntimeError(f"Another RalphBoard backend is already running on {DB_FILE}")
+    reset_session_state()
+
+    # Pre-warm the worker pool (if enabled) before anything starts polling
+    get_worker_pool()
+
+    # Optionally move old completed projects out of the hot tables on startup
+    if os.getenv("AUTO_ARCHIVE_DAYS"):
+        archived = archive_completed_projects(int(os.getenv("AUTO_ARCHIVE_DAYS")))["archived"]
+        if archived:
+            print(f"Archived {len(archived)} completed project(s).")
+
+    if backend_scheduler:
+        start_backend_scheduler()
+
+# Wrap exposed functions last, once they are all registered
+if profiling.ENABLED:
+    profiling.install(eel._exposed_functions)
 
 # Initialize Eel
 eel.init('web')
 
 if __name__ == "__main__":
+    if "--headless" in sys.argv:
+        # daemon.py imports this module as "app"; don't load it a second time
+        sys.modules.setdefault("app", sys.modules[__name__])
+        import daemon
+        daemon.main()
+        sys.exit(0)
+
+    # One backend per database: with a daemon running, the UI is its client
+    daemon_url = find_daemon()
+    if daemon_url:
+        use_daemon(daemon_url)
+    elif acquire_backend_lock():
+        startup()
+    else:
+        print(f"Another RalphBoard instance is already running on {DB_FILE}. Close it, or start daemon.py and open the UI against it.")
+        sys.exit(1)
+
     # Start Eel
     try:
         eel.start('index.html', size=(1200, 800))
@@ -0,0 +1,144 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Completed projects are moved here so the hot tables only hold active work
+ARCHIVE_DB_FILE = os.getenv("ARCHIVE_DB_FILE", "ralphboard_archive.db")
+
+# (table, rows belonging to :project_id), children before parents.
+# {db} is replaced with "main" or "archive" depending on the direction.
+ARCHIVE_TABLES = [
+    ("run_iterations", "run_id IN (SELECT id FROM {db}.task_runs WHERE task_id IN (SELECT id FROM {db}.tasks WHERE project_id = :project_id))"),
+    ("task_runs", "task_id IN (SELECT id FROM {db}.tasks WHERE project_id = :project_id)"),
+    ("task_feedback", "task_id IN (SELECT id FROM {db}.tasks WHERE project_id = :project_id)"),
+    ("task_events", "task_id IN (SELECT id FROM {db}.tasks WHERE project_id = :project_id)"),
+    ("task_dependencies", "task_id IN (SELECT id FROM {db}.tasks WHERE project_id = :project_id)"),
+    ("tasks", "project_id = :project_id"),
+    ("projects", "id = :project_id")
+]
+
+ARCHIVE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS archive.idx_archive_tasks_project ON tasks (project_id)",
+    "CREATE INDEX IF NOT EXISTS archive.idx_archive_feedback_task ON task_feedback (task_id)",
+    "CREATE INDEX IF NOT EXISTS archive.idx_archive_events_task ON task_events (task_id)",
+    "CREATE INDEX IF NOT EXISTS archive.idx_archive_dependencies_task ON task_dependencies (task_id)",
+    "CREATE INDEX IF NOT EXISTS archive.idx_archive_runs_task ON task_runs (task_id)",
+    "CREATE INDEX IF NOT EXISTS archive.idx_archive_iterations_run ON run_iterations (run_id)"
+]
+
+def attach_archive(conn):
+    attached = [row[1] for row in conn.execute('PRAGMA database_list').fetchall()]
+    if 'archive' not in attached:
+        conn.execute('ATTACH DATABASE ? AS archive', (ARCHIVE_DB_FILE,))
+    _sync_archive_schema(conn)
+
+def _columns(conn, db, table):
+    return [row[1] for row in conn.execute(f'PRAGMA {db}.table_info({table})').fetchall()]
+
+def _sync_archive_schema(conn):
+    # Archive tables mirror the hot ones, including columns added by later migrations
+    for table, _ in ARCHIVE_TABLES:
+        hot_columns = conn.execute(f'PRAGMA main.table_info({table})').fetchall()
+        archive_columns = _columns(conn, 'archive', table)
+        if not archive_columns:
+            conn.execute(f'CREATE TABLE archive.{table} AS SELECT * FROM main.{table} WHERE 0')
+            archive_columns = _columns(conn, 'archive', table)
+        for col in hot_columns:
+            if col[1] not in archive_columns:
+                conn.execute(f'ALTER TABLE archive.{table} ADD COLUMN {col[1]} {col[2]}')
+    conn.execute('CREATE TABLE IF NOT EXISTS archive.archived_projects (project_id INTEGER PRIMARY KEY, archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)')
+    for sql in ARCHIVE_INDEXES:
+        conn.execute(sql)
+
+def _move_project(conn, project_id, src, dst):
+    moved = {}
+    params = {"project_id": project_id}
+    # Copy parents first, delete children first
+    for table, where in reversed(ARCHIVE_TABLES):
+        cols = ", ".join(c for c in _columns(conn, src, table) if c in _columns(conn, dst, table))
+        conn.execute(f'INSERT INTO {dst}.{table} ({cols}) SELECT {cols} FROM {src}.{table} WHERE {where.format(db=src)}', params)
+    for table, where in ARCHIVE_TABLES:
+        moved[table] = conn.execute(f'DELETE FROM {src}.{table} WHERE {where.format(db=src)}', params).rowcount
+    return moved
+
+def archive_project(conn, project_id):
+    """
+    Moves a project with its tasks and history into the archive database
+    in one transaction. Ids are kept, so restore puts everything back as-is.
+    """
+    attach_archive(conn)
+    cursor = conn.cursor()
+
+    cursor.execute('SELECT id FROM main.projects WHERE id = ?', (project_id,))
+    if not cursor.fetchone():
+        return {"success": False, "message": "Project not found"}
+
+    # Tasks elsewhere that wait on this project's tasks would lose their dependency
+    cursor.execute('''
+        SELECT COUNT(*) FROM main.task_dependencies d JOIN main.tasks t ON t.id = d.task_id
+        WHERE t.project_id != ? AND d.depends_on_id IN (SELECT id FROM main.tasks WHERE project_id = ?)
+    ''', (project_id, project_id))
+    if cursor.fetchone()[0]:
+        return {"success": False, "message": "Tasks in other projects depend on this project"}
+
+    try:
+        moved = _move_project(conn, project_id, 'main', 'archive')
+        cursor.execute('INSERT OR REPLACE INTO archive.archived_projects (project_id) VALUES (?)', (project_id,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return {"success": True, "moved": moved}
+
+def restore_project(conn, project_id):
+    attach_archive(conn)
+    cursor = conn.cursor()
+
+    cursor.execute('SELECT id FROM archive.projects WHERE id = ?', (project_id,))
+    if not cursor.fetchone():
+        return {"success": False, "message": "Archived project not found"}
+
+    try:
+        moved = _move_project(conn, project_id, 'archive', 'main')
+        cursor.execute('DELETE FROM archive.archived_projects WHERE project_id = ?', (project_id,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return {"success": True, "moved": moved}
+
+def archive_completed_projects(conn, older_than_days=0):
+    """
+    Archives every completed project, optionally only those created more
+    than `older_than_days` ago.
+    """
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT id FROM projects
+        WHERE status = 'completed' AND created_at <= datetime('now', ?)
+    ''', (f'-{int(older_than_days)} days',))
+    archived = []
+    for (project_id,) in cursor.fetchall():
+        if archive_project(conn, project_id).get("success"):
+            archived.append(project_id)
+    return archived
+
+def list_archived_projects(conn):
+    attach_archive(conn)
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT p.*, a.archived_at,
+               (SELECT COUNT(*) FROM archive.tasks t WHERE t.project_id = p.id) as total_tasks,
+               (SELECT COUNT(*) FROM archive.tasks t WHERE t.project_id = p.id AND t.is_complete = 1) as completed_tasks
+        FROM archive.projects p
+        LEFT JOIN archive.archived_projects a ON a.project_id = p.id
+        ORDER BY a.archived_at DESC
+    ''')
+    return [dict(row) for row in cursor.fetchall()]
+
+def get_archived_tasks(conn, project_id):
+    attach_archive(conn)
+    cursor = conn.cursor()
+    cursor.execute('SELECT * FROM archive.tasks WHERE project_id = ? ORDER BY id', (project_id,))
+    return [dict(row) for row in cursor.fetchall()]
@@ -0,0 +1,240 @@
+import sys
+import json
+import argparse
+
+import verification
+
+FORMAT_NAME = "ralphboard"
+FORMAT_VERSION = 1
+BATCH_SIZE = 1000
+
+# Derived columns are rebuilt by triggers on import
+SKIP_COLUMNS = {"queue_rank"}
+
+# Imported agents start stopped with fresh stats, like newly created ones
+AGENT_RESET = {"is_active": 0, "status": "Idle", "busy_seconds": 0, "tasks_done": 0, "stats_since": None}
+
+def _columns(conn, table):
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({table})').fetchall()]
+
+def _write(f, record_type, row):
+    f.write(json.dumps({"type": record_type, **row}, ensure_ascii=False, default=str))
+    f.write("\n")
+
+def _stream(conn, sql, params=()):
+    cursor = conn.cursor()
+    cursor.execute(sql, params)
+    while True:
+        rows = cursor.fetchmany(BATCH_SIZE)
+        if not rows:
+            break
+        for row in rows:
+            yield {k: row[k] for k in row.keys() if k not in SKIP_COLUMNS}
+
+def export_board(conn, f, project_ids=None, include_agents=True):
+    """
+    Writes agents, projects, tasks and dependency edges as JSON Lines to the
+    open file `f`. Rows are streamed with fetchmany, so memory use doesn't
+    grow with the board.
+    """
+    counts = {"agent": 0, "project": 0, "task": 0, "dependency": 0}
+    _write(f, "header", {"format": FORMAT_NAME, "version": FORMAT_VERSION})
+
+    if include_agents:
+        for row in _stream(conn, 'SELECT * FROM agents ORDER BY id'):
+            _write(f, "agent", row)
+            counts["agent"] += 1
+
+    where, params = "", ()
+    if project_ids:
+        project_ids = [int(p) for p in project_ids]
+        where = f"WHERE {{col}} IN ({','.join('?' for _ in project_ids)})"
+        params = tuple(project_ids)
+
+    for row in _stream(conn, f'SELECT * FROM projects {where.format(col="id")} ORDER BY id', params):
+        _write(f, "project", row)
+        counts["project"] += 1
+
+    for row in _stream(conn, f'SELECT * FROM tasks {where.format(col="project_id")} ORDER BY id', params):
+        _write(f, "task", row)
+        counts["task"] += 1
+
+    for row in _stream(conn, f'''
+        SELECT d.task_id, d.depends_on_id FROM task_dependencies d JOIN tasks t ON t.id = d.task_id
+        {where.format(col="t.project_id")} ORDER BY d.task_id, d.depends_on_id
+    ''', params):
+        _write(f, "dependency", row)
+        counts["dependency"] += 1
+
+    return counts
+
+def _read_records(f):
+    for line_no, line in enumerate(f, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Line {line_no}: invalid JSON ({e})")
+
+def _next_id(conn, table):
+    # New ids must clear both existing rows and AUTOINCREMENT history
+    max_id = conn.execute(f'SELECT COALESCE(MAX(id), 0) FROM {table}').fetchone()[0]
+    row = conn.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,)).fetchone()
+    return max(max_id, row[0] if row else 0)
+
+class _BatchInserter:
+    def __init__(self, conn, table, columns):
+        self.conn = conn
+        self.columns = columns
+        self.sql = f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" for _ in columns)})'
+        self.rows = []
+        self.count = 0
+
+    def add(self, record):
+        self.rows.append(tuple(record.get(c) for c in self.columns))
+        if len(self.rows) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.conn.executemany(self.sql, self.rows)
+            self.count += len(self.rows)
+            self.rows = []
+
+def _imported_checks(record):
+    # Like generated ones: file checks only, commands would run unreviewed here
+    try:
+        return verification.dump_checks(record.get("checks"), authored=False)
+    except ValueError as e:
+        print(f"Ignoring invalid checks of imported task {record.get('title')}: {e}")
+        return None
+
+def import_board(conn, f):
+    """
+    Loads a JSON Lines export in a single transaction.
+
+    Project and task ids are shifted by the current max id instead of being
+    remapped through a lookup table, so every id (including dependency_id)
+    can be translated on the fly and memory stays flat. Dependencies that
+    point outside the imported set are cleared at the end.
+
+    Agents whose name and role already exist are skipped; the rest come in
+    stopped with their stats reset. Tasks that were in progress go back to
+    their queue, since no run exists for them here, and keep only their file
+    checks (see verification.dump_checks).
+    """
+    project_offset = _next_id(conn, 'projects')
+    task_offset = _next_id(conn, 'tasks')
+
+    agent_cols = [c for c in _columns(conn, 'agents') if c != 'id' and c not in SKIP_COLUMNS]
+    project_cols = [c for c in _columns(conn, 'projects') if c not in SKIP_COLUMNS]
+    task_cols = [c for c in _columns(conn, 'tasks') if c not in SKIP_COLUMNS]
+
+    agents = _BatchInserter(conn, 'agents', agent_cols)
+    projects = _BatchInserter(conn, 'projects', project_cols)
+    tasks = _BatchInserter(conn, 'tasks', task_cols)
+    edges = _BatchInserter(conn, 'task_dependencies', ['task_id', 'depends_on_id'])
+
+    existing_agents = {(row[0], row[1]) for row in conn.execute('SELECT name, role FROM agents')}
+    imported_projects = set()
+    skipped = 0
+    header_seen = False
+
+    try:
+        for record in _read_records(f):
+            record_type = record.pop("type", None)
+
+            if not header_seen:
+                if record_type != "header" or record.get("format") != FORMAT_NAME:
+                    raise ValueError("Not a RalphBoard export file")
+                if record.get("version", 0) > FORMAT_VERSION:
+                    raise ValueError(f"Unsupported export version {record.get('version')}")
+                header_seen = True
+                continue
+
+            if record_type == "agent":
+                if (record.get("name"), record.get("role")) in existing_agents:
+                    skipped += 1
+                    continue
+                existing_agents.add((record.get("name"), record.get("role")))
+                agents.add({**record, **AGENT_RESET})
+            elif record_type == "project":
+                old_id = int(record["id"])
+                imported_projects.add(old_id)
+                record["id"] = old_id + project_offset
+                projects.add(record)
+            elif record_type == "task":
+                if record.get("project_id") not in imported_projects:
+                    skipped += 1
+                    continue
+                # Parents must exist before children reference them
+                projects.flush()
+                record["id"] = int(record["id"]) + task_offset
+                record["project_id"] = int(record["project_id"]) + project_offset
+                if record.get("dependency_id") is not None:
+                    record["dependency_id"] = int(record["dependency_id"]) + task_offset
+                record["is_inprogress"] = 0
+                record["checks"] = _imported_checks(record)
+                tasks.add(record)
+            elif record_type == "dependency":
+                edges.add({"task_id": int(record["task_id"]) + task_offset,
+                           "depends_on_id": int(record["depends_on_id"]) + task_offset})
+            else:
+                skipped += 1
+
+        agents.flush()
+        projects.flush()
+        tasks.flush()
+        edges.flush()
+
+        conn.execute('''
+            UPDATE tasks SET dependency_id = NULL
+            WHERE id > ? AND dependency_id IS NOT NULL
+            AND dependency_id NOT IN (SELECT id FROM tasks)
+        ''', (task_offset,))
+        conn.execute('''
+            DELETE FROM task_dependencies
+            WHERE task_id > ? AND (task_id NOT IN (SELECT id FROM tasks) OR depends_on_id NOT IN (SELECT id FROM tasks))
+        ''', (task_offset,))
+        # Exports from before task_dependencies only carry dependency_id
+        conn.execute('''
+            INSERT OR IGNORE INTO task_dependencies (task_id, depends_on_id)
+            SELECT id, dependency_id FROM tasks WHERE id > ? AND dependency_id IS NOT NULL
+        ''', (task_offset,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    return {"agents": agents.count, "projects": projects.count, "tasks": tasks.count,
+            "dependencies": edges.count, "skipped": skipped}
+
+def main():
+    parser = argparse.ArgumentParser(description="Export / import a RalphBoard as JSON Lines.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    exp = sub.add_parser("export")
+    exp.add_argument("path")
+    exp.add_argument("--project", type=int, action="append", help="Only export this project id (repeatable)")
+    exp.add_argument("--no-agents", action="store_true")
+    imp = sub.add_parser("import")
+    imp.add_argument("path")
+    args = parser.parse_args()
+
+    from app import get_db
+    conn = get_db()
+    try:
+        if args.command == "export":
+            with open(args.path, "w", encoding="utf-8") as f:
+                counts = export_board(conn, f, args.project, include_agents=not args.no_agents)
+            print(f"Exported {counts}")
+        else:
+            with open(args.path, "r", encoding="utf-8") as f:
+                counts = import_board(conn, f)
+            print(f"Imported {counts}")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,245 @@
+import os
+import time
+import secrets
+import threading
+import subprocess
+from collections import deque
+from dotenv import load_dotenv
+
+import task_state
+import agent_registry
+from models import Agent, fetch_task
+from scheduler import pick_next_task
+
+load_dotenv()
+
+# Remote workers (agent_runner.py --remote) hold a lease on each task they claim.
+# A lease that isn't renewed by a heartbeat within REMOTE_LEASE_SECONDS expires
+# and the task goes back to its queue for someone else.
+REMOTE_LEASE_SECONDS = int(os.getenv("REMOTE_LEASE_SECONDS", 120))
+# Output lines kept per task for the progress view
+REMOTE_PROGRESS_LINES = int(os.getenv("REMOTE_PROGRESS_LINES", 500))
+
+# Events a worker may report for its leased task
+RESULT_EVENTS = {"coding_succeeded", "coding_failed", "checks_failed", "review_approved", "review_rejected", "fail"}
+RESULT_PARAMS = ("feedback", "iterations", "role")
+
+def init_coordinator_schema(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS task_leases (
+            task_id INTEGER PRIMARY KEY,
+            lease_id TEXT NOT NULL UNIQUE,
+            worker_id TEXT,
+            agent_id INTEGER,
+            claimed_at REAL,
+            heartbeat_at REAL,
+            expires_at REAL,
+            FOREIGN KEY (task_id) REFERENCES tasks (id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_task_leases_expires ON task_leases (expires_at)')
+    # Last commit a remote worker pushed for each task (see sync_local_checkout)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS remote_commits (
+            task_id INTEGER PRIMARY KEY,
+            commit_sha TEXT NOT NULL,
+            worker_id TEXT,
+            pushed_at REAL
+        )
+    ''')
+
+class ProgressLog:
+    """
+    Recent output lines of remotely running tasks, numbered so a viewer can
+    poll for what's new. Memory only; a restart loses it, not the tasks.
+    """
+
+    def __init__(self, max_lines=REMOTE_PROGRESS_LINES):
+        self.max_lines = max_lines
+        self.logs = {}
+        self.seq = 0
+        self.lock = threading.Lock()
+
+    def append(self, task_id, text):
+        if not text:
+            return
+        with self.lock:
+            log = self.logs.setdefault(int(task_id), deque(maxlen=self.max_lines))
+            for line in text.splitlines():
+                self.seq += 1
+                log.append((self.seq, line))
+
+    def since(self, task_id, after=0):
+        with self.lock:
+            log = self.logs.get(int(task_id), ())
+            return [{"seq": seq, "line": line} for seq, line in log if seq > after]
+
+    def clear(self, task_id):
+        with self.lock:
+            self.logs.pop(int(task_id), None)
+
+progress_log = ProgressLog()
+
+def _git(working_dir, *args, timeout=15):
+    try:
+        result = subprocess.run(["git", "-C", working_dir, *args], capture_output=True, text=True, timeout=timeout)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() if result.returncode == 0 else None
+
+def git_info(working_dir):
+    """
+    Where remote workers get the project's code: the working directory's
+    `origin` remote and current branch. None if it isn't a git checkout
+    with an origin.
+    """
+    if not working_dir or not os.path.isdir(working_dir):
+        return None
+    url = _git(working_dir, "remote", "get-url", "origin")
+    if not url:
+        return None
+    branch = _git(working_dir, "rev-parse", "--abbrev-ref", "HEAD")
+    return {"url": url, "branch": branch if branch and branch != "HEAD" else "main"}
+
+def sync_local_checkout(conn, task):
+    """
+    Brings the project's working directory on this machine up to the last
+    commit a remote worker pushed for `task`, so a local reviewer or local
+    checks see that code rather than what the checkout had before. Fetches
+    from origin and fast-forwards; uncommitted changes that don't touch the
+    same files are kept. Raises RuntimeError if the checkout has diverged
+    (it can't be fast-forwarded). Returns the commit, or None if the task
+    has no remote work.
+    """
+    row = conn.execute('SELECT commit_sha FROM remote_commits WHERE task_id = ?', (int(task['id']),)).fetchone()
+    if not row:
+        return None
+    sha, working_dir = row[0], task['working_dir']
+    if _git(working_dir, "merge-base", "--is-ancestor", sha, "HEAD") is not None:
+        return sha
+    if _git(working_dir, "fetch", "origin", timeout=300) is None:
+        raise RuntimeError(f"Couldn't fetch task {task['id']}'s remote commit {sha[:10]} into {working_dir}")
+    if _git(working_dir, "merge", "--ff-only", "-q", sha, timeout=120) is None:
+        raise RuntimeError(f"{working_dir} can't be fast-forwarded to task {task['id']}'s remote commit {sha[:10]}; "
+                           f"it has diverged or has conflicting uncommitted changes")
+    print(f"DEBUG: Fast-forwarded {working_dir} to {sha[:10]} (remote work on task {task['id']})")
+    return sha
+
+def expire_leases(conn, now=None):
+    """
+    Returns tasks whose lease ran out to their queue. Returns their ids.
+    """
+    now = time.time() if now is None else now
+    expired = [row[0] for row in conn.execute('SELECT task_id FROM task_leases WHERE expires_at < ?', (now,))]
+    if not expired:
+        return []
+    task_state.apply_transitions(conn, [(task_id, "release") for task_id in expired], commit=False)
+    conn.executemany('DELETE FROM task_leases WHERE task_id = ?', [(task_id,) for task_id in expired])
+    agent_registry.finished(conn, expired)
+    conn.commit()
+    for task_id in expired:
+        progress_log.clear(task_id)
+    print(f"DEBUG: Remote leases expired for tasks {expired}; back in their queues.")
+    return expired
+
+def claim(conn, worker_id, agent_id):
+    """
+    Picks and claims the next task for `agent_id`'s queues on behalf of a
+    remote worker and leases it. Returns {"success": True, "lease_id", "task",
+    "agent", "git", "lease_seconds"} or {"success": False} when there's no work.
+    """
+    expire_leases(conn)
+    agent = Agent.fetch(conn, agent_id)
+    if not agent:
+        return {"success": False, "message": f"Agent {agent_id} not found"}
+    queues = agent.queues
+
+    task_id = pick_next_task(conn, queues)
+    if not task_id:
+        return {"success": False, "message": "No work"}
+
+    # Claim and lease in one transaction; losing the race just means no work this time
+    if not task_state.apply_transitions(conn, [(task_id, "claim")], commit=False)[0]["success"]:
+        conn.rollback()
+        return {"success": False, "message": "No work"}
+    now = time.time()
+    lease_id = secrets.token_hex(16)
+    conn.execute('''
+        INSERT OR REPLACE INTO task_leases (task_id, lease_id, worker_id, agent_id, claimed_at, heartbeat_at, expires_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (task_id, lease_id, worker_id, agent.id, now, now, now + REMOTE_LEASE_SECONDS))
+    agent_registry.started(conn, agent.id, [task_id], worker_id=worker_id, now=now)
+    conn.commit()
+
+    task = fetch_task(conn, task_id)
+    progress_log.clear(task_id)
+    print(f"DEBUG: Worker {worker_id} leased task {task_id} for agent {agent.name}")
+    return {"success": True, "lease_id": lease_id, "lease_seconds": REMOTE_LEASE_SECONDS,
+            "task": task.to_dict(), "agent": agent.to_dict(), "git": git_info(task.working_dir)}
+
+def _lease(conn, lease_id):
+    row = conn.execute('''
+        SELECT l.task_id, l.worker_id, l.expires_at, t.is_inprogress FROM task_leases l
+        LEFT JOIN tasks t ON t.id = l.task_id WHERE l.lease_id = ?
+    ''', (lease_id,)).fetchone()
+    if not row:
+        return None, "Lease not found (expired or finished)"
+    if row['expires_at'] < time.time():
+        return None, "Lease expired"
+    if not row['is_inprogress']:
+        # Dragged away or otherwise taken back on the board
+        return None, "Task is no longer in progress"
+    return row, None
+
+def heartbeat(conn, lease_id, progress=None):
+    """
+    Extends a lease and appends the worker's new output to the task's
+    progress log. {"success": False} tells the worker to give the task up.
+    """
+    lease, error = _lease(conn, lease_id)
+    if lease is None:
+        return {"success": False, "message": error}
+    now = time.time()
+    conn.execute('UPDATE task_leases SET heartbeat_at = ?, expires_at = ? WHERE lease_id = ?',
+                 (now, now + REMOTE_LEASE_SECONDS, lease_id))
+    conn.commit()
+    progress_log.append(lease['task_id'], progress)
+    return {"success": True, "lease_seconds": REMOTE_LEASE_SECONDS}
+
+def submit(conn, lease_id, event, params=None, progress=None):
+    """
+    Applies a worker's result (a task_state event) to its leased task and
+    ends the lease, in one transaction. params["commit"] is the commit the
+    worker pushed, if any.
+    """
+    lease, error = _lease(conn, lease_id)
+    if lease is None:
+        return {"success": False, "message": error}
+    if event not in RESULT_EVENTS:
+        return {"success": False, "message": f"Event {event!r} can't be submitted"}
+    commit_sha = (params or {}).get("commit")
+    params = {k: v for k, v in (params or {}).items() if k in RESULT_PARAMS}
+    progress_log.append(lease['task_id'], progress)
+
+    result = task_state.apply_transitions(conn, [(lease['task_id'], event, params)], commit=False)[0]
+    if not result["success"]:
+        # Don't leave it held by a lease nobody renews
+        task_state.apply_transitions(conn, [(lease['task_id'], "release")], commit=False)
+    elif commit_sha:
+        # Local reviews and checks of this task fetch it first
+        conn.execute('INSERT OR REPLACE INTO remote_commits (task_id, commit_sha, worker_id, pushed_at) VALUES (?, ?, ?, ?)',
+                     (lease['task_id'], str(commit_sha), lease['worker_id'], time.time()))
+    conn.execute('DELETE FROM task_leases WHERE lease_id = ?', (lease_id,))
+    agent_registry.finished(conn, [lease['task_id']])
+    conn.commit()
+    print(f"DEBUG: Worker {lease['worker_id']} finished task {lease['task_id']}: {event}")
+    return result
+
+def list_leases(conn):
+    now = time.time()
+    rows = conn.execute('''
+        SELECT l.task_id, l.worker_id, l.agent_id, l.claimed_at, l.heartbeat_at, l.expires_at, t.title
+        FROM task_leases l LEFT JOIN tasks t ON t.id = l.task_id ORDER BY l.claimed_at
+    ''').fetchall()
+    return [{**dict(row), "running_seconds": round(now - row['claimed_at'], 1),
+             "expires_in": round(row['expires_at'] - now, 1)} for row in rows]
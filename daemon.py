@@ -0,0 +1,230 @@
+import os
+import sys
+import json
+import hmac
+import asyncio
+import argparse
+import ipaddress
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qsl
+from dotenv import load_dotenv
+
+import eel
+import app
+import metrics
+
+load_dotenv()
+
+# Local-only by default. Binding to the network requires RALPH_API_TOKEN.
+DAEMON_HOST = os.getenv("DAEMON_HOST", "127.0.0.1")
+DAEMON_PORT = int(os.getenv("DAEMON_PORT", 8765))
+# Threads running exposed functions (agents run in-process can hold one for a long time)
+DAEMON_API_WORKERS = int(os.getenv("DAEMON_API_WORKERS", 32))
+MAX_BODY_BYTES = 16 * 1024 * 1024
+# Shared secret every API call must carry ("Authorization: Bearer <token>")
+API_TOKEN = os.getenv("RALPH_API_TOKEN", "")
+# What clients on other machines may call: the remote worker protocol only.
+# Everything else (file paths in export_board / import_board, deleting
+# projects, running agents here) stays on this machine.
+REMOTE_FUNCTION_PREFIX = "remote_"
+REMOTE_PATHS = {"/health", "/metrics"}
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed",
+               413: "Payload Too Large", 500: "Internal Server Error"}
+
+class ApiServer:
+    """
+    Serves every @eel.expose function over HTTP/JSON:
+
+        GET  /api                 -> list of function names
+        POST /api/<name>          -> body is a JSON list of args or {"args": [...], "kwargs": {...}}
+        GET  /api/<name>?k=v      -> call with query params as keyword arguments
+        GET  /health
+
+    Connections are handled by asyncio, the (blocking, sqlite-backed) functions
+    run on a thread pool, so slow calls don't hold up other clients.
+
+    With a token, every call except /health must send it. Clients on other
+    machines only get the remote_* functions, /health and /metrics.
+    """
+
+    def __init__(self, host=DAEMON_HOST, port=DAEMON_PORT, workers=DAEMON_API_WORKERS, token=API_TOKEN):
+        self.host = host
+        self.port = port
+        self.token = token
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="api")
+        self.routes = {}
+
+    def route(self, path, handler):
+        # Extra GET endpoints (e.g. /metrics); handler() returns (status, content_type, body)
+        self.routes[path] = handler
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        print(f"RalphBoard daemon listening on http://{self.host}:{self.port}")
+        async with server:
+            await server.serve_forever()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request = await self.read_request(reader)
+                if request is None:
+                    break
+                method, target, headers, body = request
+                denied = self.check_access(target, headers, writer.get_extra_info("peername"))
+                if denied:
+                    status, content_type, payload = denied
+                else:
+                    status, content_type, payload = await self.dispatch(method, target, body)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                self.write_response(writer, status, content_type, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except ValueError as e:
+            self.write_response(writer, 400, "application/json", _json({"success": False, "message": str(e)}), False)
+        finally:
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    async def read_request(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        parts = line.decode("latin-1").strip().split()
+        if len(parts) < 2:
+            raise ValueError("Malformed request line")
+        method, target = parts[0].upper(), parts[1]
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get("content-length") or 0)
+        if length > MAX_BODY_BYTES:
+            raise ValueError("Request body too large")
+        body = await reader.readexactly(length) if length else b""
+        return method, target, headers, body
+
+    def write_response(self, writer, status, content_type, payload, keep_alive):
+        head = (
+            f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + payload)
+
+    def check_access(self, target, headers, peer):
+        """
+        None if the request may go on, else the (status, content_type, body)
+        to refuse it with.
+        """
+        path = urlsplit(target).path.rstrip("/") or "/"
+        if path == "/health":
+            return None
+        if self.token:
+            scheme, _, sent = headers.get("authorization", "").partition(" ")
+            if scheme.lower() != "bearer" or not hmac.compare_digest(sent.strip().encode(), self.token.encode()):
+                return 401, "application/json", _json({"success": False, "message": "Missing or wrong API token"})
+        if not _is_loopback(peer) and path not in REMOTE_PATHS and not path.startswith("/api/" + REMOTE_FUNCTION_PREFIX):
+            return 403, "application/json", _json({"success": False, "message": "Only remote_* calls are allowed from other machines"})
+        return None
+
+    async def dispatch(self, method, target, body):
+        url = urlsplit(target)
+        path = url.path.rstrip("/") or "/"
+
+        if path == "/health":
+            return 200, "application/json", _json({"success": True})
+        if path in self.routes:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, self.routes[path])
+        if path == "/api":
+            return 200, "application/json", _json(sorted(eel._exposed_functions))
+        if not path.startswith("/api/"):
+            return 404, "application/json", _json({"success": False, "message": "Not found"})
+
+        name = path[len("/api/"):]
+        func = eel._exposed_functions.get(name)
+        if func is None:
+            return 404, "application/json", _json({"success": False, "message": f"Unknown function {name}"})
+
+        if method == "GET":
+            args, kwargs = [], dict(parse_qsl(url.query))
+        elif method == "POST":
+            try:
+                data = json.loads(body) if body.strip() else []
+            except json.JSONDecodeError as e:
+                return 400, "application/json", _json({"success": False, "message": f"Invalid JSON: {e}"})
+            if isinstance(data, list):
+                args, kwargs = data, {}
+            elif isinstance(data, dict):
+                args, kwargs = data.get("args", []), data.get("kwargs", {})
+            else:
+                args, kwargs = [data], {}
+        else:
+            return 405, "application/json", _json({"success": False, "message": "Use GET or POST"})
+
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(
+                self.executor, lambda: func(*args, **kwargs)
+            )
+        except TypeError as e:
+            return 400, "application/json", _json({"success": False, "message": str(e)})
+        except Exception as e:
+            print(f"API error in {name}: {e}")
+            return 500, "application/json", _json({"success": False, "message": str(e)})
+        return 200, "application/json", _json(result)
+
+def _json(value):
+    return json.dumps(value, default=str).encode("utf-8")
+
+def _is_loopback(peer):
+    try:
+        address = ipaddress.ip_address(peer[0].split("%")[0])
+    except (TypeError, IndexError, ValueError):
+        # Unix sockets and the like are local
+        return not isinstance(peer, tuple)
+    if getattr(address, "ipv4_mapped", None):
+        address = address.ipv4_mapped
+    return address.is_loopback
+
+def main():
+    parser = argparse.ArgumentParser(description="Run RalphBoard without the UI: HTTP/JSON API plus backend agent scheduling.")
+    parser.add_argument("--host", default=DAEMON_HOST)
+    parser.add_argument("--port", type=int, default=DAEMON_PORT)
+    parser.add_argument("--no-scheduler", action="store_true", help="Serve the API only, don't run agents")
+    args, _ = parser.parse_known_args()
+
+    try:
+        local_only = ipaddress.ip_address(args.host).is_loopback
+    except ValueError:
+        local_only = args.host == "localhost"
+    if not local_only and not API_TOKEN:
+        print(f"Refusing to listen on {args.host} without RALPH_API_TOKEN; anyone who can reach the port could call the API.")
+        return 1
+    if not app.acquire_backend_lock():
+        print(f"Another RalphBoard backend (daemon or UI) is already running on {app.DB_FILE}. Not starting a second one.")
+        return 1
+    app.startup(backend_scheduler=not args.no_scheduler)
+
+    server = ApiServer(args.host, args.port)
+    server.route("/metrics", lambda: (200, "text/plain; version=0.0.4; charset=utf-8",
+                                      metrics.registry.render_prometheus().encode("utf-8")))
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        print("Daemon stopped")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,229 @@
+from collections import defaultdict
+
+# task_dependencies holds one row per "task_id waits for depends_on_id" edge.
+# tasks.dependency_id is kept as a mirror of the lowest parent id for older
+# exports and readers; the edge table is what the board and scheduler use.
+
+class DependencyCycleError(ValueError):
+    pass
+
+def init_dependency_schema(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS task_dependencies (
+            task_id INTEGER NOT NULL,
+            depends_on_id INTEGER NOT NULL,
+            PRIMARY KEY (task_id, depends_on_id),
+            FOREIGN KEY (task_id) REFERENCES tasks (id),
+            FOREIGN KEY (depends_on_id) REFERENCES tasks (id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_task_dependencies_parent ON task_dependencies (depends_on_id)')
+    # Single dependency_id links from before the edge table (and from old exports)
+    cursor.execute('''
+        INSERT OR IGNORE INTO task_dependencies (task_id, depends_on_id)
+        SELECT id, dependency_id FROM tasks
+        WHERE dependency_id IS NOT NULL AND dependency_id != id
+    ''')
+
+# Open (not complete) parents of t.id; used for 'backlog' and todo readiness
+OPEN_DEPENDENCY_SQL = '''
+    SELECT 1 FROM task_dependencies dep JOIN tasks parent ON parent.id = dep.depends_on_id
+    WHERE dep.task_id = t.id AND parent.is_complete = 0
+'''
+
+def would_create_cycle(conn, task_id, depends_on_id):
+    # task_id -> depends_on_id closes a cycle if task_id is already upstream of depends_on_id
+    if int(task_id) == int(depends_on_id):
+        return True
+    row = conn.execute('''
+        WITH RECURSIVE upstream(id) AS (
+            SELECT ?
+            UNION
+            SELECT d.depends_on_id FROM task_dependencies d JOIN upstream u ON d.task_id = u.id
+        )
+        SELECT 1 FROM upstream WHERE id = ? LIMIT 1
+    ''', (int(depends_on_id), int(task_id))).fetchone()
+    return row is not None
+
+def _sync_legacy_column(conn, task_id):
+    conn.execute('''
+        UPDATE tasks SET dependency_id = (SELECT MIN(depends_on_id) FROM task_dependencies WHERE task_id = ?)
+        WHERE id = ?
+    ''', (task_id, task_id))
+
+def add_dependency(conn, task_id, depends_on_id):
+    """
+    Makes task_id wait for depends_on_id. Raises DependencyCycleError if that
+    would close a cycle. Doesn't commit.
+    """
+    task_id, depends_on_id = int(task_id), int(depends_on_id)
+    if would_create_cycle(conn, task_id, depends_on_id):
+        raise DependencyCycleError(f"Task {task_id} can't depend on {depends_on_id}: that would create a cycle")
+    conn.execute('INSERT OR IGNORE INTO task_dependencies (task_id, depends_on_id) VALUES (?, ?)', (task_id, depends_on_id))
+    _sync_legacy_column(conn, task_id)
+
+def remove_dependency(conn, task_id, depends_on_id):
+    conn.execute('DELETE FROM task_dependencies WHERE task_id = ? AND depends_on_id = ?', (int(task_id), int(depends_on_id)))
+    _sync_legacy_column(conn, int(task_id))
+
+def set_dependencies(conn, task_id, depends_on_ids):
+    """
+    Replaces all parents of task_id. Nothing is changed if any of them would
+    create a cycle (DependencyCycleError). Doesn't commit.
+    """
+    task_id = int(task_id)
+    wanted = sorted({int(d) for d in depends_on_ids or []})
+    current = {row[0] for row in conn.execute('SELECT depends_on_id FROM task_dependencies WHERE task_id = ?', (task_id,))}
+    if set(wanted) == current:
+        return
+    # Check everything first; the task's own current parents can't affect the result
+    for depends_on_id in wanted:
+        if would_create_cycle(conn, task_id, depends_on_id):
+            raise DependencyCycleError(f"Task {task_id} can't depend on {depends_on_id}: that would create a cycle")
+    conn.execute('DELETE FROM task_dependencies WHERE task_id = ?', (task_id,))
+    conn.executemany('INSERT INTO task_dependencies (task_id, depends_on_id) VALUES (?, ?)', [(task_id, d) for d in wanted])
+    _sync_legacy_column(conn, task_id)
+
+def parse_ids(value):
+    # None / "" / 5 / "5" / "3,5" / [3, 5] -> list of ints
+    if value is None or value == "":
+        return []
+    if isinstance(value, (list, tuple, set)):
+        return [int(v) for v in value if v not in (None, "")]
+    return [int(v) for v in str(value).split(",") if v.strip()]
+
+def get_dependencies(conn, task_ids):
+    """
+    Returns {task_id: [parent ids]} for the given tasks.
+    """
+    task_ids = [int(t) for t in task_ids]
+    result = {t: [] for t in task_ids}
+    # Stay well below SQLite's bound-parameter limit
+    for start in range(0, len(task_ids), 500):
+        chunk = task_ids[start:start + 500]
+        rows = conn.execute(f'''
+            SELECT task_id, depends_on_id FROM task_dependencies
+            WHERE task_id IN ({",".join("?" for _ in chunk)}) ORDER BY depends_on_id
+        ''', chunk).fetchall()
+        for task_id, depends_on_id in rows:
+            result[task_id].append(depends_on_id)
+    return result
+
+def critical_path(conn, project_id):
+    """
+    For every open task of a project: the length of the longest chain of
+    open tasks it unblocks, counting itself ("critical_path"), and how many
+    open tasks are downstream of it in total ("fanout").
+    Returns {task_id: (critical_path, fanout)}.
+    """
+    open_ids = {row[0] for row in conn.execute(
+        'SELECT id FROM tasks WHERE project_id = ? AND is_complete = 0', (project_id,))}
+    edges = conn.execute('''
+        SELECT d.task_id, d.depends_on_id FROM task_dependencies d
+        JOIN tasks t ON t.id = d.task_id
+        WHERE t.project_id = ? AND t.is_complete = 0
+    ''', (project_id,)).fetchall()
+    return critical_path_of(open_ids, edges)
+
+_popcount = getattr(int, "bit_count", None) or (lambda x: bin(x).count("1"))
+
+def critical_path_of(open_ids, edges):
+    # open_ids: open task ids, edges: (task_id, depends_on_id) pairs
+    children = defaultdict(list)
+    indegree = {t: 0 for t in open_ids}
+    for task_id, depends_on_id in edges:
+        if depends_on_id in open_ids and task_id in indegree:
+            children[depends_on_id].append(task_id)
+            indegree[task_id] += 1
+    parents_left = dict(indegree)
+
+    # Kahn's order, then walk it backwards so children are done before parents
+    order = [t for t, degree in indegree.items() if degree == 0]
+    for task_id in order:
+        for child in children[task_id]:
+            indegree[child] -= 1
+            if indegree[child] == 0:
+                order.append(child)
+
+    # Downstream sets are bitsets (Python ints, one bit per task, leaves
+    # lowest), so a union is one OR instead of copying a set per task. A
+    # task's set is dropped once its last parent has used it: a long chain
+    # keeps one set alive instead of one per task.
+    bit = {t: 1 << i for i, t in enumerate(reversed(order))}
+    path, fanout, downstream = {}, {}, {}
+    for task_id in reversed(order):
+        below, longest = 0, 0
+        for child in children[task_id]:
+            below |= bit.get(child, 0) | downstream.get(child, 0)
+            longest = max(longest, path.get(child, 1))
+            parents_left[child] -= 1
+            if parents_left[child] == 0:
+                downstream.pop(child, None)
+        path[task_id] = 1 + longest
+        fanout[task_id] = _popcount(below)
+        if parents_left[task_id]:
+            downstream[task_id] = below
+    # Tasks left out of the order sit on a cycle (only possible with hand-edited rows)
+    return {t: (path.get(t, 1), fanout.get(t, 0)) for t in open_ids}
+
+def _affected_critical_path(conn, project_id, task_ids):
+    """
+    critical_path() and the stored values, for just the open tasks whose
+    downstream can have changed when `task_ids` were completed, reopened,
+    created or got a new parent: those tasks and their open ancestors. Only
+    their open descendants are read, so completing a task whose parents are
+    all done reads nothing.
+    """
+    placeholders = ",".join("?" for _ in task_ids)
+    rows = conn.execute(f'''
+        WITH RECURSIVE up(id) AS (
+            SELECT id FROM tasks WHERE id IN ({placeholders}) AND project_id = ? AND is_complete = 0
+            UNION
+            SELECT d.depends_on_id FROM task_dependencies d JOIN tasks p ON p.id = d.depends_on_id
+            WHERE d.task_id IN ({placeholders}) AND p.project_id = ? AND p.is_complete = 0
+            UNION
+            SELECT d.depends_on_id FROM task_dependencies d JOIN up ON d.task_id = up.id
+            JOIN tasks p ON p.id = d.depends_on_id WHERE p.project_id = ? AND p.is_complete = 0
+        ),
+        down(id) AS (
+            SELECT id FROM up
+            UNION
+            SELECT d.task_id FROM task_dependencies d JOIN down ON d.depends_on_id = down.id
+            JOIN tasks c ON c.id = d.task_id WHERE c.project_id = ? AND c.is_complete = 0
+        )
+        SELECT down.id, down.id IN (SELECT id FROM up), t.critical_path, t.fanout, d.depends_on_id
+        FROM down JOIN tasks t ON t.id = down.id LEFT JOIN task_dependencies d ON d.task_id = down.id
+    ''', [*task_ids, project_id, *task_ids, project_id, project_id, project_id]).fetchall()
+    open_ids = {row[0] for row in rows}
+    current = {row[0]: (row[2], row[3]) for row in rows if row[1]}
+    edges = [(row[0], row[4]) for row in rows if row[4] is not None]
+    values = {t: value for t, value in critical_path_of(open_ids, edges).items() if t in current}
+    return values, current
+
+def update_critical_path(conn, project_id, task_ids=None):
+    """
+    Stores critical_path / fanout on the project's open tasks, which feeds
+    queue_rank (see scheduler.py). With `task_ids` (tasks completed, reopened,
+    created or given a new parent) only the tasks that can have changed are
+    recomputed; removing a dependency needs the whole project. Only changed
+    rows are written. Doesn't commit.
+    """
+    if project_id is None:
+        return 0
+    if task_ids is not None:
+        task_ids = sorted({int(t) for t in task_ids})
+        if not task_ids:
+            return 0
+        # Stay well below SQLite's bound-parameter limit (ids are bound twice)
+        if len(task_ids) > 400:
+            task_ids = None
+    if task_ids is None:
+        values = critical_path(conn, project_id)
+        current = {row[0]: (row[1], row[2]) for row in conn.execute(
+            'SELECT id, critical_path, fanout FROM tasks WHERE project_id = ? AND is_complete = 0', (project_id,))}
+    else:
+        values, current = _affected_critical_path(conn, project_id, task_ids)
+    changed = [(cp, fanout, task_id) for task_id, (cp, fanout) in values.items() if current.get(task_id) != (cp, fanout)]
+    if changed:
+        conn.executemany('UPDATE tasks SET critical_path = ?, fanout = ? WHERE id = ?', changed)
+    return len(changed)
@@ -0,0 +1,407 @@
+import time
+import sqlite3
+import bisect
+import threading
+
+# In-process metrics registry with Prometheus text and JSON output.
+#
+# Task state transitions happen in several processes (UI backend, pool workers,
+# agent windows), so they are recorded in the task_events table by a trigger and
+# folded into the registry incrementally at scrape time. Everything else is
+# observed directly in this process.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600, 14400, 86400)
+DB_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+ITERATION_BUCKETS = (1, 2, 3, 5, 8, 10, 15, 20, 30, 50)
+
+# Board column of a task row, same precedence as get_board_data (backlog is
+# derived from dependencies at read time and counts as todo here)
+STATUS_SQL = '''CASE WHEN {p}is_complete = 1 THEN 'complete'
+                     WHEN {p}is_review = 1 THEN 'review'
+                     WHEN {p}is_failed = 1 THEN 'triage'
+                     WHEN {p}is_inprogress = 1 THEN 'inprogress'
+                     ELSE 'todo' END'''
+
+class _Metric:
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def labels(self, *label_values):
+        return _Bound(self, tuple(str(v) for v in label_values))
+
+    def _key(self, label_values):
+        if len(label_values) != len(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}")
+        return label_values
+
+class _Bound:
+    def __init__(self, metric, label_values):
+        self.metric = metric
+        self.label_values = label_values
+
+    def inc(self, amount=1):
+        self.metric.inc(amount, self.label_values)
+
+    def set(self, value):
+        self.metric.set(value, self.label_values)
+
+    def observe(self, value):
+        self.metric.observe(value, self.label_values)
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, label_values=()):
+        key = self._key(label_values)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [(self.name + "_total", key, value) for key, value in self.values.items()]
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, label_values=()):
+        key = self._key(label_values)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount=1, label_values=()):
+        key = self._key(label_values)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def reset(self):
+        with self.lock:
+            self.values.clear()
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, key, value) for key, value in self.values.items()]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, label_values=()):
+        key = self._key(label_values)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            state["counts"][bisect.bisect_left(self.buckets, value)] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def samples(self):
+        out = []
+        with self.lock:
+            for key, state in self.values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, state["counts"]):
+                    cumulative += count
+                    out.append((self.name + "_bucket", key + (("le", _fmt(bound)),), cumulative))
+                out.append((self.name + "_bucket", key + (("le", "+Inf"),), state["count"]))
+                out.append((self.name + "_sum", key, state["sum"]))
+                out.append((self.name + "_count", key, state["count"]))
+        return out
+
+    def summary(self, key):
+        with self.lock:
+            state = self.values.get(key)
+            if not state:
+                return None
+            return {"count": state["count"], "sum": round(state["sum"], 6),
+                    "avg": round(state["sum"] / state["count"], 6) if state["count"] else 0,
+                    "p50": self._quantile(state, 0.5), "p95": self._quantile(state, 0.95)}
+
+    def _quantile(self, state, q):
+        # Upper bound of the bucket holding the q-th observation
+        target = q * state["count"]
+        cumulative = 0
+        for bound, count in zip(self.buckets, state["counts"]):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return None
+
+def _fmt(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def _register(self, metric):
+        with self.lock:
+            existing = self.metrics.get(metric.name)
+            if existing:
+                return existing
+            self.metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=()):
+        return self._register(Gauge(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def add_collector(self, func):
+        # Called before every scrape to refresh gauges / fold in external events
+        self.collectors.append(func)
+
+    def collect(self):
+        for func in self.collectors:
+            try:
+                func()
+            except Exception as e:
+                print(f"Metrics collector error: {e}")
+
+    def render_prometheus(self):
+        self.collect()
+        lines = []
+        for metric in sorted(self.metrics.values(), key=lambda m: m.name):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for sample_name, key, value in metric.samples():
+                label_pairs = list(zip(metric.label_names, key[:len(metric.label_names)])) + list(key[len(metric.label_names):])
+                if label_pairs:
+                    rendered = ",".join(f'{k}="{_escape(v)}"' for k, v in label_pairs)
+                    lines.append(f"{sample_name}{{{rendered}}} {_fmt(value)}")
+                else:
+                    lines.append(f"{sample_name} {_fmt(value)}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """
+        JSON-friendly view for the UI: plain values for counters/gauges,
+        count/sum/avg/p50/p95 for histograms.
+        """
+        self.collect()
+        out = {}
+        for metric in self.metrics.values():
+            series = []
+            with metric.lock:
+                keys = list(metric.values.keys())
+            for key in keys:
+                labels = dict(zip(metric.label_names, key))
+                if isinstance(metric, Histogram):
+                    series.append({"labels": labels, **(metric.summary(key) or {})})
+                else:
+                    series.append({"labels": labels, "value": metric.values.get(key)})
+            out[metric.name] = {"type": metric.kind, "help": metric.help, "series": series}
+        return out
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+registry = Registry()
+
+# --- Metrics ---
+
+TASK_TRANSITIONS = registry.counter("ralph_task_transitions", "Task moves between board columns", ("from_status", "to_status"))
+TIME_IN_STATUS = registry.histogram("ralph_task_time_in_status_seconds", "Time a task spent in a column before leaving it", ("status",))
+REVIEWS = registry.counter("ralph_reviews", "Review outcomes", ("outcome",))
+RUN_ITERATIONS = registry.histogram("ralph_agent_iterations", "Loop iterations per agent run", ("role",), ITERATION_BUCKETS)
+QUEUE_DEPTH = registry.gauge("ralph_queue_depth", "Tasks per board column (active projects)", ("status",))
+AGENTS_ACTIVE = registry.gauge("ralph_agents_active", "Agents switched on")
+AGENTS_BUSY = registry.gauge("ralph_agents_busy", "Active agents with a run going (coding or review)")
+AGENT_UTILIZATION = registry.gauge("ralph_agent_utilization", "Busy / active agents")
+DB_QUERY_SECONDS = registry.histogram("ralph_db_query_seconds", "SQLite statement latency in this process", ("op",), DB_BUCKETS)
+LLM_REQUEST_SECONDS = registry.histogram("ralph_llm_request_seconds", "Model request latency including rate limiter wait", ("agent",))
+LLM_WAIT_SECONDS = registry.histogram("ralph_llm_limiter_wait_seconds", "Time spent waiting for the rate limiter", ("agent",), DB_BUCKETS + (10, 30, 60))
+
+# --- Schema / event folding ---
+
+def init_metrics_schema(cursor):
+    """
+    Adds tasks.status_since and the task_events log written by a trigger
+    whenever a task changes column.
+    """
+    try: cursor.execute('ALTER TABLE tasks ADD COLUMN status_since TIMESTAMP')
+    except: pass
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS task_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            task_id INTEGER,
+            from_status TEXT,
+            to_status TEXT,
+            seconds_in_status REAL,
+            iterations INTEGER,
+            role TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (task_id) REFERENCES tasks (id)
+        )
+    ''')
+    # The task_state event behind the row (NULL on rows from before it was recorded)
+    try: cursor.execute('ALTER TABLE task_events ADD COLUMN event TEXT')
+    except: pass
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_task_events_task ON task_events (task_id)')
+
+    old_status = STATUS_SQL.format(p="OLD.")
+    new_status = STATUS_SQL.format(p="NEW.")
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS tasks_status_event
+        AFTER UPDATE OF is_inprogress, is_review, is_complete, is_failed ON tasks
+        WHEN ({old_status}) != ({new_status})
+        BEGIN
+            INSERT INTO task_events (task_id, from_status, to_status, seconds_in_status)
+            VALUES (NEW.id, {old_status}, {new_status},
+                    (julianday('now') - julianday(COALESCE(OLD.status_since, OLD.created_at))) * 86400.0);
+            UPDATE tasks SET status_since = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE id = NEW.id;
+        END
+    ''')
+
+def record_run(conn, task_id, role, iterations):
+    """
+    Attaches the agent run's iteration count to the event that ended it.
+    Call right after the status update, in the same transaction (task_state.py
+    does); the task's latest event is the one that update logged.
+    """
+    if iterations is None:
+        return
+    conn.execute('''
+        UPDATE task_events SET iterations = ?, role = ?
+        WHERE id = (SELECT MAX(id) FROM task_events WHERE task_id = ?)
+    ''', (int(iterations), role, task_id))
+
+REVIEW_EVENTS = {"review_approved": "approved", "review_rejected": "rejected"}
+
+def last_event_id(conn, task_id):
+    return conn.execute('SELECT COALESCE(MAX(id), 0) FROM task_events WHERE task_id = ?', (task_id,)).fetchone()[0]
+
+def record_event(conn, task_id, event, since_id):
+    """
+    Names the task_state event on the row its update logged (the task's rows
+    after `since_id`), so a reviewer's verdict can be told from a drag.
+    Call right after the status update, in the same transaction.
+    """
+    conn.execute('UPDATE task_events SET event = ? WHERE task_id = ? AND id > ?', (event, task_id, since_id))
+
+class EventFolder:
+    """
+    Folds new task_events rows into the counters and histograms. Only rows
+    after the last seen id are read, so each scrape costs O(new events).
+    """
+
+    def __init__(self, get_conn):
+        self.get_conn = get_conn
+        self.last_id = 0
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            conn = self.get_conn()
+            try:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT id, from_status, to_status, seconds_in_status, iterations, role, event
+                    FROM task_events WHERE id > ? ORDER BY id
+                ''', (self.last_id,))
+                while True:
+                    rows = cursor.fetchmany(1000)
+                    if not rows:
+                        break
+                    for event_id, from_status, to_status, seconds, iterations, role, event in rows:
+                        self.last_id = event_id
+                        TASK_TRANSITIONS.inc(1, (from_status, to_status))
+                        if seconds is not None and seconds >= 0:
+                            TIME_IN_STATUS.observe(seconds, (from_status,))
+                        if event in REVIEW_EVENTS:
+                            REVIEWS.inc(1, (REVIEW_EVENTS[event],))
+                        elif event is None and from_status == 'review' and to_status != 'inprogress':
+                            # Rows from before events were recorded: best guess
+                            REVIEWS.inc(1, ("approved" if to_status == 'complete' else "rejected",))
+                        if iterations is not None:
+                            RUN_ITERATIONS.observe(iterations, (role or "unknown",))
+            finally:
+                conn.close()
+
+def board_gauges(get_conn):
+    def collect():
+        conn = get_conn()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT {STATUS_SQL.format(p="t.")} AS status, COUNT(*)
+                FROM tasks t JOIN projects p ON p.id = t.project_id
+                WHERE p.status IS NULL OR p.status != 'completed'
+                GROUP BY status
+            ''')
+            counts = dict(cursor.fetchall())
+            for status in ("todo", "inprogress", "review", "triage", "complete"):
+                QUEUE_DEPTH.set(counts.get(status, 0), (status,))
+
+            cursor.execute('SELECT COUNT(*) FROM agents WHERE is_active = 1')
+            active = cursor.fetchone()[0]
+            # Runs by agent (agent_registry.py), so claimed reviews count as well
+            cursor.execute('''
+                SELECT COUNT(DISTINCT a.agent_id) FROM agent_activity a
+                JOIN agents g ON g.id = a.agent_id WHERE g.is_active = 1
+            ''')
+            busy = cursor.fetchone()[0]
+        finally:
+            conn.close()
+        AGENTS_ACTIVE.set(active)
+        AGENTS_BUSY.set(busy)
+        AGENT_UTILIZATION.set(round(min(busy / active, 1.0), 4) if active else 0)
+    return collect
+
+# --- DB latency ---
+
+def _op(sql):
+    word = sql.lstrip().split(None, 1)
+    return word[0].upper() if word else "?"
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, *args):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, *args)
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - start, (_op(sql),))
+
+    def executemany(self, sql, *args):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, *args)
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - start, (_op(sql),))
+
+class TimedConnection(sqlite3.Connection):
+    """
+    sqlite3 connection factory that records statement and commit latency.
+    """
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, *args):
+        return self.cursor().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        return self.cursor().executemany(sql, *args)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - start, ("COMMIT",))
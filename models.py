@@ -0,0 +1,94 @@
+import json
+
+from task_state import status_from_flags
+
+# Compact row records for the hot paths (dispatching agents, building the
+# board). Each record has one slot per column it selects, so a board of tens
+# of thousands of tasks doesn't carry a dict (and every column) per row.
+# Records read like the dicts they replace: task['title'], task.get('x').
+
+class Record:
+    __slots__ = ()
+    TABLE = None
+    COLUMNS = ()
+
+    def __init__(self, *values, **named):
+        for name, value in zip(self.__slots__, values):
+            object.__setattr__(self, name, value)
+        for name in self.__slots__[len(values):]:
+            object.__setattr__(self, name, named.pop(name, None))
+        if named:
+            raise TypeError(f"{type(self).__name__} has no fields {sorted(named)}")
+
+    @classmethod
+    def select(cls, alias=""):
+        # Explicit column list, in slot order, for "SELECT {Task.select('t')} FROM tasks t"
+        prefix = f"{alias}." if alias else ""
+        return ", ".join(prefix + column for column in cls.COLUMNS)
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(*row)
+
+    @classmethod
+    def fetch(cls, conn, record_id):
+        row = conn.execute(f'SELECT {cls.select()} FROM {cls.TABLE} WHERE id = ?', (record_id,)).fetchone()
+        return cls.from_row(row) if row else None
+
+    def __getitem__(self, name):
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name) from None
+
+    def __setitem__(self, name, value):
+        setattr(self, name, value)
+
+    def get(self, name, default=None):
+        return getattr(self, name, default)
+
+    def keys(self):
+        return self.__slots__
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(getattr(self, n) == getattr(other, n) for n in self.__slots__)
+
+    def __repr__(self):
+        return f"{type(self).__name__}(id={getattr(self, 'id', None)!r})"
+
+class Task(Record):
+    TABLE = "tasks"
+    COLUMNS = ("id", "project_id", "title", "description", "success_criteria",
+               "is_inprogress", "is_review", "is_complete", "is_failed",
+               "review_count", "priority", "checks", "dependency_id", "created_at")
+    # working_dir comes from the project, filled in by the caller
+    __slots__ = COLUMNS + ("working_dir",)
+
+    @property
+    def status(self):
+        return status_from_flags(self.is_inprogress, self.is_review, self.is_complete, self.is_failed)
+
+class Agent(Record):
+    TABLE = "agents"
+    COLUMNS = ("id", "name", "role", "system_prompt_key", "show_window", "is_active", "target_queues")
+    __slots__ = COLUMNS
+
+    @property
+    def queues(self):
+        try:
+            return json.loads(self.target_queues or "[]")
+        except ValueError:
+            return []
+
+def fetch_task(conn, task_id):
+    """
+    The task with its project's working_dir, or None.
+    """
+    row = conn.execute(f'''
+        SELECT {Task.select("t")}, p.working_dir FROM tasks t
+        LEFT JOIN projects p ON p.id = t.project_id WHERE t.id = ?
+    ''', (task_id,)).fetchone()
+    return Task.from_row(row) if row else None
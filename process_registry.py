@@ -0,0 +1,285 @@
+import os
+import sys
+import time
+import signal
+import sqlite3
+import threading
+import subprocess
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Which OS processes work on which task, so a run can be stopped: agent_runner.py
+# windows started by the app, and the opencode sessions agents start wherever
+# they run (app, window, pool worker). Every one is started in a process group
+# of its own and stopped as a whole tree. A cancelled task also gets a row in
+# task_cancellations, which the agent loops check between iterations, so a run
+# whose opencode was killed ends instead of starting its next iteration.
+
+# Seconds a process tree gets to exit after SIGTERM before it is killed
+PROCESS_KILL_GRACE_SECONDS = float(os.getenv("PROCESS_KILL_GRACE_SECONDS", 3))
+
+# agent_runner.py --remote has no access to the board's database; it only
+# tracks its own processes (see _local)
+ENABLED = True
+
+def init_process_registry_schema(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS agent_processes (
+            pid INTEGER,
+            task_id INTEGER,
+            pgid INTEGER,
+            kind TEXT,
+            owner_pid INTEGER,
+            started_at REAL,
+            PRIMARY KEY (pid, task_id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_agent_processes_task ON agent_processes (task_id)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS task_cancellations (
+            task_id INTEGER PRIMARY KEY,
+            reason TEXT,
+            requested_at REAL
+        )
+    ''')
+
+def _default_db():
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    conn = sqlite3.connect(os.path.join(base_dir, 'ralphboard.db'))
+    conn.row_factory = sqlite3.Row
+    return conn
+
+_get_conn = _default_db
+
+def configure(get_conn):
+    # Use the caller's get_db so processes land in the same database
+    global _get_conn
+    _get_conn = get_conn
+
+# This process's own children and cancellations, for when the database isn't
+# shared (remote workers) and so a cancel here doesn't wait on a query
+_local = {}
+_local_cancelled = {}
+_lock = threading.Lock()
+
+def _ids(task_ids):
+    return [int(t) for t in (task_ids if isinstance(task_ids, (list, tuple, set)) else [task_ids]) if t is not None]
+
+def popen_kwargs(creationflags=0):
+    """
+    Popen arguments that start the process in a new process group, so it
+    and everything it starts can be stopped together.
+    """
+    if sys.platform == "win32":
+        # CREATE_NEW_PROCESS_GROUP; taskkill /T finds the tree either way
+        return {"creationflags": creationflags | 0x00000200}
+    return {"start_new_session": True}
+
+def _pgid(pid):
+    if sys.platform == "win32":
+        return None
+    try:
+        return os.getpgid(pid)
+    except OSError:
+        return None
+
+def register(task_ids, process, kind="opencode"):
+    """
+    Records that `process` works on `task_ids`. Failures are printed and
+    swallowed; an unregistered process only can't be cancelled.
+    """
+    task_ids = _ids(task_ids)
+    if not task_ids:
+        return
+    pgid = _pgid(process.pid)
+    with _lock:
+        for task_id in task_ids:
+            _local.setdefault(task_id, {})[process.pid] = pgid
+    if not ENABLED:
+        return
+    try:
+        conn = _get_conn()
+        try:
+            now = time.time()
+            conn.executemany('''
+                INSERT OR REPLACE INTO agent_processes (pid, task_id, pgid, kind, owner_pid, started_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', [(process.pid, task_id, pgid, kind, os.getpid(), now) for task_id in task_ids])
+            conn.commit()
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"Process registry update failed: {e}")
+
+def unregister(process):
+    with _lock:
+        for task_id in [t for t, pids in _local.items() if process.pid in pids]:
+            del _local[task_id][process.pid]
+            if not _local[task_id]:
+                del _local[task_id]
+    if not ENABLED:
+        return
+    try:
+        conn = _get_conn()
+        try:
+            conn.execute('DELETE FROM agent_processes WHERE pid = ?', (process.pid,))
+            conn.commit()
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"Process registry update failed: {e}")
+
+def _group_alive(pgid):
+    try:
+        os.killpg(pgid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+def kill_tree(pid, pgid=None, grace=None):
+    """
+    Stops `pid` and everything it started: taskkill /T on Windows, otherwise
+    SIGTERM to its process group and SIGKILL to what is left after `grace`
+    seconds. Never touches this process's own group.
+    """
+    grace = PROCESS_KILL_GRACE_SECONDS if grace is None else grace
+    if sys.platform == "win32":
+        try:
+            subprocess.run(["taskkill", "/T", "/F", "/PID", str(pid)], capture_output=True, timeout=30)
+        except (OSError, subprocess.SubprocessError) as e:
+            print(f"Failed to stop process {pid}: {e}")
+        return
+
+    if pgid is None or pgid == os.getpgid(0):
+        # Not a group of its own (started elsewhere): just the process
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError:
+            pass
+        return
+    try:
+        os.killpg(pgid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+    except PermissionError as e:
+        print(f"Failed to stop process group {pgid}: {e}")
+        return
+    deadline = time.time() + grace
+    while time.time() < deadline:
+        if not _group_alive(pgid):
+            return
+        time.sleep(0.1)
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except OSError:
+        pass
+
+def _kill_all(processes):
+    # Runner windows first, so they can't start another opencode meanwhile
+    killed = set()
+    for pid, pgid, kind in sorted(processes, key=lambda p: p[2] != "runner"):
+        if pid in killed:
+            continue
+        kill_tree(pid, pgid)
+        killed.add(pid)
+    return len(killed)
+
+def _take_local(task_ids, now):
+    """
+    Flags `task_ids` cancelled in this process and detaches them from its
+    children. Returns the children left with no task, to be stopped.
+    """
+    with _lock:
+        for task_id in task_ids:
+            _local_cancelled[task_id] = now
+        pids = {pid: pgid for t in task_ids for pid, pgid in _local.pop(t, {}).items()}
+        # A process still working on other tasks (a batch review) keeps running
+        busy = {pid for pids_of in _local.values() for pid in pids_of}
+    return {(pid, pgid, "opencode") for pid, pgid in pids.items() if pid not in busy}
+
+def cancel(conn, task_ids, reason="cancelled", now=None):
+    """
+    Marks `task_ids` cancelled and stops the processes working on them.
+    A process shared with tasks that aren't cancelled (a batch review) is
+    left running; the cancelled tasks' verdicts are dropped by the run
+    (see cancelled_tasks) and the process is stopped with its last task.
+    Commits first, so the runs see the flag when their opencode dies.
+    Returns the number of processes stopped.
+    """
+    task_ids = _ids(task_ids)
+    if not task_ids:
+        return 0
+    now = time.time() if now is None else now
+    processes = _take_local(task_ids, now)
+    if ENABLED:
+        conn.executemany('INSERT OR REPLACE INTO task_cancellations (task_id, reason, requested_at) VALUES (?, ?, ?)',
+                         [(task_id, reason, now) for task_id in task_ids])
+        placeholders = ",".join("?" for _ in task_ids)
+        rows = conn.execute(f'''
+            SELECT pid, pgid, kind FROM agent_processes p WHERE task_id IN ({placeholders})
+            AND NOT EXISTS (SELECT 1 FROM agent_processes o WHERE o.pid = p.pid AND o.task_id NOT IN ({placeholders}))
+        ''', task_ids + task_ids).fetchall()
+        processes.update((row[0], row[1], row[2]) for row in rows)
+        conn.execute(f'DELETE FROM agent_processes WHERE task_id IN ({placeholders})', task_ids)
+        conn.commit()
+    stopped = _kill_all(processes)
+    if stopped:
+        print(f"DEBUG: Tasks {task_ids} {reason}; stopped {stopped} process(es).")
+    return stopped
+
+def cancel_local(task_ids, reason="cancelled"):
+    # For processes without the board's database (remote workers)
+    task_ids = _ids(task_ids)
+    processes = _take_local(task_ids, time.time())
+    stopped = _kill_all(processes)
+    if stopped:
+        print(f"DEBUG: Tasks {task_ids} {reason}; stopped {stopped} process(es).")
+    return stopped
+
+def kill_owned_by(conn, owner_pid):
+    """
+    Stops processes left behind by `owner_pid` (a window runner or pool
+    worker that exited without cleaning up). Doesn't commit.
+    """
+    if not ENABLED:
+        return 0
+    rows = conn.execute('SELECT DISTINCT pid, pgid, kind FROM agent_processes WHERE owner_pid = ?', (owner_pid,)).fetchall()
+    conn.execute('DELETE FROM agent_processes WHERE owner_pid = ?', (owner_pid,))
+    return _kill_all([(row[0], row[1], row[2]) for row in rows])
+
+def cancelled_tasks(task_ids, since):
+    """
+    Those of `task_ids` cancelled at or after `since` (the start of the
+    caller's run, so earlier runs' cancellations don't count).
+    """
+    task_ids = _ids(task_ids)
+    with _lock:
+        found = {t for t in task_ids if _local_cancelled.get(t, -1) >= since}
+    if not ENABLED or not task_ids:
+        return found
+    try:
+        conn = _get_conn()
+        try:
+            rows = conn.execute(f'''
+                SELECT task_id FROM task_cancellations WHERE requested_at >= ? AND task_id IN ({",".join("?" for _ in task_ids)})
+            ''', [since, *task_ids]).fetchall()
+        finally:
+            conn.close()
+        found.update(row[0] for row in rows)
+    except Exception as e:
+        print(f"Process registry check failed: {e}")
+    return found
+
+def clear(conn):
+    """
+    Forgets the processes of a previous session (at startup). Doesn't commit.
+    """
+    conn.execute('DELETE FROM agent_processes')
+
+def list_processes(conn):
+    now = time.time()
+    rows = conn.execute('SELECT * FROM agent_processes ORDER BY started_at').fetchall()
+    return [{**dict(row), "running_seconds": round(now - (row['started_at'] or now), 1)} for row in rows]
@@ -0,0 +1,232 @@
+import os
+import sys
+import time
+import json
+import pstats
+import sqlite3
+import cProfile
+import threading
+import functools
+from io import StringIO
+from collections import deque, Counter as StackCounter
+from dotenv import load_dotenv
+
+import metrics
+
+load_dotenv()
+
+# Off by default; when off nothing is wrapped and get_db uses the plain timed connection
+ENABLED = os.getenv("PROFILING", "false").lower() == "true"
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 100))
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_LOG", "slow_queries.log")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", 0.005))
+RECENT_SLOW_QUERIES = 200
+
+API_CALL_SECONDS = metrics.registry.histogram("ralph_api_call_seconds", "Exposed function latency (profiling only)", ("function",))
+API_PAYLOAD_BYTES = metrics.registry.histogram(
+    "ralph_api_payload_bytes", "Exposed function argument / result size as JSON (profiling only)",
+    ("function", "direction"), (100, 1000, 10000, 100000, 1000000, 10000000)
+)
+
+_lock = threading.Lock()
+_stats = {}
+_armed = {}
+_last_profiles = {}
+_slow_queries = deque(maxlen=RECENT_SLOW_QUERIES)
+
+def _json_size(value):
+    try:
+        return len(json.dumps(value, default=str))
+    except Exception:
+        return 0
+
+def _record(name, seconds, in_bytes, out_bytes):
+    API_CALL_SECONDS.observe(seconds, (name,))
+    API_PAYLOAD_BYTES.observe(in_bytes, (name, "in"))
+    API_PAYLOAD_BYTES.observe(out_bytes, (name, "out"))
+    with _lock:
+        s = _stats.setdefault(name, {"calls": 0, "errors": 0, "total_s": 0.0, "max_s": 0.0, "in_bytes": 0, "out_bytes": 0})
+        s["calls"] += 1
+        s["total_s"] += seconds
+        s["max_s"] = max(s["max_s"], seconds)
+        s["in_bytes"] += in_bytes
+        s["out_bytes"] += out_bytes
+
+def _wrap(name, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with _lock:
+            mode = _armed.pop(name, None)
+        start = time.perf_counter()
+        try:
+            if mode == "cprofile":
+                result = _run_cprofile(name, func, args, kwargs)
+            elif mode == "sample":
+                result = _run_sampled(name, func, args, kwargs)
+            else:
+                result = func(*args, **kwargs)
+        except Exception:
+            with _lock:
+                _stats.setdefault(name, {"calls": 0, "errors": 0, "total_s": 0.0, "max_s": 0.0, "in_bytes": 0, "out_bytes": 0})["errors"] += 1
+            raise
+        seconds = time.perf_counter() - start
+        _record(name, seconds, _json_size([args, kwargs]), _json_size(result))
+        return result
+    wrapper._profiled = True
+    return wrapper
+
+def install(exposed):
+    """
+    Wraps every function in `exposed` (eel._exposed_functions) in place.
+    Eel looks functions up by name on each call, so this also covers the
+    daemon's HTTP API.
+    """
+    count = 0
+    for name, func in list(exposed.items()):
+        if getattr(func, "_profiled", False):
+            continue
+        exposed[name] = _wrap(name, func)
+        count += 1
+    print(f"DEBUG: Profiling enabled for {count} exposed functions (slow query threshold {SLOW_QUERY_MS}ms).")
+
+def get_stats():
+    with _lock:
+        rows = [{"function": name, **s, "avg_ms": round(s["total_s"] / s["calls"] * 1000, 3) if s["calls"] else 0}
+                for name, s in _stats.items()]
+    rows.sort(key=lambda r: r["total_s"], reverse=True)
+    return rows
+
+def reset_stats():
+    with _lock:
+        _stats.clear()
+        _slow_queries.clear()
+
+# --- On-demand profiles ---
+
+def arm(name, mode="cprofile"):
+    """
+    Profiles the next call of exposed function `name`. The result is written
+    to PROFILE_DIR and kept for get_last_profile(name).
+    """
+    if mode not in ("cprofile", "sample"):
+        raise ValueError("mode must be 'cprofile' or 'sample'")
+    with _lock:
+        _armed[name] = mode
+
+def get_last_profile(name):
+    with _lock:
+        return _last_profiles.get(name)
+
+def _profile_path(name, ext):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    return os.path.join(PROFILE_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.{ext}")
+
+def _run_cprofile(name, func, args, kwargs):
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        path = _profile_path(name, "prof")
+        profiler.dump_stats(path)
+        out = StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(30)
+        with _lock:
+            _last_profiles[name] = {"mode": "cprofile", "path": path, "report": out.getvalue()}
+        print(f"DEBUG: cProfile for {name} written to {path}")
+
+def _run_sampled(name, func, args, kwargs):
+    # Stack sampler for calls where cProfile's per-call overhead skews the picture.
+    # Output is collapsed stacks ("a;b;c count"), ready for flamegraph tools.
+    target = threading.get_ident()
+    stacks = StackCounter()
+    done = threading.Event()
+
+    def sampler():
+        while not done.wait(SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(target)
+            parts = []
+            while frame is not None:
+                code = frame.f_code
+                parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if parts:
+                stacks[";".join(reversed(parts))] += 1
+
+    thread = threading.Thread(target=sampler, daemon=True)
+    thread.start()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        done.set()
+        thread.join()
+        path = _profile_path(name, "folded")
+        report = "\n".join(f"{stack} {count}" for stack, count in stacks.most_common())
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(report + "\n")
+        with _lock:
+            _last_profiles[name] = {"mode": "sample", "path": path, "samples": sum(stacks.values()),
+                                    "report": "\n".join(f"{count:6d}  {stack.rsplit(';', 1)[-1]}" for stack, count in stacks.most_common(30))}
+        print(f"DEBUG: Sampled profile for {name} written to {path}")
+
+# --- Slow query log ---
+
+EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+
+def _log_slow_query(conn, sql, params, seconds):
+    plan = []
+    # executemany has no single parameter set to plan with
+    if params is not None and sql.lstrip().upper().startswith(EXPLAINABLE):
+        try:
+            # Plain cursor: the EXPLAIN itself shouldn't be timed or logged
+            cursor = sqlite3.Cursor(conn)
+            cursor.execute("EXPLAIN QUERY PLAN " + sql, *params)
+            plan = [row[-1] for row in cursor.fetchall()]
+        except Exception as e:
+            plan = [f"(no plan: {e})"]
+    entry = {"at": time.strftime("%Y-%m-%d %H:%M:%S"), "ms": round(seconds * 1000, 2),
+             "sql": " ".join(sql.split()), "plan": plan}
+    with _lock:
+        _slow_queries.append(entry)
+    print(f"SLOW QUERY {entry['ms']}ms: {entry['sql'][:200]}\n  plan: {' | '.join(plan)}")
+    if SLOW_QUERY_LOG:
+        try:
+            with open(SLOW_QUERY_LOG, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+        except Exception:
+            pass
+
+def get_slow_queries():
+    with _lock:
+        return list(_slow_queries)
+
+class ProfiledCursor(metrics.TimedCursor):
+    def execute(self, sql, *args):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, *args)
+        finally:
+            seconds = time.perf_counter() - start
+            if seconds * 1000 >= SLOW_QUERY_MS:
+                _log_slow_query(self.connection, sql, args, seconds)
+
+    def executemany(self, sql, *args):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, *args)
+        finally:
+            seconds = time.perf_counter() - start
+            if seconds * 1000 >= SLOW_QUERY_MS:
+                _log_slow_query(self.connection, sql, None, seconds)
+
+class ProfiledConnection(metrics.TimedConnection):
+    """
+    Timed connection that also logs statements slower than SLOW_QUERY_MS
+    together with their EXPLAIN QUERY PLAN.
+    """
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+# Connection factory for get_db()
+connection_factory = ProfiledConnection if ENABLED else metrics.TimedConnection
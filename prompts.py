@@ -1,3 +1,8 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
 SYSTEM_PROMPTS = {
     "task_generator": """
 You are an expert Frontend Architect and Project Manager. 
@@ -6,9 +11,12 @@ Your goal is to break down a project into a sequence of actionable, atomic tasks
 RULES:
 1. Every task must be specific and actionable.
 2. Tasks should follow a logical progression.
-3. Identify dependencies: if Task B requires Task A to be finished, specify that.
+3. Identify dependencies: if Task B requires Task A to be finished, specify that. A task may depend on several tasks; independent tasks should not depend on each other so they can run in parallel.
 4. Each task should be assigned a relative 'file_path' if applicable.
 5. Return ONLY a JSON list of objects.
+6. Where success can be verified mechanically, add 'checks' (optional):
+   {"type": "file_exists", "path": ...} or {"type": "regex", "path": ..., "pattern": ...},
+   with paths relative to the working directory.
 
 JSON Format:
 [
@@ -16,17 +24,46 @@ JSON Format:
     "title": "Initial repository setup",
     "description": "Initialize a new git repository and create a baseline file structure.",
     "success_criteria": "A .git folder exists and basic directory structure matches the plan.",
-    "dependency_index": null
+    "dependency_indices": []
   },
   {
     "title": "Create index.html",
     "description": "Create the main entry point for the web application.",
     "success_criteria": "index.html file exists in the root directory.",
-    "dependency_index": 0
+    "checks": [{"type": "file_exists", "path": "index.html"}],
+    "dependency_indices": [0]
+  }
+]
+
+Note: 'dependency_indices' lists the 0-based indices of the tasks in this list that must be completed first.
+""",
+    "epic_planner": """
+You are an expert Software Architect and Project Manager.
+Your goal is to split a large project into epics: coherent areas of work that are each broken down into tasks separately, by someone who only sees the project description and that one epic.
+
+RULES:
+1. Aim for 3-12 epics that together cover the whole project, without overlap.
+2. Each epic's description must say everything needed to plan it: scope, relevant requirements from the project description, interfaces with other epics.
+3. Identify dependencies between epics: if epic B builds on the result of epic A, list A in B's 'dependency_indices'. Independent epics should not depend on each other so they can be worked on in parallel.
+4. Return ONLY a JSON list of objects.
+
+JSON Format:
+[
+  {
+    "title": "Data model and persistence",
+    "description": "Database schema for users and orders, migrations, and a repository layer used by the API.",
+    "success_criteria": "Schema is created on startup and the repository functions are covered by tests.",
+    "dependency_indices": []
+  },
+  {
+    "title": "REST API",
+    "description": "Endpoints for users and orders on top of the repository layer, with validation and error responses.",
+    "success_criteria": "All endpoints respond as specified.",
+    "dependency_indices": [0]
   }
 ]
 
-Note: 'dependency_index' is the 0-based index of the task in this list that must be completed first.
+Note: 'dependency_indices' lists the 0-based indices of the epics in this list that must be completed first.
 """,
     "task_reviewer": """
 You are an expert Code Reviewer and Quality Assurance Engineer.
@@ -46,3 +83,169 @@ Return a JSON object:
 }
 """
 }
+
+# Used by the board itself, not offered as an agent directive
+INTERNAL_PROMPTS = {"epic_planner"}
+
+# Review progress log entries kept in a prompt; later iterations keep the
+# first ones and replace only the tail, so the prefix stays cacheable
+REVIEW_LOG_ENTRIES = int(os.getenv("REVIEW_LOG_ENTRIES", 4))
+
+# Agent loop prompts. Inference servers with prefix caching (vLLM, llama.cpp)
+# only reuse the prefill of a prompt up to its first changed character, so each
+# prompt starts with what never changes (instructions), then the task, then
+# logs that only grow, and ends with what changes every iteration (the
+# iteration number). `python prompts.py` reports how much of each prompt is
+# shared with the previous iteration.
+
+RALPH_INSTRUCTIONS = """You are in an iterative development loop. Work on the task below until you can genuinely complete it.
+
+## Instructions
+1. Read the current state of files to understand what's been done.
+2. Make progress on the task.
+3. Run tests/verification if applicable.
+4. When the task is GENUINELY COMPLETE, output:
+   <promise>COMPLETE</promise>
+
+## Critical Rules
+- ONLY output <promise>COMPLETE</promise> when the task is truly done.
+- Do NOT lie or output false promises to exit the loop.
+- If you failed in previous iterations, analyze the failure log and TRY A DIFFERENT APPROACH.
+- The loop will continue until you succeed or we run out of iterations.
+"""
+
+RALPH_FOLLOWUP_INSTRUCTIONS = """Your previous attempt did not complete the task.
+Re-check the current state of the files and keep working on the same task. If you were stuck, TRY A DIFFERENT APPROACH.
+When the task is GENUINELY COMPLETE, output:
+   <promise>COMPLETE</promise>
+"""
+
+REVIEW_INSTRUCTIONS = """You are a strict QA Reviewer. Your job is to verify if the following task has been completed correctly.
+
+## Instructions
+1. Explore the codebase (list files, read files) to verify the implementation.
+2. Check if the Success Criteria are met in the working directory given below.
+3. If you need more information, use tools to get it.
+4. If the task is GENUINELY COMPLETE and meets all criteria:
+   - Output: <promise>COMPLETE</promise>
+5. If there are issues, bugs, or missing requirements:
+   - List the specific issues clearly.
+   - Output: <promise>REJECTED</promise> (This acts as the fail signal)
+
+## Critical Rules
+- You MUST explicitly output <promise>COMPLETE</promise> or <promise>REJECTED</promise> when you have made a decision.
+- Do NOT just stop without a decision.
+- If you run out of iterations, the review defaults to REJECTED.
+"""
+
+BATCH_REVIEW_INSTRUCTIONS = """You are a strict QA Reviewer. Your job is to verify if each of the tasks below has been completed correctly.
+Review every task on its own merits.
+
+## Instructions
+1. Explore the codebase (list files, read files) to verify each implementation.
+2. Check if each task's Success Criteria are met in the working directory given below.
+3. If you need more information, use tools to get it.
+4. For EVERY task still awaiting a verdict (listed at the end), output exactly one verdict block with its task number:
+   - If the task is GENUINELY COMPLETE and meets all criteria:
+     <verdict task="ID">COMPLETE</verdict>
+   - If there are issues, bugs, or missing requirements:
+     <verdict task="ID">REJECTED
+     - the specific issues for this task
+     </verdict>
+
+## Critical Rules
+- Every task needs its own verdict; issues listed outside a verdict block are not recorded.
+- Tasks without a verdict are reviewed again next iteration.
+- If you run out of iterations, tasks without a verdict default to REJECTED.
+"""
+
+def task_text(task):
+    return f"""Task Title: {task['title']}
+Description: {task.get('description', '')}
+Success Criteria: {task.get('success_criteria', '')}"""
+
+def _log(heading, entries, limit=None):
+    # Logs are append-only so earlier iterations' prompts stay a prefix
+    if limit and len(entries) > limit:
+        entries = entries[:limit - 1] + [f"({len(entries) - limit} iterations omitted)", entries[-1]]
+    return f"\n## {heading}:\n" + "\n".join(entries) + "\n" if entries else ""
+
+def ralph_prompt(task, failure_log, iteration, max_iterations):
+    return f"""{RALPH_INSTRUCTIONS}
+## Your Task
+{task_text(task)}
+{_log("Previous Failed Attempts Log", failure_log)}
+# Ralph Wiggum Loop - Iteration {iteration} / {max_iterations}
+Now, work on the task. Good luck!
+"""
+
+def ralph_followup_prompt(last_failure, iteration, max_iterations):
+    # For a persistent opencode session, which already holds the task
+    return f"""{RALPH_FOLLOWUP_INSTRUCTIONS}
+{last_failure or ""}
+
+# Ralph Wiggum Loop - Iteration {iteration} / {max_iterations}
+"""
+
+def review_prompt(task, working_dir, review_log, iteration, max_iterations):
+    return f"""{REVIEW_INSTRUCTIONS}
+## The Task
+{task_text(task)}
+
+Working directory: {working_dir}
+{_log("Review Progress Log", review_log, REVIEW_LOG_ENTRIES)}
+# Task Review - Iteration {iteration} / {max_iterations}
+Begin your review step.
+"""
+
+def batch_review_prompt(tasks, pending, working_dir, review_log, iteration, max_iterations):
+    # Every task of the batch stays listed; only the awaiting list at the end shrinks
+    sections = "\n\n".join(f"### Task {task_id}\n{task_text(task)}" for task_id, task in tasks.items())
+    return f"""{BATCH_REVIEW_INSTRUCTIONS}
+## The Tasks
+{sections}
+
+Working directory: {working_dir}
+{_log("Review Progress Log", review_log, REVIEW_LOG_ENTRIES)}
+# Batch Task Review - Iteration {iteration} / {max_iterations}
+Tasks awaiting a verdict: {", ".join(str(task_id) for task_id in pending)}
+Begin your review step.
+"""
+
+def shared_prefix_chars(previous, current):
+    """
+    Characters at the start of `current` that are identical to `previous`,
+    roughly what a prefix cache can reuse from the previous request.
+    """
+    limit = min(len(previous or ""), len(current or ""))
+    i = 0
+    while i < limit and previous[i] == current[i]:
+        i += 1
+    return i
+
+def stable_prefix_report(iterations=5, spec_chars=6000):
+    """
+    Builds every loop prompt for a sample task over `iterations` iterations
+    and returns {prompt: [share of each iteration's prompt that is a prefix
+    of the previous one]} for iterations 2..N.
+    """
+    task = {"title": "Sample task", "success_criteria": "All tests pass.",
+            "description": ("Implement the module as specified. " * (spec_chars // 35 + 1))[:spec_chars]}
+    batch = {1: task, 2: dict(task, title="Second task"), 3: dict(task, title="Third task")}
+    attempts = [f"Iteration {i} Result: Did not complete. 2 files changed. Output snippet: ...attempt {i} output..."
+                for i in range(1, iterations + 1)]
+
+    prompts = {
+        "coding": [ralph_prompt(task, attempts[:i - 1], i, iterations) for i in range(1, iterations + 1)],
+        "coding (session follow-up)": [ralph_followup_prompt(attempts[i - 2] if i > 1 else "", i, iterations)
+                                       for i in range(1, iterations + 1)],
+        "review": [review_prompt(task, "/work", attempts[:i - 1], i, iterations) for i in range(1, iterations + 1)],
+        "batch review": [batch_review_prompt(batch, list(batch)[min(i - 1, 2):], "/work", attempts[:i - 1], i, iterations)
+                         for i in range(1, iterations + 1)],
+    }
+    return {name: [round(shared_prefix_chars(texts[i - 1], texts[i]) / len(texts[i]), 3) for i in range(1, len(texts))]
+            for name, texts in prompts.items()}
+
+if __name__ == "__main__":
+    for name, ratios in stable_prefix_report().items():
+        print(f"{name:28} {sum(ratios) / len(ratios):6.1%}  per iteration: {', '.join(f'{r:.1%}' for r in ratios)}")
@@ -0,0 +1,281 @@
+import os
+import time
+import sqlite3
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Limiter Configuration (0 = unlimited)
+MAX_RPS = float(os.getenv("LLM_MAX_RPS", 0))            # Requests per second
+MAX_TPM = int(os.getenv("LLM_MAX_TPM", 0))              # Tokens per minute
+MAX_INFLIGHT = int(os.getenv("LLM_MAX_INFLIGHT", 0))    # Concurrent requests
+INTERACTIVE_RESERVE = int(os.getenv("LLM_INTERACTIVE_RESERVE", 1))  # In-flight slots only interactive calls may take
+LEASE_TTL = float(os.getenv("LLM_LEASE_TTL", 900))      # Seconds before a crashed holder's slot is reclaimed
+SESSION_LEASE_TTL = float(os.getenv("LLM_SESSION_LEASE_TTL", 120))  # Same for opencode sessions, which renew theirs while running
+EST_COMPLETION_TOKENS = int(os.getenv("LLM_EST_COMPLETION_TOKENS", 512))
+
+# State is shared through a small SQLite file so every agent process,
+# window runner and pool worker on this machine sees the same buckets.
+LIMITER_DB = os.getenv("LLM_LIMITER_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "ralph_limiter.db"))
+
+# Lower value = served first
+PRIORITY_INTERACTIVE = 0   # UI-triggered generation / expansion
+PRIORITY_AGENT = 10        # Agent loops
+PRIORITY_BATCH = 20        # Bulk jobs
+
+POLL_INTERVAL = 0.05
+WAITER_STALE_SECONDS = 30
+SLOW_WAIT_SECONDS = 1.0
+
+def estimate_tokens(text):
+    # ~4 characters per token is close enough for budgeting
+    return len(text or "") // 4
+
+class Lease:
+    def __init__(self, limiter, lease_id, est_tokens, wait_seconds):
+        self.limiter = limiter
+        self.lease_id = lease_id
+        self.est_tokens = est_tokens
+        self.wait_seconds = wait_seconds
+        self.actual_tokens = None
+        self.keeper = None
+
+    def keep_alive(self, ttl):
+        """
+        Renews the lease every ttl/3 seconds until it is released, for
+        holders that run longer than any fixed TTL (opencode sessions).
+        A holder that dies stops renewing and its slot is reclaimed.
+        """
+        if not self.limiter or self.lease_id is None or self.keeper:
+            return self
+        stop = threading.Event()
+
+        def renew():
+            while not stop.wait(max(ttl / 3.0, 1.0)):
+                try:
+                    self.limiter._renew(self, ttl)
+                except Exception as e:
+                    print(f"[RateLimiter] Lease renewal failed: {e}")
+
+        thread = threading.Thread(target=renew, daemon=True)
+        self.keeper = (stop, thread)
+        thread.start()
+        return self
+
+    def record_usage(self, total_tokens):
+        self.actual_tokens = total_tokens
+
+    def release(self):
+        if self.keeper:
+            self.keeper[0].set()
+            self.keeper = None
+        if self.limiter and self.lease_id is not None:
+            self.limiter._release(self)
+            self.lease_id = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+class RateLimiter:
+    """
+    Token-bucket limiter for requests/second and tokens/minute plus an
+    in-flight cap, shared across processes through a SQLite file.
+
+    Waiters are queued in (priority, arrival) order and only the head of the
+    queue may take a slot, so interactive calls overtake agent and batch work.
+    Queueing alone doesn't help once agents hold every in-flight slot for a
+    whole opencode session, so `interactive_reserve` slots (never all of
+    them) are kept for interactive calls.
+    """
+
+    def __init__(self, path=LIMITER_DB, max_rps=MAX_RPS, max_tpm=MAX_TPM, max_inflight=MAX_INFLIGHT, lease_ttl=LEASE_TTL,
+                 interactive_reserve=INTERACTIVE_RESERVE):
+        self.path = path
+        self.max_rps = max_rps
+        self.max_tpm = max_tpm
+        self.max_inflight = max_inflight
+        self.interactive_reserve = max(0, min(interactive_reserve, max_inflight - 1))
+        self.lease_ttl = lease_ttl
+        self.enabled = max_rps > 0 or max_tpm > 0 or max_inflight > 0
+        self.local = threading.local()
+        self.stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "total_wait": 0.0, "max_wait": 0.0, "by_priority": {}}
+        if self.enabled:
+            self._init_schema()
+
+    def _db(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self.local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        db = self._db()
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS limiter_state (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                req_tokens REAL,
+                tpm_tokens REAL,
+                updated_at REAL
+            )
+        ''')
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS limiter_leases (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                pid INTEGER,
+                est_tokens INTEGER,
+                expires_at REAL
+            )
+        ''')
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS limiter_waiters (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                priority INTEGER,
+                seen_at REAL
+            )
+        ''')
+        db.execute('CREATE INDEX IF NOT EXISTS idx_limiter_waiters_order ON limiter_waiters (priority, id)')
+        db.execute('INSERT OR IGNORE INTO limiter_state (id, req_tokens, tpm_tokens, updated_at) VALUES (1, ?, ?, ?)',
+                   (max(self.max_rps, 1), self.max_tpm, time.time()))
+
+    def _refill(self, db, now):
+        req_tokens, tpm_tokens, updated_at = db.execute('SELECT req_tokens, tpm_tokens, updated_at FROM limiter_state WHERE id = 1').fetchone()
+        elapsed = max(0.0, now - updated_at)
+        if self.max_rps > 0:
+            req_tokens = min(max(self.max_rps, 1), req_tokens + elapsed * self.max_rps)
+        if self.max_tpm > 0:
+            tpm_tokens = min(self.max_tpm, tpm_tokens + elapsed * self.max_tpm / 60.0)
+        return req_tokens, tpm_tokens
+
+    def acquire(self, priority=PRIORITY_AGENT, tokens=0, ttl=None):
+        """
+        Blocks until a request slot is available and returns a Lease.
+        Use as a context manager so the in-flight slot is always released.
+        `ttl` overrides how long the slot is held if it is never released.
+        """
+        if not self.enabled:
+            return Lease(None, None, tokens, 0.0)
+
+        start = time.time()
+        db = self._db()
+        waiter_id = db.execute('INSERT INTO limiter_waiters (priority, seen_at) VALUES (?, ?)', (priority, start)).lastrowid
+        # A single request larger than the whole bucket would never fit
+        needed_tpm = min(tokens, self.max_tpm) if self.max_tpm > 0 else 0
+        max_inflight = self.max_inflight if priority <= PRIORITY_INTERACTIVE else self.max_inflight - self.interactive_reserve
+
+        try:
+            while True:
+                delay = POLL_INTERVAL
+                lease = None
+                db.execute('BEGIN IMMEDIATE')
+                try:
+                    now = time.time()
+                    db.execute('DELETE FROM limiter_leases WHERE expires_at < ?', (now,))
+                    db.execute('DELETE FROM limiter_waiters WHERE seen_at < ? AND id != ?', (now - WAITER_STALE_SECONDS, waiter_id))
+                    if db.execute('UPDATE limiter_waiters SET seen_at = ? WHERE id = ?', (now, waiter_id)).rowcount == 0:
+                        waiter_id = db.execute('INSERT INTO limiter_waiters (priority, seen_at) VALUES (?, ?)', (priority, now)).lastrowid
+
+                    head = db.execute('SELECT id FROM limiter_waiters ORDER BY priority, id LIMIT 1').fetchone()[0]
+                    if head == waiter_id:
+                        req_tokens, tpm_tokens = self._refill(db, now)
+                        inflight = db.execute('SELECT COUNT(*) FROM limiter_leases').fetchone()[0]
+
+                        inflight_ok = self.max_inflight <= 0 or inflight < max_inflight
+                        rps_ok = self.max_rps <= 0 or req_tokens >= 1
+                        tpm_ok = self.max_tpm <= 0 or tpm_tokens >= needed_tpm
+
+                        if inflight_ok and rps_ok and tpm_ok:
+                            if self.max_rps > 0: req_tokens -= 1
+                            if self.max_tpm > 0: tpm_tokens -= tokens
+                            db.execute('UPDATE limiter_state SET req_tokens = ?, tpm_tokens = ?, updated_at = ? WHERE id = 1',
+                                       (req_tokens, tpm_tokens, now))
+                            lease_id = db.execute('INSERT INTO limiter_leases (pid, est_tokens, expires_at) VALUES (?, ?, ?)',
+                                                  (os.getpid(), tokens, now + (ttl or self.lease_ttl))).lastrowid
+                            db.execute('DELETE FROM limiter_waiters WHERE id = ?', (waiter_id,))
+                            lease = Lease(self, lease_id, tokens, now - start)
+                        else:
+                            # Sleep about as long as the bucket needs to refill
+                            if not rps_ok:
+                                delay = max(delay, (1 - req_tokens) / self.max_rps)
+                            if not tpm_ok:
+                                delay = max(delay, (needed_tpm - tpm_tokens) / (self.max_tpm / 60.0))
+                    db.execute('COMMIT')
+                except:
+                    db.execute('ROLLBACK')
+                    raise
+
+                if lease:
+                    waiter_id = None
+                    self._record_wait(priority, lease.wait_seconds)
+                    return lease
+                time.sleep(min(delay, 1.0))
+        finally:
+            if waiter_id is not None:
+                try:
+                    db.execute('DELETE FROM limiter_waiters WHERE id = ?', (waiter_id,))
+                except Exception:
+                    pass
+
+    def _renew(self, lease, ttl):
+        # Runs on the keeper thread, which gets its own connection
+        self._db().execute('UPDATE limiter_leases SET expires_at = ? WHERE id = ?', (time.time() + ttl, lease.lease_id))
+
+    def _release(self, lease):
+        db = self._db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.execute('DELETE FROM limiter_leases WHERE id = ?', (lease.lease_id,))
+            if self.max_tpm > 0 and lease.actual_tokens is not None:
+                # Settle the estimate against real usage
+                db.execute('UPDATE limiter_state SET tpm_tokens = MIN(?, tpm_tokens + ?) WHERE id = 1',
+                           (self.max_tpm, lease.est_tokens - lease.actual_tokens))
+            db.execute('COMMIT')
+        except:
+            db.execute('ROLLBACK')
+            raise
+
+    def _record_wait(self, priority, wait):
+        with self.stats_lock:
+            self.stats["requests"] += 1
+            self.stats["total_wait"] += wait
+            self.stats["max_wait"] = max(self.stats["max_wait"], wait)
+            bucket = self.stats["by_priority"].setdefault(str(priority), {"requests": 0, "total_wait": 0.0})
+            bucket["requests"] += 1
+            bucket["total_wait"] += wait
+        if wait >= SLOW_WAIT_SECONDS:
+            print(f"[RateLimiter] Waited {wait:.2f}s for a model slot (priority {priority})")
+
+    def get_stats(self):
+        with self.stats_lock:
+            stats = {
+                "enabled": self.enabled,
+                "max_rps": self.max_rps,
+                "max_tpm": self.max_tpm,
+                "max_inflight": self.max_inflight,
+                "interactive_reserve": self.interactive_reserve,
+                "requests": self.stats["requests"],
+                "avg_wait": self.stats["total_wait"] / self.stats["requests"] if self.stats["requests"] else 0.0,
+                "max_wait": self.stats["max_wait"],
+                "by_priority": {k: dict(v) for k, v in self.stats["by_priority"].items()}
+            }
+        if self.enabled:
+            db = self._db()
+            stats["inflight"] = db.execute('SELECT COUNT(*) FROM limiter_leases WHERE expires_at >= ?', (time.time(),)).fetchone()[0]
+            stats["waiting"] = db.execute('SELECT COUNT(*) FROM limiter_waiters').fetchone()[0]
+        return stats
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+def get_limiter():
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter()
+    return _limiter
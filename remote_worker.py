@@ -0,0 +1,224 @@
+import os
+import sys
+import time
+import json
+import socket
+import threading
+import traceback
+import subprocess
+import urllib.request
+import urllib.error
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# agent_runner.py --remote: runs agents on this machine for a coordinator
+# (app.py / daemon.py) elsewhere. The coordinator hands out leased tasks over
+# its HTTP/JSON API; the code travels through the project's git remote.
+REMOTE_WORKSPACE_ROOT = os.getenv("REMOTE_WORKSPACE_ROOT", os.path.join(os.path.expanduser("~"), ".ralphboard", "workspaces"))
+REMOTE_POLL_SECONDS = float(os.getenv("REMOTE_POLL_SECONDS", 5))
+REMOTE_HEARTBEAT_SECONDS = float(os.getenv("REMOTE_HEARTBEAT_SECONDS", 20))
+REMOTE_HTTP_TIMEOUT = float(os.getenv("REMOTE_HTTP_TIMEOUT", 30))
+REMOTE_PUSH_ATTEMPTS = 3
+# The coordinator's shared API token (daemon.py)
+RALPH_API_TOKEN = os.getenv("RALPH_API_TOKEN", "")
+
+class CoordinatorError(Exception):
+    pass
+
+class CoordinatorClient:
+    def __init__(self, url, timeout=REMOTE_HTTP_TIMEOUT, token=RALPH_API_TOKEN):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.token = token
+
+    def call(self, name, *args, **kwargs):
+        body = json.dumps({"args": list(args), "kwargs": kwargs}, default=str).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        request = urllib.request.Request(f"{self.url}/api/{name}", data=body, method="POST", headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read() or b"null")
+        except urllib.error.HTTPError as e:
+            raise CoordinatorError(f"{name}: HTTP {e.code} {e.read()[:200]!r}")
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            raise CoordinatorError(f"{name}: {e}")
+
+class OutputTee:
+    """
+    Stands in for sys.stdout: writes through and keeps what was written
+    since the last drain() for the next heartbeat.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffer = []
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        with self.lock:
+            self.buffer.append(text)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def drain(self):
+        with self.lock:
+            text, self.buffer = "".join(self.buffer), []
+        return text
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+def _git(cwd, *args, check=True):
+    result = subprocess.run(["git", *args], cwd=cwd, capture_output=True, text=True)
+    if check and result.returncode != 0:
+        raise RuntimeError(f"git {' '.join(args)} failed: {(result.stderr or result.stdout).strip()}")
+    return result
+
+class RemoteWorker:
+    """
+    Claims tasks for one agent from the coordinator, runs them here and
+    reports the result. While a task runs, a heartbeat thread renews the
+    lease and streams new output; if the lease is lost the result is
+    dropped by the coordinator.
+
+    Workspace sync: each project is cloned once under REMOTE_WORKSPACE_ROOT
+    and reset to the coordinator's branch before every task. Coding results
+    are committed and pushed back to that branch (rebasing on conflicts).
+    """
+
+    def __init__(self, url, agent_id, worker_id=None, workspace_root=REMOTE_WORKSPACE_ROOT,
+                 poll_seconds=REMOTE_POLL_SECONDS, heartbeat_seconds=REMOTE_HEARTBEAT_SECONDS):
+        self.client = CoordinatorClient(url)
+        self.agent_id = agent_id
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.workspace_root = workspace_root
+        self.poll_seconds = poll_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.agent_cache = {}
+        self.output = None
+
+    def run(self, once=False):
+        print(f"Remote worker {self.worker_id} serving agent {self.agent_id} from {self.client.url}")
+        self.output = OutputTee(sys.stdout)
+        sys.stdout = self.output
+        try:
+            while True:
+                try:
+                    worked = self.run_one()
+                except CoordinatorError as e:
+                    print(f"Coordinator unreachable: {e}")
+                    worked = False
+                if once:
+                    return worked
+                if not worked:
+                    time.sleep(self.poll_seconds)
+        except KeyboardInterrupt:
+            print("Remote worker stopped")
+        finally:
+            sys.stdout = self.output.stream
+
+    def run_one(self):
+        """
+        Claims and runs one task. Returns False when there was no work.
+        """
+        lease = self.client.call("remote_claim", worker_id=self.worker_id, agent_id=self.agent_id)
+        if not lease or not lease.get("success"):
+            return False
+
+        task, agent_data = lease["task"], lease["agent"]
+        print(f"--- Task {task['id']}: {task['title']} (lease {lease['lease_id'][:8]}) ---")
+        if self.output:
+            self.output.drain()
+        stop = threading.Event()
+        lost = threading.Event()
+        beat = threading.Thread(target=self._heartbeat, args=(lease["lease_id"], task['id'], stop, lost), daemon=True)
+        beat.start()
+
+        event, params = "fail", {}
+        try:
+            import agent_runner
+            class_name = agent_data.get('role', 'CodingAgent')
+            task['working_dir'] = self.sync_workspace(task, lease.get("git"))
+            agent = agent_runner.get_agent(agent_data, self.agent_cache, show_window=False)
+            result = agent.work_on_task(task)
+            # Checks run here, in this worker's checkout
+            _, event, params = agent_runner.result_transition(task, class_name, result)
+            if class_name != "ReviewerAgent" and lease.get("git") and not lost.is_set():
+                commit_sha = self.publish(task['working_dir'], task, lease["git"])
+                if commit_sha:
+                    params = {**params, "commit": commit_sha}
+        except Exception as e:
+            print(f"\nCRITICAL ERROR: {e}")
+            traceback.print_exc()
+            event, params = "fail", {}
+        finally:
+            stop.set()
+            beat.join()
+
+        reply = self.client.call("remote_submit", lease_id=lease["lease_id"], event=event, params=params,
+                                 progress=self.output.drain() if self.output else None)
+        if not reply or not reply.get("success"):
+            print(f"Result for task {task['id']} not accepted: {(reply or {}).get('message')}")
+        return True
+
+    def _heartbeat(self, lease_id, task_id, stop, lost):
+        while not stop.wait(self.heartbeat_seconds):
+            try:
+                reply = self.client.call("remote_heartbeat", lease_id=lease_id,
+                                         progress=self.output.drain() if self.output else None)
+            except CoordinatorError as e:
+                # Keep working; the lease survives a few missed beats
+                print(f"Heartbeat failed: {e}")
+                continue
+            if not reply.get("success"):
+                # Dragged away, cancelled or expired: stop working on it
+                print(f"Lease lost: {reply.get('message')}")
+                lost.set()
+                import process_registry
+                process_registry.cancel_local(task_id, "lease lost")
+                return
+
+    def sync_workspace(self, task, git):
+        """
+        Returns the local working directory for the task, reset to the
+        coordinator's branch. Without a git remote the coordinator's path is
+        used as is (e.g. a shared filesystem).
+        """
+        if not git:
+            working_dir = task.get('working_dir')
+            if not working_dir or not os.path.isdir(working_dir):
+                raise RuntimeError(f"Project has no git remote and {working_dir!r} isn't available on this machine")
+            return working_dir
+
+        workspace = os.path.join(self.workspace_root, f"project-{task['project_id']}")
+        if not os.path.isdir(os.path.join(workspace, ".git")):
+            os.makedirs(self.workspace_root, exist_ok=True)
+            _git(self.workspace_root, "clone", git["url"], workspace)
+        _git(workspace, "fetch", "origin")
+        _git(workspace, "checkout", "-B", git["branch"], f"origin/{git['branch']}")
+        _git(workspace, "reset", "--hard", f"origin/{git['branch']}")
+        _git(workspace, "clean", "-fd")
+        return workspace
+
+    def publish(self, workspace, task, git):
+        # Commit whatever the agent changed and push it to the coordinator's branch
+        _git(workspace, "add", "-A")
+        if _git(workspace, "diff", "--cached", "--quiet", check=False).returncode == 0:
+            return None
+        identity = []
+        if _git(workspace, "config", "user.email", check=False).returncode != 0:
+            identity = ["-c", "user.name=RalphBoard", "-c", f"user.email=ralphboard@{socket.gethostname()}"]
+        _git(workspace, *identity, "commit", "-q", "-m", f"RalphBoard task {task['id']}: {task['title']}")
+        for attempt in range(REMOTE_PUSH_ATTEMPTS):
+            if _git(workspace, "push", "origin", f"HEAD:{git['branch']}", check=False).returncode == 0:
+                sha = _git(workspace, "rev-parse", "HEAD").stdout.strip()
+                print(f"DEBUG: Pushed task {task['id']} as {sha[:10]}")
+                return sha
+            # Someone else pushed first
+            _git(workspace, *identity, "pull", "--rebase", "origin", git["branch"])
+        raise RuntimeError(f"Couldn't push task {task['id']} after {REMOTE_PUSH_ATTEMPTS} attempts")
@@ -0,0 +1,314 @@
+import os
+import time
+import queue
+import sqlite3
+import threading
+import atexit
+from dotenv import load_dotenv
+
+from prompts import shared_prefix_chars
+
+load_dotenv()
+
+# Iteration rows are queued and written by a background thread in batches
+RUN_TRACE_ENABLED = os.getenv("RUN_TRACE", "true").lower() == "true"
+RUN_TRACE_FLUSH_SECONDS = float(os.getenv("RUN_TRACE_FLUSH_SECONDS", 2))
+RUN_TRACE_BATCH = 200
+
+MARKERS = ("COMPLETE", "REJECTED")
+
+def init_run_trace_schema(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS task_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            task_id INTEGER,
+            agent_name TEXT,
+            role TEXT,
+            max_iterations INTEGER,
+            iterations INTEGER DEFAULT 0,
+            outcome TEXT,
+            started_at REAL,
+            ended_at REAL,
+            FOREIGN KEY (task_id) REFERENCES tasks (id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS run_iterations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            run_id INTEGER,
+            iteration INTEGER,
+            started_at REAL,
+            ended_at REAL,
+            exit_code INTEGER,
+            prompt_chars INTEGER,
+            output_chars INTEGER,
+            marker TEXT,
+            error TEXT,
+            FOREIGN KEY (run_id) REFERENCES task_runs (id)
+        )
+    ''')
+    try: cursor.execute('ALTER TABLE run_iterations ADD COLUMN files_changed INTEGER')
+    except: pass
+    # Leading characters of the prompt shared with the previous iteration's (prefix-cacheable)
+    try: cursor.execute('ALTER TABLE run_iterations ADD COLUMN prefix_chars INTEGER')
+    except: pass
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_task_runs_task ON task_runs (task_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_run_iterations_run ON run_iterations (run_id)')
+
+def _default_db():
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    conn = sqlite3.connect(os.path.join(base_dir, 'ralphboard.db'))
+    conn.row_factory = sqlite3.Row
+    return conn
+
+_get_conn = _default_db
+
+def configure(get_conn):
+    # Use the caller's get_db so traces land in the same database
+    global _get_conn
+    _get_conn = get_conn
+
+class _Writer:
+    """
+    Background thread that drains queued (sql, params) rows and writes them
+    with executemany in one transaction per batch.
+    """
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def put(self, sql, params):
+        self._ensure_started()
+        self.queue.put((sql, params))
+
+    def flush(self, timeout=10):
+        # Blocks until everything queued so far is written
+        if self.thread is None:
+            return
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait(timeout)
+
+    def _ensure_started(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                first = self.queue.get(timeout=RUN_TRACE_FLUSH_SECONDS)
+            except queue.Empty:
+                continue
+            items = [first]
+            # Take whatever else has piled up, up to a batch
+            while len(items) < RUN_TRACE_BATCH:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write([i for i in items if not isinstance(i, threading.Event)])
+            for item in items:
+                if isinstance(item, threading.Event):
+                    item.set()
+
+    def _write(self, rows):
+        if not rows:
+            return
+        grouped = {}
+        for sql, params in rows:
+            grouped.setdefault(sql, []).append(params)
+        try:
+            conn = _get_conn()
+            try:
+                for sql, params in grouped.items():
+                    conn.executemany(sql, params)
+                conn.commit()
+            finally:
+                conn.close()
+        except Exception as e:
+            print(f"Run trace write failed ({len(rows)} rows dropped): {e}")
+
+_writer = _Writer()
+atexit.register(_writer.flush)
+
+class RunTrace:
+    """
+    Records one agent run (a coding loop or a review) and its iterations.
+    Tracing problems are printed and swallowed; they never fail the run.
+    """
+
+    def __init__(self, task_id, agent_name, role, max_iterations):
+        self.run_id = None
+        self.iterations = 0
+        self._iteration = None
+        self._last_prompt = None
+        if not RUN_TRACE_ENABLED or task_id is None:
+            return
+        try:
+            # One synchronous insert per run, so iterations can reference its id
+            conn = _get_conn()
+            try:
+                cursor = conn.execute(
+                    'INSERT INTO task_runs (task_id, agent_name, role, max_iterations, started_at) VALUES (?, ?, ?, ?, ?)',
+                    (int(task_id), agent_name, role, max_iterations, time.time())
+                )
+                self.run_id = cursor.lastrowid
+                conn.commit()
+            finally:
+                conn.close()
+        except Exception as e:
+            print(f"Run trace disabled for this run: {e}")
+
+    def iteration_started(self, iteration, prompt):
+        prefix_chars = shared_prefix_chars(self._last_prompt, prompt) if self._last_prompt is not None else None
+        self._last_prompt = prompt
+        self._iteration = (iteration, time.time(), len(prompt or ""), prefix_chars)
+
+    def iteration_finished(self, exit_code=None, output="", error=None, files_changed=None, marker=None):
+        # `marker` overrides the <promise> scan (batch reviews give per-task verdicts)
+        if self._iteration is None:
+            return
+        iteration, started_at, prompt_chars, prefix_chars = self._iteration
+        self._iteration = None
+        self.iterations = iteration
+        if self.run_id is None:
+            return
+        if marker is None:
+            marker = next((m for m in MARKERS if f"<promise>{m}</promise>" in (output or "")), None)
+        _writer.put(
+            'INSERT INTO run_iterations (run_id, iteration, started_at, ended_at, exit_code, prompt_chars, prefix_chars, output_chars, marker, error, files_changed) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (self.run_id, iteration, started_at, time.time(), exit_code, prompt_chars, prefix_chars, len(output or ""), marker, error, files_changed)
+        )
+
+    def finish(self, outcome):
+        if self.run_id is None:
+            return
+        _writer.put(
+            'UPDATE task_runs SET outcome = ?, iterations = ?, ended_at = ? WHERE id = ?',
+            (outcome, self.iterations, time.time(), self.run_id)
+        )
+        _writer.flush()
+
+def start_run(task, agent_name, role, max_iterations):
+    return RunTrace(task.get('id'), agent_name, role, max_iterations)
+
+# --- Queries ---
+
+def time_per_stage(conn, since_days=None):
+    """
+    Run and iteration durations per role (coding vs review), plus average
+    time tasks wait in each board column (from task_events).
+    """
+    where, params = "WHERE r.ended_at IS NOT NULL", []
+    if since_days:
+        where += " AND r.started_at >= ?"
+        params.append(time.time() - float(since_days) * 86400)
+
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT r.role, COUNT(*) AS runs,
+               SUM(r.ended_at - r.started_at) AS total_seconds,
+               AVG(r.ended_at - r.started_at) AS avg_run_seconds,
+               MAX(r.ended_at - r.started_at) AS max_run_seconds,
+               SUM(r.iterations) AS iterations
+        FROM task_runs r {where}
+        GROUP BY r.role
+    ''', params)
+    roles = [dict(row) for row in cursor.fetchall()]
+
+    cursor.execute(f'''
+        SELECT r.role, AVG(i.ended_at - i.started_at) AS avg_iteration_seconds
+        FROM run_iterations i JOIN task_runs r ON r.id = i.run_id
+        {where}
+        GROUP BY r.role
+    ''', params)
+    per_iteration = {row['role']: row['avg_iteration_seconds'] for row in cursor.fetchall()}
+    for row in roles:
+        row['avg_iteration_seconds'] = per_iteration.get(row['role'])
+
+    cursor.execute('''
+        SELECT from_status AS status, COUNT(*) AS exits, AVG(seconds_in_status) AS avg_seconds
+        FROM task_events GROUP BY from_status
+    ''')
+    columns = [dict(row) for row in cursor.fetchall()]
+    return {"roles": roles, "columns": columns}
+
+def iterations_to_success(conn, since_days=None):
+    """
+    Per agent: runs, success rate and how many iterations successful runs
+    took, with the distribution for tuning MAX_ITERATIONS.
+    """
+    where, params = "WHERE outcome IS NOT NULL", []
+    if since_days:
+        where += " AND started_at >= ?"
+        params.append(time.time() - float(since_days) * 86400)
+
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT agent_name, role, COUNT(*) AS runs,
+               SUM(outcome = 'success') AS successes,
+               AVG(CASE WHEN outcome = 'success' THEN iterations END) AS avg_iterations_to_success,
+               MAX(CASE WHEN outcome = 'success' THEN iterations END) AS max_iterations_to_success,
+               SUM(CASE WHEN outcome != 'success' AND iterations >= max_iterations THEN 1 ELSE 0 END) AS exhausted
+        FROM task_runs {where}
+        GROUP BY agent_name, role
+        ORDER BY runs DESC
+    ''', params)
+    agents = [dict(row) for row in cursor.fetchall()]
+
+    cursor.execute(f'''
+        SELECT agent_name, iterations, COUNT(*) AS runs
+        FROM task_runs {where} AND outcome = 'success'
+        GROUP BY agent_name, iterations
+    ''', params)
+    distribution = {}
+    for row in cursor.fetchall():
+        distribution.setdefault(row['agent_name'], {})[row['iterations']] = row['runs']
+
+    for agent in agents:
+        agent['success_rate'] = round(agent['successes'] / agent['runs'], 4) if agent['runs'] else 0
+        agent['distribution'] = distribution.get(agent['agent_name'], {})
+    return agents
+
+def prompt_prefix_reuse(conn, since_days=None):
+    """
+    Per role: how much of iterations 2..N's prompts repeated the previous
+    iteration's prompt from the start (what a prefix cache can skip).
+    """
+    where, params = "WHERE i.prefix_chars IS NOT NULL", []
+    if since_days:
+        where += " AND r.started_at >= ?"
+        params.append(time.time() - float(since_days) * 86400)
+
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT r.role, COUNT(*) AS iterations,
+               SUM(i.prompt_chars) AS prompt_chars, SUM(i.prefix_chars) AS prefix_chars
+        FROM run_iterations i JOIN task_runs r ON r.id = i.run_id
+        {where}
+        GROUP BY r.role
+    ''', params)
+    roles = [dict(row) for row in cursor.fetchall()]
+    for row in roles:
+        row['prefix_ratio'] = round(row['prefix_chars'] / row['prompt_chars'], 4) if row['prompt_chars'] else None
+    return roles
+
+def get_task_runs(conn, task_id):
+    cursor = conn.cursor()
+    cursor.execute('SELECT * FROM task_runs WHERE task_id = ? ORDER BY id', (task_id,))
+    runs = [dict(row) for row in cursor.fetchall()]
+    if not runs:
+        return []
+    by_id = {run['id']: run for run in runs}
+    for run in runs:
+        run['iteration_log'] = []
+    cursor.execute(f'''
+        SELECT * FROM run_iterations WHERE run_id IN ({",".join("?" for _ in runs)}) ORDER BY run_id, iteration
+    ''', list(by_id))
+    for row in cursor.fetchall():
+        by_id[row['run_id']]['iteration_log'].append(dict(row))
+    return runs
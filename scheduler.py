@@ -0,0 +1,342 @@
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+from rate_limiter import estimate_tokens
+from dependencies import OPEN_DEPENDENCY_SQL
+from agent_registry import AGENT_MAX_RUNS
+
+load_dotenv()
+
+# One priority point is worth this many seconds of waiting.
+# A task created TASK_AGING_SECONDS earlier ties with a task one priority higher,
+# so old work always rises to the top eventually.
+TASK_AGING_SECONDS = int(os.getenv("TASK_AGING_SECONDS", 600))
+
+# Critical-path boost: each further task in the longest chain a task unblocks,
+# and each open task downstream of it, moves it up by this many seconds
+CRITICAL_PATH_SECONDS = int(os.getenv("CRITICAL_PATH_SECONDS", TASK_AGING_SECONDS))
+FANOUT_SECONDS = int(os.getenv("FANOUT_SECONDS", TASK_AGING_SECONDS // 4))
+
+# Backend agent loop (replaces the browser's setInterval when enabled)
+SCHEDULER_INTERVAL = float(os.getenv("SCHEDULER_INTERVAL", 5))
+SCHEDULER_MAX_WORKERS = int(os.getenv("SCHEDULER_MAX_WORKERS", 16))
+
+# Preemption (0 = off): a ready task ranked this many priority points ahead of
+# a local run's task (queue_rank, so aging and critical path count too) takes
+# its agent, once the run has gone on for PREEMPT_MIN_RUN_SECONDS
+PREEMPT_PRIORITY_GAP = int(os.getenv("PREEMPT_PRIORITY_GAP", 0))
+PREEMPT_MIN_RUN_SECONDS = int(os.getenv("PREEMPT_MIN_RUN_SECONDS", 300))
+
+# Review several small tasks of one project in a single reviewer session (1 = off)
+REVIEW_BATCH_SIZE = int(os.getenv("REVIEW_BATCH_SIZE", 1))
+REVIEW_BATCH_MAX_TOKENS = int(os.getenv("REVIEW_BATCH_MAX_TOKENS", 6000))
+
+# Relative share of picks each queue gets when several have work
+DEFAULT_QUEUE_WEIGHTS = {"review": 3, "triage": 1, "todo": 2}
+try:
+    QUEUE_WEIGHTS = {**DEFAULT_QUEUE_WEIGHTS, **json.loads(os.getenv("QUEUE_WEIGHTS") or "{}")}
+except:
+    QUEUE_WEIGHTS = dict(DEFAULT_QUEUE_WEIGHTS)
+
+# Each queue's WHERE clause matches its partial index below, so the pick
+# walks (project_id, queue_rank) and stops at the first row.
+QUEUE_CONDITIONS = {
+    "review": "t.is_review = 1 AND t.is_inprogress = 0",
+    "triage": "t.is_failed = 1 AND t.is_inprogress = 0",
+    "todo": "t.is_complete = 0 AND t.is_review = 0 AND t.is_failed = 0 AND t.is_inprogress = 0"
+}
+
+QUEUE_READY = {
+    "todo": f"AND NOT EXISTS ({OPEN_DEPENDENCY_SQL})"
+}
+
+def queue_rank_sql(prefix):
+    # Lower rank = picked sooner
+    return (f"CAST(strftime('%s', {prefix}created_at) AS INTEGER) - COALESCE({prefix}priority, 0) * {TASK_AGING_SECONDS}"
+            f" - (COALESCE({prefix}critical_path, 1) - 1) * {CRITICAL_PATH_SECONDS} - COALESCE({prefix}fanout, 0) * {FANOUT_SECONDS}")
+
+def init_scheduler_schema(cursor):
+    """
+    Adds priority/queue_rank (and critical-path) columns, keeps queue_rank
+    maintained by triggers and creates one partial index per queue.
+    """
+    try: cursor.execute('ALTER TABLE tasks ADD COLUMN priority INTEGER DEFAULT 0')
+    except: pass
+    try: cursor.execute('ALTER TABLE tasks ADD COLUMN queue_rank INTEGER')
+    except: pass
+    try: cursor.execute('ALTER TABLE projects ADD COLUMN weight REAL DEFAULT 1')
+    except: pass
+    # Maintained by dependencies.update_critical_path
+    try: cursor.execute('ALTER TABLE tasks ADD COLUMN critical_path INTEGER DEFAULT 1')
+    except: pass
+    try: cursor.execute('ALTER TABLE tasks ADD COLUMN fanout INTEGER DEFAULT 0')
+    except: pass
+
+    triggers = {
+        "tasks_queue_rank_insert": f'''
+            CREATE TRIGGER tasks_queue_rank_insert AFTER INSERT ON tasks
+            BEGIN
+                UPDATE tasks SET queue_rank = {queue_rank_sql("NEW.")} WHERE id = NEW.id;
+            END''',
+        "tasks_queue_rank_update": f'''
+            CREATE TRIGGER tasks_queue_rank_update AFTER UPDATE OF priority, created_at, critical_path, fanout ON tasks
+            BEGIN
+                UPDATE tasks SET queue_rank = {queue_rank_sql("NEW.")} WHERE id = NEW.id;
+            END'''
+    }
+
+    # Recreate triggers (and re-rank) only when the rank formula or its settings changed
+    rerank = False
+    for name, sql in triggers.items():
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", (name,))
+        row = cursor.fetchone()
+        if row and row[0] == sql.strip():
+            continue
+        cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+        cursor.execute(sql.strip())
+        rerank = True
+
+    if rerank:
+        cursor.execute(f'UPDATE tasks SET queue_rank = {queue_rank_sql("")}')
+    else:
+        cursor.execute(f'UPDATE tasks SET queue_rank = {queue_rank_sql("")} WHERE queue_rank IS NULL')
+
+    for queue, condition in QUEUE_CONDITIONS.items():
+        cursor.execute(f'''
+            CREATE INDEX IF NOT EXISTS idx_tasks_{queue}_queue
+            ON tasks (project_id, queue_rank) WHERE {condition.replace("t.", "")}
+        ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_projects_status ON projects (status)')
+
+class FairShare:
+    """
+    Stride scheduling over (project, queue) pairs.
+
+    Every pair has a virtual "pass"; the pair with the lowest pass is probed
+    first and pays 1 / weight when it is served. Pairs that were idle join at
+    the current virtual time, so they can't bank credit and starve the rest.
+    """
+
+    def __init__(self):
+        self.passes = {}
+        self.virtual_time = 0.0
+        self.lock = threading.Lock()
+
+    def order(self, weighted_keys):
+        with self.lock:
+            vt = self.virtual_time
+            return sorted(
+                weighted_keys,
+                key=lambda kw: (max(self.passes.get(kw[0], vt), vt), -kw[1])
+            )
+
+    def charge(self, key, weight):
+        with self.lock:
+            current = max(self.passes.get(key, self.virtual_time), self.virtual_time)
+            self.virtual_time = current
+            self.passes[key] = current + 1.0 / max(weight, 0.001)
+
+    def forget(self, project_id):
+        with self.lock:
+            for key in [k for k in self.passes if k[0] == project_id]:
+                del self.passes[key]
+
+fair_share = FairShare()
+
+def pick_next_task(conn, queues, share=None):
+    """
+    Returns the id of the next task for an agent watching `queues`, or None.
+    `share` is the FairShare state to use (default: the process-wide one).
+
+    The (project, queue) pair is chosen by weighted fair share among the pairs
+    that have queued tasks (one statement, an EXISTS per project on each
+    queue's partial index), the task inside it by priority with aging and
+    critical path (queue_rank), a LIMIT 1 walk of the same index. A todo
+    pair whose tasks are all blocked is charged like a served one, so it
+    isn't probed first again on the next pick.
+    """
+    queues = [q for q in queues if q in QUEUE_CONDITIONS]
+    if not queues:
+        return None
+    share = share or fair_share
+
+    cursor = conn.cursor()
+    # 'planning': still being generated, its dependencies aren't all in yet
+    cursor.execute(" UNION ALL ".join(f'''
+        SELECT p.id, p.weight, '{queue}' FROM projects p
+        WHERE (p.status IS NULL OR p.status NOT IN ('completed', 'planning'))
+        AND EXISTS (SELECT 1 FROM tasks t WHERE t.project_id = p.id AND {QUEUE_CONDITIONS[queue]})
+    ''' for queue in queues))
+    weighted_keys = [((project_id, queue), (weight if weight is not None else 1) * QUEUE_WEIGHTS.get(queue, 1))
+                     for project_id, weight, queue in cursor.fetchall()]
+
+    for (project_id, queue), weight in share.order(weighted_keys):
+        share.charge((project_id, queue), weight)
+        row = cursor.execute(f'''
+            SELECT t.id FROM tasks t
+            WHERE t.project_id = ? AND {QUEUE_CONDITIONS[queue]}
+            {QUEUE_READY.get(queue, "")}
+            ORDER BY t.queue_rank
+            LIMIT 1
+        ''', (project_id,)).fetchone()
+        if row:
+            return row[0]
+
+    return None
+
+def pick_review_batch(conn, task_id, max_tasks=None, max_tokens=None):
+    """
+    Returns review-ready task ids from the same project as `task_id` (which
+    comes first) to review together in one session, up to REVIEW_BATCH_SIZE
+    tasks and REVIEW_BATCH_MAX_TOKENS of estimated task text.
+    Nothing is claimed here.
+    """
+    max_tasks = REVIEW_BATCH_SIZE if max_tasks is None else max_tasks
+    max_tokens = REVIEW_BATCH_MAX_TOKENS if max_tokens is None else max_tokens
+
+    cursor = conn.cursor()
+    cursor.execute('SELECT id, project_id, title, description, success_criteria FROM tasks WHERE id = ?', (task_id,))
+    first = cursor.fetchone()
+    if not first:
+        return []
+    batch = [first['id']]
+    if max_tasks <= 1 or first['project_id'] is None:
+        return batch
+
+    tokens = _review_tokens(first)
+    cursor.execute(f'''
+        SELECT t.id, t.title, t.description, t.success_criteria FROM tasks t
+        WHERE t.project_id = ? AND {QUEUE_CONDITIONS["review"]} AND t.id != ?
+        ORDER BY t.queue_rank
+        LIMIT ?
+    ''', (first['project_id'], first['id'], max_tasks - 1))
+    for row in cursor.fetchall():
+        cost = _review_tokens(row)
+        if tokens + cost > max_tokens:
+            break
+        batch.append(row['id'])
+        tokens += cost
+    return batch
+
+def preemption_candidates(conn, now=None, gap=None, min_run_seconds=None):
+    """
+    Local runs to stop so their agents take better-ranked waiting work:
+    [(agent_id, task_ids, waiting_task_id)]. A run qualifies when a ready task
+    in one of its agent's queues ranks `gap` priority points ahead of it, it
+    has gone on for `min_run_seconds`, and no idle agent watches that queue.
+    At most one run per queue per call; nothing is stopped here.
+    """
+    gap = PREEMPT_PRIORITY_GAP if gap is None else gap
+    min_run_seconds = PREEMPT_MIN_RUN_SECONDS if min_run_seconds is None else min_run_seconds
+    if gap <= 0:
+        return []
+    now = time.time() if now is None else now
+
+    agents = conn.execute('''
+        SELECT g.id, g.target_queues,
+               (SELECT COUNT(DISTINCT run_id) FROM agent_activity a WHERE a.agent_id = g.id AND a.worker_id IS NULL) AS runs
+        FROM agents g WHERE g.is_active = 1
+    ''').fetchall()
+    queues_of = {}
+    for agent in agents:
+        try:
+            queues_of[agent['id']] = [q for q in json.loads(agent['target_queues'] or "[]") if q in QUEUE_CONDITIONS]
+        except ValueError:
+            queues_of[agent['id']] = []
+    # Queues an agent with spare capacity will serve anyway
+    served = {q for agent in agents if agent['runs'] < AGENT_MAX_RUNS for q in queues_of[agent['id']]}
+
+    waiting = {}
+    for queue in {q for queues in queues_of.values() for q in queues} - served:
+        waiting[queue] = conn.execute(f'''
+            SELECT t.id, t.queue_rank FROM tasks t JOIN projects p ON p.id = t.project_id
+            WHERE (p.status IS NULL OR p.status NOT IN ('completed', 'planning')) AND {QUEUE_CONDITIONS[queue]}
+            {QUEUE_READY.get(queue, "")}
+            ORDER BY t.queue_rank LIMIT 1
+        ''').fetchone()
+
+    # Worst-ranked runs go first
+    runs = conn.execute('''
+        SELECT a.agent_id, GROUP_CONCAT(a.task_id) AS task_ids, MIN(t.queue_rank) AS queue_rank
+        FROM agent_activity a JOIN tasks t ON t.id = a.task_id
+        WHERE a.worker_id IS NULL
+        GROUP BY a.run_id HAVING MIN(a.started_at) <= ?
+        ORDER BY queue_rank DESC
+    ''', (now - min_run_seconds,)).fetchall()
+
+    candidates = []
+    for run in runs:
+        for queue in queues_of.get(run['agent_id'], ()):
+            best = waiting.get(queue)
+            if best is None or best['queue_rank'] is None or run['queue_rank'] is None:
+                continue
+            if run['queue_rank'] - best['queue_rank'] >= gap * TASK_AGING_SECONDS:
+                candidates.append((run['agent_id'], [int(t) for t in str(run['task_ids']).split(",")], best['id']))
+                waiting[queue] = None
+                break
+    return candidates
+
+def _review_tokens(row):
+    return estimate_tokens(f"{row['title']}\n{row['description'] or ''}\n{row['success_criteria'] or ''}")
+
+class AgentLoop:
+    """
+    Polls active agents for work from a background thread, like the UI's
+    setInterval loop but without needing a browser open.
+
+    An agent whose previous find_work call is still running (an in-process
+    run) is skipped, so each agent works on at most one in-process task.
+    """
+
+    def __init__(self, list_active_agents, find_work, interval=SCHEDULER_INTERVAL, max_workers=SCHEDULER_MAX_WORKERS):
+        self.list_active_agents = list_active_agents
+        self.find_work = find_work
+        self.interval = interval
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="agent-loop")
+        self.busy = set()
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        print(f"DEBUG: Backend agent loop started (every {self.interval}s).")
+
+    def stop(self):
+        self.running = False
+        self.executor.shutdown(wait=False)
+
+    def _run(self):
+        while self.running:
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"Agent loop error: {e}")
+            time.sleep(self.interval)
+
+    def tick(self):
+        for agent_id in self.list_active_agents():
+            with self.lock:
+                if agent_id in self.busy:
+                    continue
+                self.busy.add(agent_id)
+            future = self.executor.submit(self.find_work, agent_id)
+            future.add_done_callback(lambda f, a=agent_id: self._done(a, f))
+
+    def _done(self, agent_id, future):
+        with self.lock:
+            self.busy.discard(agent_id)
+        if future.exception():
+            print(f"Agent {agent_id} loop error: {future.exception()}")
+
+    def is_busy(self, agent_id):
+        with self.lock:
+            return agent_id in self.busy
@@ -0,0 +1,183 @@
+import re
+import heapq
+
+# Each source gets an external-content FTS5 table: the text lives once in the
+# real table, the index holds only postings, and triggers keep it in sync.
+FTS_SOURCES = {
+    "task": {
+        "fts": "tasks_fts",
+        "table": "tasks",
+        "columns": ["title", "description", "success_criteria"],
+        "rank": "bm25(10.0, 2.0, 4.0)"
+    },
+    "project": {
+        "fts": "projects_fts",
+        "table": "projects",
+        "columns": ["name", "description"],
+        "rank": "bm25(10.0, 2.0)"
+    },
+    "feedback": {
+        "fts": "feedback_fts",
+        "table": "task_feedback",
+        "columns": ["feedback"],
+        "rank": "bm25(1.0)"
+    }
+}
+
+SNIPPET_TOKENS = 16
+# FTS5 snippet() scores every hit in a document; above this size we cut the
+# snippet around the first match ourselves instead.
+SNIPPET_FTS_MAX_CHARS = 50000
+SNIPPET_CONTEXT_CHARS = 80
+
+def init_search_schema(cursor):
+    """
+    Creates the reviewer feedback table, the FTS5 indexes and their sync triggers.
+    Returns False if this SQLite build has no FTS5.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS task_feedback (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            task_id INTEGER,
+            review_number INTEGER,
+            feedback TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (task_id) REFERENCES tasks (id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_task_feedback_task ON task_feedback (task_id)')
+
+    for source in FTS_SOURCES.values():
+        fts, table, columns = source["fts"], source["table"], source["columns"]
+        cols = ", ".join(columns)
+        new_cols = ", ".join(f"new.{c}" for c in columns)
+        old_cols = ", ".join(f"old.{c}" for c in columns)
+
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts,))
+        exists = cursor.fetchone() is not None
+        if not exists:
+            try:
+                cursor.execute(f'''
+                    CREATE VIRTUAL TABLE {fts} USING fts5(
+                        {cols}, content='{table}', content_rowid='id', tokenize='porter unicode61'
+                    )
+                ''')
+            except Exception as e:
+                print(f"Search disabled, FTS5 not available: {e}")
+                return False
+            cursor.execute(f"INSERT INTO {fts} ({fts}, rank) VALUES ('rank', ?)", (source["rank"],))
+
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN
+                INSERT INTO {fts} (rowid, {cols}) VALUES (new.id, {new_cols});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN
+                INSERT INTO {fts} ({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_cols});
+            END
+        ''')
+        # Only text columns re-index; status flag updates don't touch the index
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {cols} ON {table} BEGIN
+                INSERT INTO {fts} ({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_cols});
+                INSERT INTO {fts} (rowid, {cols}) VALUES (new.id, {new_cols});
+            END
+        ''')
+
+        if not exists:
+            # Index rows that existed before search was added
+            cursor.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+
+    return True
+
+def build_match_query(query):
+    """
+    Turns free text into a safe FTS5 query: every word must match, the last
+    one as a prefix so results show up while typing.
+    """
+    terms = re.findall(r"\w+", query or "", re.UNICODE)
+    if not terms:
+        return None
+    quoted = [f'"{t}"' for t in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+def _fallback_snippet(texts, terms):
+    pattern = re.compile(r"\b(?:" + "|".join(re.escape(t) for t in terms) + r")\w*", re.IGNORECASE)
+    for text in texts:
+        found = pattern.search(text or "")
+        if not found:
+            continue
+        start = max(0, found.start() - SNIPPET_CONTEXT_CHARS)
+        end = min(len(text), found.end() + SNIPPET_CONTEXT_CHARS)
+        window = pattern.sub(lambda m: f"<mark>{m.group(0)}</mark>", text[start:end])
+        return ("…" if start > 0 else "") + window + ("…" if end < len(text) else "")
+    first = next((t for t in texts if t), "")
+    return first[:SNIPPET_CONTEXT_CHARS * 2]
+
+def search(conn, query, page=1, page_size=20, kinds=None, raw=False):
+    """
+    Ranked, paginated search over tasks, projects and reviewer feedback.
+
+    Each index is asked only for its top page * page_size hits (FTS5 stops
+    early on ORDER BY rank LIMIT), the lists are merged by bm25 score and
+    snippets are computed only for the rows on the requested page.
+    """
+    match = query if raw else build_match_query(query)
+    page = max(1, int(page))
+    page_size = max(1, min(int(page_size), 200))
+    kinds = [k for k in (kinds or FTS_SOURCES.keys()) if k in FTS_SOURCES]
+    if not match or not kinds:
+        return {"results": [], "total": 0, "page": page, "page_size": page_size}
+
+    cursor = conn.cursor()
+    depth = page * page_size
+    hits = []
+    total = 0
+    for kind in kinds:
+        fts = FTS_SOURCES[kind]["fts"]
+        cursor.execute(f'SELECT rowid, rank FROM {fts} WHERE {fts} MATCH ? ORDER BY rank LIMIT ?', (match, depth))
+        hits.extend((row[1], kind, row[0]) for row in cursor.fetchall())
+        cursor.execute(f'SELECT COUNT(*) FROM {fts} WHERE {fts} MATCH ?', (match,))
+        total += cursor.fetchone()[0]
+
+    page_hits = heapq.nsmallest(depth, hits)[(page - 1) * page_size:]
+
+    results = []
+    terms = re.findall(r"\w+", query or "", re.UNICODE)
+    for score, kind, rowid in page_hits:
+        source = FTS_SOURCES[kind]
+        fts, columns = source["fts"], source["columns"]
+        length_sql = " + ".join(f"COALESCE(length({c}), 0)" for c in columns)
+        cursor.execute(f'SELECT {length_sql} FROM {source["table"]} WHERE id = ?', (rowid,))
+        if cursor.fetchone()[0] > SNIPPET_FTS_MAX_CHARS and terms:
+            cursor.execute(f'SELECT {", ".join(columns)} FROM {source["table"]} WHERE id = ?', (rowid,))
+            snippet = _fallback_snippet(list(cursor.fetchone()), terms)
+        else:
+            cursor.execute(f'''
+                SELECT snippet({fts}, -1, '<mark>', '</mark>', '…', {SNIPPET_TOKENS})
+                FROM {fts} WHERE {fts} MATCH ? AND rowid = ?
+            ''', (match, rowid))
+            snippet = cursor.fetchone()[0]
+
+        if kind == "task":
+            cursor.execute('SELECT id, project_id, title FROM tasks WHERE id = ?', (rowid,))
+            row = cursor.fetchone()
+            item = {"task_id": row[0], "project_id": row[1], "title": row[2]}
+        elif kind == "project":
+            cursor.execute('SELECT id, name FROM projects WHERE id = ?', (rowid,))
+            row = cursor.fetchone()
+            item = {"task_id": None, "project_id": row[0], "title": row[1]}
+        else:
+            cursor.execute('''
+                SELECT f.task_id, t.project_id, t.title, f.review_number
+                FROM task_feedback f LEFT JOIN tasks t ON t.id = f.task_id
+                WHERE f.id = ?
+            ''', (rowid,))
+            row = cursor.fetchone()
+            item = {"task_id": row[0], "project_id": row[1], "title": row[2], "review_number": row[3]}
+
+        results.append({"kind": kind, "id": rowid, "score": score, "snippet": snippet, **item})
+
+    return {"results": results, "total": total, "page": page, "page_size": page_size}
@@ -0,0 +1,414 @@
+import os
+import sys
+import json
+import math
+import time
+import heapq
+import random
+import sqlite3
+import argparse
+from collections import defaultdict
+from dotenv import load_dotenv
+
+import task_state
+from storage import MemoryStorage
+
+load_dotenv()
+
+# Capacity planning: the board's pipeline (task_state transitions, scheduler
+# picks, dependencies, review retries) runs on a MemoryStorage whose clock is
+# the simulation's, and agent runs are replaced by sampled durations and
+# outcomes. Nothing calls a model; a few thousand tasks take seconds.
+#
+#   python simulator.py --tasks 2000 --coders 4 --reviewers 2
+#   python simulator.py --recorded ralphboard.db --coders 8 --reviewers 2
+
+MAX_ITERATIONS = int(os.getenv("MAX_ITERATIONS", 15))
+MAX_REVIEW_ITERATIONS = int(os.getenv("MAX_REVIEW_ITERATIONS", 5))
+MAX_STALLED_ITERATIONS = int(os.getenv("MAX_STALLED_ITERATIONS", 3))
+
+# The task_state event each recorded run outcome (task_runs.outcome, see
+# agents.py) ends in, as agent_runner.result_transition applies it. Other
+# outcomes (cancelled and preempted runs were cut short by the board, not
+# the agent) aren't sampled.
+CODING_OUTCOMES = {"success": "coding_succeeded", "failure": "coding_failed", "stalled": "coding_failed", "error": "coding_failed"}
+REVIEW_OUTCOMES = {"success": "review_approved", "rejected": "review_rejected", "failure": "review_rejected", "error": "review_rejected"}
+OUTCOMES = {"CodingAgent": CODING_OUTCOMES, "ReviewerAgent": REVIEW_OUTCOMES}
+
+def _lognormal(rng, mean, spread):
+    # Mean `mean`, log-space sigma `spread`
+    if spread <= 0:
+        return mean
+    return rng.lognormvariate(math.log(mean) - spread * spread / 2, spread)
+
+def _iterations(rng, mean, limit):
+    # 1 + geometric, so a run takes `mean` iterations on average
+    count = 1
+    while count < limit and rng.random() > 1.0 / max(mean, 1.0):
+        count += 1
+    return count
+
+class RunModel:
+    """
+    How long agent runs take and how they end.
+
+    Parametric by default: iterations per run are geometric around a mean,
+    iteration durations lognormal; a `stall_rate` share of coding runs stops
+    after MAX_STALLED_ITERATIONS without changes and fails. from_db()
+    samples a board's recorded runs instead (task_runs, run_iterations,
+    task_events) and falls back to the parameters for roles without history.
+    """
+
+    def __init__(self, coding_iteration_seconds=90.0, review_iteration_seconds=60.0,
+                 coding_iterations=3.0, review_iterations=1.5, coding_failure_rate=0.05,
+                 checks_failure_rate=0.1, rejection_rate=0.2, spread=0.5, stall_rate=0.0):
+        self.coding_iteration_seconds = coding_iteration_seconds
+        self.review_iteration_seconds = review_iteration_seconds
+        self.coding_iterations = coding_iterations
+        self.review_iterations = review_iterations
+        self.coding_failure_rate = coding_failure_rate
+        self.checks_failure_rate = checks_failure_rate
+        self.rejection_rate = rejection_rate
+        self.spread = spread
+        self.stall_rate = stall_rate
+        # Recorded samples: role -> [seconds per iteration], role -> [(iterations, outcome)]
+        self.iteration_samples = {}
+        self.run_samples = {}
+
+    @classmethod
+    def from_db(cls, conn, since_days=None, **defaults):
+        model = cls(**defaults)
+        where, params = "", []
+        if since_days:
+            where, params = "AND r.started_at >= ?", [time.time() - float(since_days) * 86400]
+
+        for role, seconds in conn.execute(f'''
+            SELECT r.role, i.ended_at - i.started_at FROM run_iterations i JOIN task_runs r ON r.id = i.run_id
+            WHERE i.ended_at IS NOT NULL AND i.started_at IS NOT NULL {where}
+        ''', params):
+            if seconds is not None and seconds >= 0:
+                model.iteration_samples.setdefault(role, []).append(seconds)
+        for role, iterations, outcome in conn.execute(f'''
+            SELECT r.role, r.iterations, r.outcome FROM task_runs r WHERE r.outcome IS NOT NULL {where}
+        ''', params):
+            if outcome in OUTCOMES.get(role, ()):
+                model.run_samples.setdefault(role, []).append((max(1, iterations or 1), outcome))
+
+        # Checks failures are coding successes the gate sent back (rows from
+        # before task_events.event: coding runs that went back to todo)
+        coding_successes = sum(1 for _, outcome in model.run_samples.get("CodingAgent", ()) if outcome == "success")
+        bounced = conn.execute('''
+            SELECT COUNT(*) FROM task_events
+            WHERE event = 'checks_failed'
+               OR (event IS NULL AND role = 'CodingAgent' AND from_status = 'inprogress' AND to_status = 'todo')
+        ''').fetchone()[0]
+        if coding_successes:
+            model.checks_failure_rate = min(1.0, bounced / coding_successes)
+        return model
+
+    def _duration(self, rng, role, iterations, mean_seconds):
+        samples = self.iteration_samples.get(role)
+        if samples:
+            return sum(rng.choice(samples) for _ in range(iterations))
+        return sum(_lognormal(rng, mean_seconds, self.spread) for _ in range(iterations))
+
+    def coding_run(self, rng):
+        # (seconds, iterations, task_state event)
+        recorded = self.run_samples.get("CodingAgent")
+        if recorded:
+            iterations, outcome = rng.choice(recorded)
+            event = CODING_OUTCOMES[outcome]
+        elif rng.random() < self.stall_rate:
+            iterations, event = min(MAX_STALLED_ITERATIONS, MAX_ITERATIONS), "coding_failed"
+        else:
+            iterations = _iterations(rng, self.coding_iterations, MAX_ITERATIONS)
+            event = "coding_failed" if rng.random() < self.coding_failure_rate else "coding_succeeded"
+        seconds = self._duration(rng, "CodingAgent", iterations, self.coding_iteration_seconds)
+        if event == "coding_failed":
+            return seconds, iterations, event
+        if rng.random() < self.checks_failure_rate:
+            return seconds, iterations, "checks_failed"
+        return seconds, iterations, "coding_succeeded"
+
+    def review_run(self, rng):
+        recorded = self.run_samples.get("ReviewerAgent")
+        if recorded:
+            iterations, outcome = rng.choice(recorded)
+            approved = REVIEW_OUTCOMES[outcome] == "review_approved"
+        else:
+            iterations = _iterations(rng, self.review_iterations, MAX_REVIEW_ITERATIONS)
+            approved = rng.random() >= self.rejection_rate
+        seconds = self._duration(rng, "ReviewerAgent", iterations, self.review_iteration_seconds)
+        return seconds, iterations, "review_approved" if approved else "review_rejected"
+
+def build_workload(store, tasks=1000, projects=4, max_dependencies=2, window=20, seed=0):
+    """
+    Random dependency DAGs: each task depends on up to `max_dependencies`
+    of the `window` tasks created before it in its project. Returns task ids.
+    """
+    rng = random.Random(seed)
+    project_ids = [store.create_project(f"Simulated project {i + 1}") for i in range(projects)]
+    created = {project_id: [] for project_id in project_ids}
+    for i in range(tasks):
+        project_id = project_ids[i % projects]
+        recent = created[project_id][-window:]
+        depends_on = rng.sample(recent, min(len(recent), rng.randint(0, max_dependencies)))
+        created[project_id].append(store.create_task(project_id, f"Task {i + 1}", depends_on=depends_on))
+    return [t for ids in created.values() for t in ids]
+
+def load_workload(store, conn, project_ids=None):
+    """
+    Copies the open tasks of a board's active projects (or `project_ids`),
+    with their dependencies on each other, into `store`. Returns task ids.
+    """
+    if project_ids:
+        placeholders = ",".join("?" for _ in project_ids)
+        projects = conn.execute(f'SELECT id, name, weight FROM projects WHERE id IN ({placeholders})', list(project_ids)).fetchall()
+    else:
+        projects = conn.execute("SELECT id, name, weight FROM projects WHERE status IS NULL OR status != 'completed'").fetchall()
+
+    mapping = {}
+    for project in projects:
+        project_id = store.create_project(project[1], weight=project[2] if project[2] is not None else 1)
+        rows = conn.execute('SELECT id, title, priority FROM tasks WHERE project_id = ? AND is_complete = 0 ORDER BY id', (project[0],)).fetchall()
+        open_ids = {row[0] for row in rows}
+        parents = defaultdict(list)
+        for task_id, depends_on_id in conn.execute('''
+            SELECT d.task_id, d.depends_on_id FROM task_dependencies d JOIN tasks t ON t.id = d.task_id WHERE t.project_id = ?
+        ''', (project[0],)):
+            if task_id in open_ids and depends_on_id in open_ids:
+                parents[task_id].append(depends_on_id)
+
+        # Parents first, so every task is created after what it waits for
+        pending = {row[0]: row for row in rows}
+        while pending:
+            ready = [row for task_id, row in pending.items() if all(p in mapping for p in parents[task_id])]
+            if not ready:
+                # A cycle (hand-edited rows): drop the remaining edges
+                ready, parents = list(pending.values()), defaultdict(list)
+            for row in ready:
+                mapping[row[0]] = store.create_task(project_id, row[1], priority=row[2] or 0,
+                                                    depends_on=[mapping[p] for p in parents[row[0]]])
+                del pending[row[0]]
+    return list(mapping.values())
+
+def _percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def _summary(values):
+    if not values:
+        return {"count": 0, "mean": None, "p50": None, "p95": None, "max": None}
+    return {"count": len(values), "mean": round(sum(values) / len(values), 1),
+            "p50": round(_percentile(values, 0.5), 1), "p95": round(_percentile(values, 0.95), 1),
+            "max": round(max(values), 1)}
+
+class Simulator:
+    """
+    Discrete-event simulation of agents working a board.
+
+    `agents` are dicts like the agents table: {"name", "role", "queues"}. An
+    agent takes one task at a time (claimed through the store, so picks
+    follow scheduler.py); a task claimed from Review gets a review run, any
+    other a coding run. The only events are runs finishing: the result is
+    applied as the task_state event the real runner would apply, and every
+    idle agent looks for work again.
+    """
+
+    def __init__(self, agents, model=None, store=None, seed=0):
+        self.now = 0.0
+        self.store = store if store is not None else MemoryStorage(clock=lambda: self.now)
+        self.agents = [dict(agent, queues=list(agent.get("queues") or ())) for agent in agents]
+        self.model = model or RunModel()
+        self.rng = random.Random(seed)
+        self.events = []
+        self.sequence = 0
+        self.available_since = {}
+        self.waits = defaultdict(list)
+        self.service = defaultdict(list)
+        self.busy = [0.0] * len(self.agents)
+        self.runs = [0] * len(self.agents)
+        self.outcomes = defaultdict(int)
+
+    def _ready(self, task_id):
+        return all(self.store.tasks[p]["is_complete"] for p in self.store.parents[task_id] if p in self.store.tasks)
+
+    def _queued(self, task_id):
+        # Mark when the task became available to its next agent
+        task = self.store.tasks[task_id]
+        if not task["is_complete"] and not task["is_inprogress"] and (task["is_review"] or self._ready(task_id)):
+            self.available_since[task_id] = self.now
+
+    def _dispatch(self, idle):
+        still_idle = []
+        for index in idle:
+            agent = self.agents[index]
+            task_id = self.store.pick_next_task(agent["queues"])
+            if task_id is None:
+                still_idle.append(index)
+                continue
+            stage = self.store.get_task(task_id)["status"]
+            if not self.store.apply_transitions([(task_id, "claim")])[0]["success"]:
+                still_idle.append(index)
+                continue
+            self.waits[stage].append(self.now - self.available_since.pop(task_id, self.now))
+            run = self.model.review_run(self.rng) if stage == "review" else self.model.coding_run(self.rng)
+            self.sequence += 1
+            heapq.heappush(self.events, (self.now + run[0], self.sequence, index, task_id, stage, run))
+        return still_idle
+
+    def run(self, until=None):
+        """
+        Runs until no agent has anything left to do (or virtual time
+        `until`) and returns the report.
+        """
+        started = time.time()
+        for task in self.store.list_tasks():
+            self._queued(task["id"])
+        idle = self._dispatch(list(range(len(self.agents))))
+
+        while self.events:
+            finish_at, _, index, task_id, stage, (seconds, iterations, event) = heapq.heappop(self.events)
+            if until is not None and finish_at > until:
+                self.now = until
+                break
+            self.now = finish_at
+            agent = self.agents[index]
+            self.busy[index] += seconds
+            self.runs[index] += 1
+            self.service["review" if stage == "review" else "coding"].append(seconds)
+            self.outcomes[event] += 1
+
+            params = {"role": agent.get("role"), "iterations": iterations}
+            if event in task_state.BOUNCE_LABELS:
+                params["feedback"] = "Simulated"
+            result = self.store.apply_transitions([(task_id, event, params)])[0]
+            if result["success"]:
+                self._queued(task_id)
+                if result["status"] == "complete":
+                    for child in self.store.children[task_id]:
+                        if child in self.store.tasks:
+                            self._queued(child)
+
+            idle = self._dispatch(idle + [index])
+
+        return self.report(time.time() - started)
+
+    def report(self, wall_seconds=None):
+        makespan = self.now
+        statuses = defaultdict(int)
+        for task in self.store.tasks.values():
+            statuses[task_state.status_from_flags(task["is_inprogress"], task["is_review"], task["is_complete"], task["is_failed"])] += 1
+
+        agents = []
+        roles = defaultdict(lambda: {"agents": 0, "busy_seconds": 0.0, "runs": 0})
+        for index, agent in enumerate(self.agents):
+            agents.append({"name": agent.get("name"), "role": agent.get("role"), "queues": agent["queues"], "runs": self.runs[index],
+                           "busy_seconds": round(self.busy[index], 1),
+                           "utilization": round(self.busy[index] / makespan, 4) if makespan else 0.0})
+            role = roles[agent.get("role")]
+            role["agents"] += 1
+            role["busy_seconds"] += self.busy[index]
+            role["runs"] += self.runs[index]
+        for role in roles.values():
+            role["utilization"] = round(role["busy_seconds"] / (makespan * role["agents"]), 4) if makespan else 0.0
+            role["busy_seconds"] = round(role["busy_seconds"], 1)
+
+        return {
+            "tasks": len(self.store.tasks),
+            "completed": statuses["complete"],
+            "triage": statuses["triage"],
+            # Blocked behind a triaged task, or in a queue no agent watches
+            "stuck": len(self.store.tasks) - statuses["complete"] - statuses["triage"],
+            "makespan_seconds": round(makespan, 1),
+            "makespan_hours": round(makespan / 3600, 2),
+            "tasks_per_hour": round(statuses["complete"] / (makespan / 3600), 2) if makespan else 0.0,
+            "outcomes": dict(self.outcomes),
+            "queue_wait_seconds": {stage: _summary(values) for stage, values in self.waits.items()},
+            "run_seconds": {stage: _summary(values) for stage, values in self.service.items()},
+            "roles": dict(roles),
+            "agents": agents,
+            "wall_seconds": round(wall_seconds, 3) if wall_seconds is not None else None,
+        }
+
+def simulate(coders=4, reviewers=2, tasks=1000, projects=4, model=None, seed=0, triage_agents=0, conn=None, project_ids=None, until=None):
+    """
+    Builds a board (random, or the open tasks of `conn`'s board) and an agent
+    pool, runs it and returns the report.
+    """
+    simulator = Simulator(
+        [{"name": f"coder-{i + 1}", "role": "CodingAgent", "queues": ["todo"]} for i in range(coders)]
+        + [{"name": f"reviewer-{i + 1}", "role": "ReviewerAgent", "queues": ["review"]} for i in range(reviewers)]
+        + [{"name": f"fixer-{i + 1}", "role": "CodingAgent", "queues": ["triage"]} for i in range(triage_agents)],
+        model=model, seed=seed)
+    if conn is not None:
+        load_workload(simulator.store, conn, project_ids)
+    else:
+        build_workload(simulator.store, tasks=tasks, projects=projects, seed=seed)
+    return simulator.run(until=until)
+
+def _print_report(report):
+    print(f"Tasks: {report['tasks']}  completed: {report['completed']}  triage: {report['triage']}  stuck: {report['stuck']}")
+    print(f"Makespan: {report['makespan_hours']} h  throughput: {report['tasks_per_hour']} tasks/h  "
+          f"(simulated in {report['wall_seconds']} s)")
+    print(f"Outcomes: {json.dumps(report['outcomes'])}")
+    for stage, wait in report["queue_wait_seconds"].items():
+        print(f"Wait in {stage:6}  mean {wait['mean']} s  p95 {wait['p95']} s  max {wait['max']} s")
+    for stage, run in report["run_seconds"].items():
+        print(f"Run {stage:6}      mean {run['mean']} s  p95 {run['p95']} s  ({run['count']} runs)")
+    for name, role in report["roles"].items():
+        print(f"{name}: {role['agents']} agents, {role['runs']} runs, utilization {role['utilization']:.1%}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate agents working a RalphBoard to plan capacity.")
+    parser.add_argument("--coders", type=int, default=4)
+    parser.add_argument("--reviewers", type=int, default=2)
+    parser.add_argument("--triage-agents", type=int, default=0, help="Coding agents that also pick up tasks from Triage")
+    parser.add_argument("--tasks", type=int, default=1000)
+    parser.add_argument("--projects", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--coding-iteration-seconds", type=float, default=90.0)
+    parser.add_argument("--review-iteration-seconds", type=float, default=60.0)
+    parser.add_argument("--coding-iterations", type=float, default=3.0, help="Mean iterations per coding run")
+    parser.add_argument("--review-iterations", type=float, default=1.5)
+    parser.add_argument("--rejection-rate", type=float, default=0.2)
+    parser.add_argument("--checks-failure-rate", type=float, default=0.1)
+    parser.add_argument("--coding-failure-rate", type=float, default=0.05)
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="Share of coding runs that stall (MAX_STALLED_ITERATIONS) and fail")
+    parser.add_argument("--max-review-attempts", type=int, help="Overrides MAX_REVIEW_ATTEMPTS")
+    parser.add_argument("--recorded", metavar="DB", help="Sample durations and outcomes from this board's run history")
+    parser.add_argument("--board", action="store_true", help="With --recorded: simulate that board's open tasks")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args(argv)
+
+    if args.max_review_attempts is not None:
+        os.environ["MAX_REVIEW_ATTEMPTS"] = str(args.max_review_attempts)
+    defaults = {"coding_iteration_seconds": args.coding_iteration_seconds, "review_iteration_seconds": args.review_iteration_seconds,
+                "coding_iterations": args.coding_iterations, "review_iterations": args.review_iterations,
+                "rejection_rate": args.rejection_rate, "checks_failure_rate": args.checks_failure_rate,
+                "coding_failure_rate": args.coding_failure_rate, "stall_rate": args.stall_rate}
+
+    conn = None
+    if args.recorded:
+        conn = sqlite3.connect(args.recorded)
+        model = RunModel.from_db(conn, **defaults)
+    else:
+        model = RunModel(**defaults)
+    try:
+        report = simulate(coders=args.coders, reviewers=args.reviewers, tasks=args.tasks, projects=args.projects,
+                          model=model, seed=args.seed, triage_agents=args.triage_agents,
+                          conn=conn if args.board else None)
+    finally:
+        if conn is not None:
+            conn.close()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        _print_report(report)
+    return report
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
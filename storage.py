@@ -0,0 +1,775 @@
+import json
+import time
+import bisect
+import sqlite3
+import itertools
+import threading
+from abc import ABC, abstractmethod
+from collections import defaultdict
+
+import task_state
+import dependencies
+import search_index
+import metrics
+import run_trace
+import coordinator
+import agent_registry
+import process_registry
+import models
+from metrics import STATUS_SQL
+from scheduler import (init_scheduler_schema, pick_next_task, FairShare, QUEUE_CONDITIONS, QUEUE_WEIGHTS,
+                       TASK_AGING_SECONDS, CRITICAL_PATH_SECONDS, FANOUT_SECONDS)
+
+# Repository layer for projects, tasks and agents. SQLiteStorage is the board's
+# database; MemoryStorage keeps everything in dicts with the same queue indexes
+# for benchmarks, simulations and throwaway boards. Both must pass the same
+# tests (tests/test_storage.py).
+
+TASK_FIELDS = ("title", "description", "success_criteria", "priority", "checks", "review_count")
+PROJECT_FIELDS = ("name", "description", "working_dir", "status", "weight")
+AGENT_FIELDS = ("name", "role", "system_prompt_key", "show_window", "is_active", "target_queues")
+
+def connect(path, factory=sqlite3.Connection):
+    # The board's database at `path`, rows by column name
+    conn = sqlite3.connect(path, factory=factory)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def _check_fields(fields, allowed):
+    unknown = set(fields) - set(allowed)
+    if unknown:
+        raise ValueError(f"Can't update {sorted(unknown)}")
+
+def init_schema(conn):
+    """
+    Creates / migrates every table the board uses. Doesn't commit.
+    """
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS projects (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            description TEXT,
+            working_dir TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            project_id INTEGER,
+            title TEXT NOT NULL,
+            description TEXT,
+            success_criteria TEXT,
+            is_inprogress INTEGER DEFAULT 0,
+            is_review INTEGER DEFAULT 0,
+            is_complete INTEGER DEFAULT 0,
+            is_failed INTEGER DEFAULT 0,
+            dependency_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (project_id) REFERENCES projects (id),
+            FOREIGN KEY (dependency_id) REFERENCES tasks (id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS agents (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            role TEXT,
+            system_prompt_key TEXT,
+            status TEXT DEFAULT 'Idle',
+            show_window INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    try: cursor.execute('ALTER TABLE projects ADD COLUMN status TEXT DEFAULT "active"')
+    except: pass
+    try: cursor.execute('ALTER TABLE tasks ADD COLUMN description TEXT')
+    except: pass
+    try: cursor.execute('ALTER TABLE tasks ADD COLUMN success_criteria TEXT')
+    except: pass
+    try: cursor.execute('ALTER TABLE tasks ADD COLUMN is_failed INTEGER DEFAULT 0')
+    except: pass
+    try: cursor.execute('ALTER TABLE agents ADD COLUMN show_window INTEGER DEFAULT 0')
+    except: pass
+    try: cursor.execute('ALTER TABLE agents ADD COLUMN is_active INTEGER DEFAULT 0')
+    except: pass
+    try: cursor.execute('ALTER TABLE agents ADD COLUMN target_queues TEXT')
+    except: pass
+    try: cursor.execute('ALTER TABLE tasks ADD COLUMN review_count INTEGER DEFAULT 0')
+    except: pass
+    try: cursor.execute('ALTER TABLE tasks ADD COLUMN checks TEXT')
+    except: pass
+    init_scheduler_schema(cursor)
+    dependencies.init_dependency_schema(cursor)
+    search_index.init_search_schema(cursor)
+    metrics.init_metrics_schema(cursor)
+    run_trace.init_run_trace_schema(cursor)
+    coordinator.init_coordinator_schema(cursor)
+    agent_registry.init_agent_registry_schema(cursor)
+    process_registry.init_process_registry_schema(cursor)
+
+def refresh_critical_paths(conn):
+    # Whole-board recompute, at backend startup (boards from before
+    # task_dependencies) and after imports
+    for row in conn.execute("SELECT id FROM projects WHERE status IS NULL OR status != 'completed'").fetchall():
+        dependencies.update_critical_path(conn, row[0])
+
+class Storage(ABC):
+    """
+    Projects, tasks and agents as plain dicts (task dicts carry a derived
+    "status"). Status changes are task_state events and raise
+    task_state.InvalidTransition when not allowed; dependencies that would
+    close a cycle raise dependencies.DependencyCycleError.
+    load_task / load_agent return the compact records of models.py that
+    dispatch and runs use (the task carries its project's working_dir).
+    board_tasks() is what the board shows: tasks of projects that aren't
+    completed, with project_name, working_dir and "dependencies" (their
+    parents as {id, title, is_complete}, by id).
+    """
+
+    # Projects
+    @abstractmethod
+    def create_project(self, name, description="", working_dir="", weight=1): ...
+    @abstractmethod
+    def get_project(self, project_id): ...
+    @abstractmethod
+    def list_projects(self, active_only=False, stats=False): ...
+    @abstractmethod
+    def update_project(self, project_id, **fields): ...
+    @abstractmethod
+    def delete_project(self, project_id): ...
+
+    # Tasks
+    @abstractmethod
+    def create_task(self, project_id, title, description="", success_criteria="", priority=0, depends_on=(), checks=None): ...
+    @abstractmethod
+    def get_task(self, task_id): ...
+    @abstractmethod
+    def load_task(self, task_id): ...
+    @abstractmethod
+    def list_tasks(self, project_id=None): ...
+    @abstractmethod
+    def board_tasks(self): ...
+    @abstractmethod
+    def update_task(self, task_id, **fields): ...
+    @abstractmethod
+    def add_dependency(self, task_id, depends_on_id): ...
+    @abstractmethod
+    def set_dependencies(self, task_id, depends_on_ids): ...
+    @abstractmethod
+    def get_dependencies(self, task_id): ...
+    @abstractmethod
+    def apply_transitions(self, transitions): ...
+    @abstractmethod
+    def pick_next_task(self, queues): ...
+    @abstractmethod
+    def task_events(self, task_id=None): ...
+
+    # Agents
+    @abstractmethod
+    def create_agent(self, name, role="CodingAgent", system_prompt_key="coding_agent", target_queues=(), is_active=True, show_window=False): ...
+    @abstractmethod
+    def get_agent(self, agent_id): ...
+    @abstractmethod
+    def load_agent(self, agent_id): ...
+    @abstractmethod
+    def list_agents(self, active_only=False): ...
+    @abstractmethod
+    def update_agent(self, agent_id, **fields): ...
+    @abstractmethod
+    def delete_agent(self, agent_id): ...
+
+    def transition(self, task_id, event, **params):
+        result = self.apply_transitions([(task_id, event, params)])[0]
+        if not result["success"]:
+            raise task_state.InvalidTransition(result["message"])
+        return result
+
+    def claim_next(self, queues):
+        """
+        Picks and claims a task for an agent watching `queues`. Returns the
+        task id, or None when there's nothing (or the claim lost a race).
+        """
+        task_id = self.pick_next_task(queues)
+        if task_id is None:
+            return None
+        return task_id if self.apply_transitions([(task_id, "claim")])[0]["success"] else None
+
+    def close(self):
+        pass
+
+class SQLiteStorage(Storage):
+    def __init__(self, conn, share=None):
+        self.conn = conn
+        self.share = share or FairShare()
+
+    @classmethod
+    def open(cls, path=":memory:", share=None):
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        init_schema(conn)
+        refresh_critical_paths(conn)
+        conn.commit()
+        return cls(conn, share)
+
+    def create_project(self, name, description="", working_dir="", weight=1):
+        cursor = self.conn.execute('INSERT INTO projects (name, description, working_dir, status, weight) VALUES (?, ?, ?, ?, ?)',
+                                   (name, description, working_dir, 'active', weight))
+        self.conn.commit()
+        return cursor.lastrowid
+
+    def get_project(self, project_id):
+        row = self.conn.execute('SELECT * FROM projects WHERE id = ?', (project_id,)).fetchone()
+        return dict(row) if row else None
+
+    def list_projects(self, active_only=False, stats=False):
+        where = "WHERE p.status IS NULL OR p.status != 'completed'" if active_only else ""
+        if not stats:
+            return [dict(row) for row in self.conn.execute(f'SELECT p.* FROM projects p {where} ORDER BY p.id')]
+        return [dict(row) for row in self.conn.execute(f'''
+            SELECT p.*,
+                   COUNT(t.id) as total_tasks,
+                   SUM(CASE WHEN t.is_complete = 1 THEN 1 ELSE 0 END) as completed_tasks
+            FROM projects p
+            LEFT JOIN tasks t ON p.id = t.project_id
+            {where}
+            GROUP BY p.id
+            ORDER BY p.id
+        ''')]
+
+    def update_project(self, project_id, **fields):
+        _check_fields(fields, PROJECT_FIELDS)
+        if fields:
+            self.conn.execute(f'UPDATE projects SET {", ".join(f"{k} = ?" for k in fields)} WHERE id = ?',
+                              (*fields.values(), project_id))
+            self.conn.commit()
+
+    def delete_project(self, project_id):
+        cursor = self.conn.cursor()
+        # Delete tasks first (foreign key might cascade but let's be safe)
+        cursor.execute('DELETE FROM task_feedback WHERE task_id IN (SELECT id FROM tasks WHERE project_id = ?)', (project_id,))
+        cursor.execute('DELETE FROM task_events WHERE task_id IN (SELECT id FROM tasks WHERE project_id = ?)', (project_id,))
+        cursor.execute('DELETE FROM run_iterations WHERE run_id IN (SELECT id FROM task_runs WHERE task_id IN (SELECT id FROM tasks WHERE project_id = ?))', (project_id,))
+        cursor.execute('DELETE FROM task_runs WHERE task_id IN (SELECT id FROM tasks WHERE project_id = ?)', (project_id,))
+        cursor.execute('''
+            DELETE FROM task_dependencies
+            WHERE task_id IN (SELECT id FROM tasks WHERE project_id = ?) OR depends_on_id IN (SELECT id FROM tasks WHERE project_id = ?)
+        ''', (project_id, project_id))
+        cursor.execute('UPDATE tasks SET dependency_id = NULL WHERE dependency_id IN (SELECT id FROM tasks WHERE project_id = ?)', (project_id,))
+        cursor.execute('DELETE FROM tasks WHERE project_id = ?', (project_id,))
+        cursor.execute('DELETE FROM projects WHERE id = ?', (project_id,))
+        self.conn.commit()
+
+    def create_task(self, project_id, title, description="", success_criteria="", priority=0, depends_on=(), checks=None):
+        cursor = self.conn.execute('INSERT INTO tasks (project_id, title, description, success_criteria, priority, checks) VALUES (?, ?, ?, ?, ?, ?)',
+                                   (project_id, title, description, success_criteria, int(priority or 0), checks))
+        task_id = cursor.lastrowid
+        try:
+            for parent in depends_on:
+                dependencies.add_dependency(self.conn, task_id, parent)
+        except Exception:
+            self.conn.rollback()
+            raise
+        task_state.refresh_projects(self.conn, [project_id], [task_id])
+        self.conn.commit()
+        return task_id
+
+    def get_task(self, task_id):
+        row = self.conn.execute(f'SELECT *, {STATUS_SQL.format(p="")} AS status FROM tasks WHERE id = ?', (task_id,)).fetchone()
+        return dict(row) if row else None
+
+    def load_task(self, task_id):
+        return models.fetch_task(self.conn, task_id)
+
+    def list_tasks(self, project_id=None):
+        if project_id is None:
+            rows = self.conn.execute(f'SELECT *, {STATUS_SQL.format(p="")} AS status FROM tasks ORDER BY id')
+        else:
+            rows = self.conn.execute(f'SELECT *, {STATUS_SQL.format(p="")} AS status FROM tasks WHERE project_id = ? ORDER BY id', (project_id,))
+        return [dict(row) for row in rows]
+
+    def board_tasks(self):
+        # Only the columns the board shows (not ranks, timestamps or search data)
+        rows = [dict(row) for row in self.conn.execute(f'''
+            SELECT {models.Task.select("t")}, p.name as project_name, p.working_dir
+            FROM tasks t
+            JOIN projects p ON t.project_id = p.id
+            WHERE p.status != 'completed'
+        ''')]
+        # Dependency edges of the visible tasks, with their parents' titles and state
+        parents = defaultdict(list)
+        for row in self.conn.execute('''
+            SELECT d.task_id, d.depends_on_id, dt.title, dt.is_complete
+            FROM task_dependencies d
+            JOIN tasks t ON t.id = d.task_id
+            JOIN projects p ON t.project_id = p.id
+            JOIN tasks dt ON dt.id = d.depends_on_id
+            WHERE p.status != 'completed'
+            ORDER BY d.depends_on_id
+        '''):
+            parents[row[0]].append({"id": row[1], "title": row[2], "is_complete": row[3]})
+        for row in rows:
+            row["dependencies"] = parents.get(row["id"], [])
+        return rows
+
+    def update_task(self, task_id, **fields):
+        _check_fields(fields, TASK_FIELDS)
+        if fields:
+            self.conn.execute(f'UPDATE tasks SET {", ".join(f"{k} = ?" for k in fields)} WHERE id = ?',
+                              (*fields.values(), task_id))
+            self.conn.commit()
+
+    def add_dependency(self, task_id, depends_on_id):
+        try:
+            dependencies.add_dependency(self.conn, task_id, depends_on_id)
+        except Exception:
+            self.conn.rollback()
+            raise
+        row = self.conn.execute('SELECT project_id FROM tasks WHERE id = ?', (task_id,)).fetchone()
+        task_state.refresh_projects(self.conn, [row[0]] if row else [], [task_id])
+        self.conn.commit()
+
+    def set_dependencies(self, task_id, depends_on_ids):
+        try:
+            dependencies.set_dependencies(self.conn, task_id, depends_on_ids)
+        except Exception:
+            self.conn.rollback()
+            raise
+        # Removed parents can shorten paths anywhere upstream: whole project
+        row = self.conn.execute('SELECT project_id FROM tasks WHERE id = ?', (task_id,)).fetchone()
+        task_state.refresh_projects(self.conn, [row[0]] if row else [])
+        self.conn.commit()
+
+    def get_dependencies(self, task_id):
+        return dependencies.get_dependencies(self.conn, [task_id])[int(task_id)]
+
+    def apply_transitions(self, transitions):
+        return task_state.apply_transitions(self.conn, transitions)
+
+    def pick_next_task(self, queues):
+        return pick_next_task(self.conn, queues, self.share)
+
+    def task_events(self, task_id=None):
+        if task_id is None:
+            rows = self.conn.execute('SELECT task_id, from_status, to_status, iterations, role FROM task_events ORDER BY id')
+        else:
+            rows = self.conn.execute('SELECT task_id, from_status, to_status, iterations, role FROM task_events WHERE task_id = ? ORDER BY id', (task_id,))
+        return [dict(row) for row in rows]
+
+    def create_agent(self, name, role="CodingAgent", system_prompt_key="coding_agent", target_queues=(), is_active=True, show_window=False):
+        cursor = self.conn.execute('''
+            INSERT INTO agents (name, role, system_prompt_key, is_active, target_queues, show_window) VALUES (?, ?, ?, ?, ?, ?)
+        ''', (name, role, system_prompt_key, 1 if is_active else 0, json.dumps(list(target_queues)), 1 if show_window else 0))
+        self.conn.commit()
+        return cursor.lastrowid
+
+    def get_agent(self, agent_id):
+        row = self.conn.execute('SELECT * FROM agents WHERE id = ?', (agent_id,)).fetchone()
+        return dict(row) if row else None
+
+    def load_agent(self, agent_id):
+        return models.Agent.fetch(self.conn, agent_id)
+
+    def list_agents(self, active_only=False):
+        where = "WHERE is_active = 1" if active_only else ""
+        return [dict(row) for row in self.conn.execute(f'SELECT * FROM agents {where} ORDER BY id')]
+
+    def update_agent(self, agent_id, **fields):
+        _check_fields(fields, AGENT_FIELDS)
+        if fields:
+            self.conn.execute(f'UPDATE agents SET {", ".join(f"{k} = ?" for k in fields)} WHERE id = ?',
+                              (*fields.values(), agent_id))
+            self.conn.commit()
+
+    def delete_agent(self, agent_id):
+        self.conn.execute('DELETE FROM agents WHERE id = ?', (agent_id,))
+        self.conn.execute('DELETE FROM agent_activity WHERE agent_id = ?', (agent_id,))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+def _queues_of(task):
+    # Python version of scheduler.QUEUE_CONDITIONS
+    if task["is_inprogress"]:
+        return []
+    queues = []
+    if task["is_review"]:
+        queues.append("review")
+    if task["is_failed"]:
+        queues.append("triage")
+    if not (task["is_complete"] or task["is_review"] or task["is_failed"]):
+        queues.append("todo")
+    return queues
+
+class MemoryStorage(Storage):
+    """
+    Everything in dicts. Each (project, queue) keeps a sorted list of
+    (queue_rank, id) like the partial indexes in SQLite, so a pick is a walk
+    from the front; dependency edges are kept in both directions.
+    `clock` supplies created_at (seconds), e.g. a simulator's virtual time.
+    """
+
+    def __init__(self, share=None, clock=time.time):
+        self.share = share or FairShare()
+        self.clock = clock
+        self.projects = {}
+        self.tasks = {}
+        self.agents = {}
+        self.parents = defaultdict(set)
+        self.children = defaultdict(set)
+        self.by_project = defaultdict(set)
+        self.open_count = defaultdict(int)
+        self.stale = set()
+        self.queues = defaultdict(list)
+        self.events = []
+        self.feedback = []
+        self.ids = {name: itertools.count(1) for name in ("projects", "tasks", "agents")}
+        self.lock = threading.RLock()
+
+    def _timestamp(self):
+        now = self.clock()
+        return now, time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(now))
+
+    # --- Projects ---
+
+    def create_project(self, name, description="", working_dir="", weight=1):
+        with self.lock:
+            project_id = next(self.ids["projects"])
+            _, created_at = self._timestamp()
+            self.projects[project_id] = {"id": project_id, "name": name, "description": description, "working_dir": working_dir,
+                                         "status": "active", "weight": weight, "created_at": created_at}
+            return project_id
+
+    def get_project(self, project_id):
+        with self.lock:
+            project = self.projects.get(project_id)
+            return dict(project) if project else None
+
+    def list_projects(self, active_only=False, stats=False):
+        with self.lock:
+            projects = [dict(p) for _, p in sorted(self.projects.items())
+                        if not active_only or p["status"] != "completed"]
+            if stats:
+                for project in projects:
+                    ids = self.by_project.get(project["id"], ())
+                    project["total_tasks"] = len(ids)
+                    project["completed_tasks"] = len(ids) - self.open_count[project["id"]] if ids else 0
+            return projects
+
+    def update_project(self, project_id, **fields):
+        _check_fields(fields, PROJECT_FIELDS)
+        with self.lock:
+            if project_id in self.projects:
+                self.projects[project_id].update(fields)
+
+    def delete_project(self, project_id):
+        with self.lock:
+            ids = self.by_project.pop(project_id, set())
+            for task_id in ids:
+                self._unindex(self.tasks.pop(task_id))
+                for parent in self.parents.pop(task_id, ()):
+                    self.children[parent].discard(task_id)
+                for child in self.children.pop(task_id, ()):
+                    self.parents[child].discard(task_id)
+            self.events = [e for e in self.events if e["task_id"] not in ids]
+            self.feedback = [f for f in self.feedback if f[0] not in ids]
+            self.open_count.pop(project_id, None)
+            self.stale.discard(project_id)
+            self.projects.pop(project_id, None)
+
+    # --- Tasks ---
+
+    def _rank(self, task):
+        return (int(task["_created"]) - (task["priority"] or 0) * TASK_AGING_SECONDS
+                - ((task["critical_path"] or 1) - 1) * CRITICAL_PATH_SECONDS - (task["fanout"] or 0) * FANOUT_SECONDS)
+
+    def _unindex(self, task):
+        for queue in _queues_of(task):
+            entries = self.queues[(task["project_id"], queue)]
+            i = bisect.bisect_left(entries, (task["queue_rank"], task["id"]))
+            if i < len(entries) and entries[i] == (task["queue_rank"], task["id"]):
+                del entries[i]
+
+    def _index(self, task):
+        task["queue_rank"] = self._rank(task)
+        for queue in _queues_of(task):
+            bisect.insort(self.queues[(task["project_id"], queue)], (task["queue_rank"], task["id"]))
+
+    def _public(self, task):
+        row = {k: v for k, v in task.items() if not k.startswith("_")}
+        row["dependency_id"] = min(self.parents[task["id"]]) if self.parents[task["id"]] else None
+        row["status"] = task_state.status_from_flags(task["is_inprogress"], task["is_review"], task["is_complete"], task["is_failed"])
+        return row
+
+    def create_task(self, project_id, title, description="", success_criteria="", priority=0, depends_on=(), checks=None):
+        with self.lock:
+            depends_on = [int(d) for d in depends_on]
+            missing = [d for d in depends_on if d not in self.tasks]
+            if missing:
+                raise ValueError(f"Unknown tasks {missing}")
+            task_id = next(self.ids["tasks"])
+            now, created_at = self._timestamp()
+            task = {"id": task_id, "project_id": project_id, "title": title, "description": description,
+                    "success_criteria": success_criteria, "is_inprogress": 0, "is_review": 0, "is_complete": 0,
+                    "is_failed": 0, "review_count": 0, "priority": int(priority or 0), "checks": checks,
+                    "critical_path": 1, "fanout": 0, "queue_rank": None, "created_at": created_at, "_created": now}
+            self.tasks[task_id] = task
+            self.by_project[project_id].add(task_id)
+            self.open_count[project_id] += 1
+            self._index(task)
+            for parent in depends_on:
+                self.parents[task_id].add(parent)
+                self.children[parent].add(task_id)
+            if depends_on:
+                self._add_leaf(task_id)
+            if project_id in self.projects:
+                # A new open task only reopens the project
+                self.projects[project_id]["status"] = "active"
+            return task_id
+
+    def get_task(self, task_id):
+        with self.lock:
+            task = self.tasks.get(int(task_id))
+            return self._public(task) if task else None
+
+    def load_task(self, task_id):
+        with self.lock:
+            task = self.tasks.get(int(task_id))
+            if task is None:
+                return None
+            row = self._public(task)
+            project = self.projects.get(task["project_id"])
+            return models.Task(*(row[c] for c in models.Task.COLUMNS), working_dir=project["working_dir"] if project else None)
+
+    def list_tasks(self, project_id=None):
+        with self.lock:
+            ids = sorted(self.tasks) if project_id is None else sorted(self.by_project.get(project_id, ()))
+            return [self._public(self.tasks[t]) for t in ids]
+
+    def board_tasks(self):
+        with self.lock:
+            rows = []
+            for project_id, project in sorted(self.projects.items()):
+                if project["status"] == "completed":
+                    continue
+                for task_id in sorted(self.by_project.get(project_id, ())):
+                    public = self._public(self.tasks[task_id])
+                    row = {c: public[c] for c in models.Task.COLUMNS}
+                    row.update(project_name=project["name"], working_dir=project["working_dir"],
+                               dependencies=[{"id": p, "title": self.tasks[p]["title"], "is_complete": self.tasks[p]["is_complete"]}
+                                             for p in sorted(self.parents[task_id]) if p in self.tasks])
+                    rows.append(row)
+            return rows
+
+    def update_task(self, task_id, **fields):
+        _check_fields(fields, TASK_FIELDS)
+        with self.lock:
+            task = self.tasks[int(task_id)]
+            self._unindex(task)
+            task.update(fields)
+            self._index(task)
+
+    def _would_create_cycle(self, task_id, depends_on_id):
+        if task_id == depends_on_id:
+            return True
+        stack, seen = [depends_on_id], set()
+        while stack:
+            current = stack.pop()
+            if current == task_id:
+                return True
+            if current not in seen:
+                seen.add(current)
+                stack.extend(self.parents[current])
+        return False
+
+    def add_dependency(self, task_id, depends_on_id):
+        task_id, depends_on_id = int(task_id), int(depends_on_id)
+        with self.lock:
+            if self._would_create_cycle(task_id, depends_on_id):
+                raise dependencies.DependencyCycleError(f"Task {task_id} can't depend on {depends_on_id}: that would create a cycle")
+            self.parents[task_id].add(depends_on_id)
+            self.children[depends_on_id].add(task_id)
+            self._refresh_project(self.tasks[task_id]["project_id"])
+
+    def set_dependencies(self, task_id, depends_on_ids):
+        task_id = int(task_id)
+        wanted = {int(d) for d in depends_on_ids or []}
+        with self.lock:
+            if wanted == self.parents[task_id]:
+                return
+            for depends_on_id in sorted(wanted):
+                if self._would_create_cycle(task_id, depends_on_id):
+                    raise dependencies.DependencyCycleError(f"Task {task_id} can't depend on {depends_on_id}: that would create a cycle")
+            for parent in self.parents[task_id]:
+                self.children[parent].discard(task_id)
+            self.parents[task_id] = wanted
+            for parent in wanted:
+                self.children[parent].add(task_id)
+            self._refresh_project(self.tasks[task_id]["project_id"])
+
+    def get_dependencies(self, task_id):
+        with self.lock:
+            return sorted(self.parents[int(task_id)])
+
+    def _ready(self, task_id):
+        return all(self.tasks[p]["is_complete"] for p in self.parents[task_id] if p in self.tasks)
+
+    def _set_rank_inputs(self, task, cp, fanout):
+        if (task["critical_path"], task["fanout"]) != (cp, fanout):
+            self._unindex(task)
+            task["critical_path"], task["fanout"] = cp, fanout
+            self._index(task)
+
+    def _add_leaf(self, task_id):
+        # What _refresh_project would work out for a new task nothing depends on
+        # yet: each open ancestor has one more task downstream and its critical
+        # path may grow. Touches only the ancestors, not the whole project.
+        ancestors, stack = set(), [task_id]
+        while stack:
+            for parent in self.parents[stack.pop()]:
+                if parent not in ancestors and parent in self.tasks and not self.tasks[parent]["is_complete"]:
+                    ancestors.add(parent)
+                    stack.append(parent)
+        paths = {t: self.tasks[t]["critical_path"] or 1 for t in ancestors}
+        paths[task_id] = 1
+        stack = [task_id]
+        while stack:
+            current = stack.pop()
+            for parent in self.parents[current]:
+                if parent in ancestors and paths[parent] < paths[current] + 1:
+                    paths[parent] = paths[current] + 1
+                    stack.append(parent)
+        for t in ancestors:
+            self._set_rank_inputs(self.tasks[t], paths[t], (self.tasks[t]["fanout"] or 0) + 1)
+
+    def _set_project_status(self, project_id):
+        project = self.projects.get(project_id)
+        if project is not None:
+            project["status"] = "completed" if self.by_project.get(project_id) and not self.open_count[project_id] else "active"
+
+    def _refresh_project(self, project_id):
+        # Project status and critical path, like task_state.refresh_projects
+        ids = self.by_project.get(project_id, ())
+        open_ids = {t for t in ids if not self.tasks[t]["is_complete"]}
+        self.open_count[project_id] = len(open_ids)
+        self._set_project_status(project_id)
+        self.stale.discard(project_id)
+        edges = [(t, p) for t in open_ids for p in self.parents[t]]
+        for task_id, (cp, fanout) in dependencies.critical_path_of(open_ids, edges).items():
+            self._set_rank_inputs(self.tasks[task_id], cp, fanout)
+
+    def _apply(self, task_id, event, params):
+        task = self.tasks.get(int(task_id))
+        if task is None:
+            task_state.rule(event, params)
+            raise task_state.InvalidTransition(f"Task {task_id} not found")
+        status = task_state.status_from_flags(task["is_inprogress"], task["is_review"], task["is_complete"], task["is_failed"])
+        changes = task_state.resolve(task, event, params)
+        if event in task_state.BOUNCE_LABELS:
+            self.feedback.append((task["id"], changes["review_count"], params.get("feedback") or ""))
+
+        was_complete = task["is_complete"]
+        self._unindex(task)
+        task.update(changes)
+        self._index(task)
+        if task["is_complete"] != was_complete:
+            self.open_count[task["project_id"]] += -1 if task["is_complete"] else 1
+            # A task finishing after all its parents leaves every other task's
+            # critical path and fanout as they were; anything else needs a full refresh
+            if not task["is_complete"] or any(not self.tasks[p]["is_complete"] for p in self.parents[task["id"]] if p in self.tasks):
+                self.stale.add(task["project_id"])
+        new_status = task_state.status_from_flags(task["is_inprogress"], task["is_review"], task["is_complete"], task["is_failed"])
+        if new_status != status:
+            self.events.append({"task_id": task["id"], "from_status": status, "to_status": new_status,
+                                "iterations": None, "role": None, "at": self.clock()})
+        if params.get("role") is not None and params.get("iterations") is not None:
+            for entry in reversed(self.events):
+                if entry["task_id"] == task["id"]:
+                    entry["iterations"], entry["role"] = int(params["iterations"]), params["role"]
+                    break
+        return {"success": True, "task_id": task["id"], "event": event, "status": new_status,
+                "project_id": task["project_id"], "review_count": task["review_count"]}
+
+    def apply_transitions(self, transitions):
+        results = []
+        projects = set()
+        with self.lock:
+            for item in transitions:
+                task_id, event = item[0], item[1]
+                params = item[2] if len(item) > 2 and item[2] else {}
+                try:
+                    result = self._apply(task_id, event, params)
+                except task_state.InvalidTransition as e:
+                    results.append({"success": False, "task_id": task_id, "event": event, "message": str(e)})
+                    continue
+                results.append(result)
+                if event in task_state.COMPLETION_EVENTS:
+                    projects.add(result["project_id"])
+            for project_id in projects:
+                if project_id in self.stale:
+                    self._refresh_project(project_id)
+                else:
+                    self._set_project_status(project_id)
+        return results
+
+    def pick_next_task(self, queues):
+        queues = [q for q in queues if q in QUEUE_CONDITIONS]
+        if not queues:
+            return None
+        with self.lock:
+            # Like scheduler.pick_next_task: only pairs with queued tasks, and
+            # a pair is charged whether or not one of them is ready
+            weighted_keys = []
+            for (project_id, queue), entries in sorted(self.queues.items()):
+                project = self.projects.get(project_id)
+                if not entries or queue not in queues or project is None or project["status"] in ("completed", "planning"):
+                    continue
+                weighted_keys.append(((project_id, queue), (project["weight"] if project["weight"] is not None else 1) * QUEUE_WEIGHTS.get(queue, 1)))
+            for (project_id, queue), weight in self.share.order(weighted_keys):
+                self.share.charge((project_id, queue), weight)
+                for _, task_id in self.queues[(project_id, queue)]:
+                    if queue != "todo" or self._ready(task_id):
+                        return task_id
+        return None
+
+    def task_events(self, task_id=None):
+        with self.lock:
+            return [{k: e[k] for k in ("task_id", "from_status", "to_status", "iterations", "role")}
+                    for e in self.events if task_id is None or e["task_id"] == task_id]
+
+    # --- Agents ---
+
+    def create_agent(self, name, role="CodingAgent", system_prompt_key="coding_agent", target_queues=(), is_active=True, show_window=False):
+        with self.lock:
+            agent_id = next(self.ids["agents"])
+            _, created_at = self._timestamp()
+            self.agents[agent_id] = {"id": agent_id, "name": name, "role": role, "system_prompt_key": system_prompt_key,
+                                     "status": "Idle", "show_window": 1 if show_window else 0, "is_active": 1 if is_active else 0,
+                                     "target_queues": json.dumps(list(target_queues)), "created_at": created_at}
+            return agent_id
+
+    def get_agent(self, agent_id):
+        with self.lock:
+            agent = self.agents.get(agent_id)
+            return dict(agent) if agent else None
+
+    def load_agent(self, agent_id):
+        with self.lock:
+            agent = self.agents.get(agent_id)
+            return models.Agent(*(agent[c] for c in models.Agent.COLUMNS)) if agent else None
+
+    def list_agents(self, active_only=False):
+        with self.lock:
+            return [dict(a) for _, a in sorted(self.agents.items()) if not active_only or a["is_active"]]
+
+    def update_agent(self, agent_id, **fields):
+        _check_fields(fields, AGENT_FIELDS)
+        with self.lock:
+            if agent_id in self.agents:
+                self.agents[agent_id].update(fields)
+
+    def delete_agent(self, agent_id):
+        with self.lock:
+            self.agents.pop(agent_id, None)
@@ -0,0 +1,250 @@
+import os
+from dotenv import load_dotenv
+
+from metrics import STATUS_SQL, record_run, record_event, last_event_id
+from dependencies import update_critical_path
+
+load_dotenv()
+
+# The board column of a task is derived from its four flags (see metrics.STATUS_SQL).
+# Every agent-driven change of those flags goes through here: an event is one
+# guarded UPDATE ... RETURNING, so a task that moved meanwhile (a drag, another
+# agent) is reported instead of overwritten.
+
+# status -> (is_inprogress, is_review, is_complete, is_failed)
+STATUS_FLAGS = {
+    "todo": (0, 0, 0, 0),
+    "backlog": (0, 0, 0, 0),  # todo with open dependencies, shown as backlog
+    "inprogress": (1, 0, 0, 0),
+    "review": (0, 1, 0, 0),
+    "complete": (0, 0, 1, 0),
+    "triage": (0, 0, 0, 1),
+}
+
+def status_from_flags(is_inprogress, is_review, is_complete, is_failed):
+    # Same precedence as STATUS_SQL
+    if is_complete: return "complete"
+    if is_review: return "review"
+    if is_failed: return "triage"
+    if is_inprogress: return "inprogress"
+    return "todo"
+
+OPEN = ("todo", "inprogress", "review", "triage")
+
+# Rejections and failed checks go back to todo with the feedback on top of the
+# description, or to triage once the task has bounced MAX_REVIEW_ATTEMPTS times.
+_BOUNCE_COUNT = "COALESCE(review_count, 0) + 1"
+_BOUNCE = f'''
+    review_count = {_BOUNCE_COUNT},
+    is_inprogress = 0, is_review = 0, is_complete = 0,
+    is_failed = CASE WHEN {_BOUNCE_COUNT} >= :max_reviews THEN 1 ELSE 0 END,
+    description = CASE WHEN {_BOUNCE_COUNT} >= :max_reviews THEN description
+                       ELSE :label || ' (' || ({_BOUNCE_COUNT}) || ')__:' || char(10) || :feedback
+                            || char(10) || char(10) || COALESCE(description, '') END
+'''
+
+BOUNCE = "bounce"
+MOVE = "move"
+
+# event -> (statuses it is allowed from, flags it requires, flags it sets).
+# BOUNCE / MOVE are computed per task (see _BOUNCE and the "status" param).
+# rule() is the one reading of this table: _apply compiles it to a guarded
+# UPDATE, resolve() applies it to a task dict (storage.MemoryStorage).
+TRANSITIONS = {
+    # An agent picks the task up (the column stays, is_inprogress marks it taken)
+    "claim": (("todo", "triage", "review"), {"is_inprogress": 0}, {"is_inprogress": 1, "is_failed": 0}),
+    "claim_review": (("review",), {"is_inprogress": 0}, {"is_inprogress": 1}),
+    # Manual run from the UI, or a dispatch after a claim
+    "start": (OPEN, {}, {"is_inprogress": 1, "is_failed": 0}),
+    # Results apply to whatever column the run was started from (agents can
+    # watch any queue and be run by hand on any card); is_inprogress = 1 is
+    # what tells a live run from a task that was dragged away meanwhile
+    "coding_succeeded": (OPEN, {"is_inprogress": 1}, {"is_inprogress": 0, "is_review": 1, "is_failed": 0}),
+    "coding_failed": (OPEN, {"is_inprogress": 1}, {"is_inprogress": 0, "is_review": 0, "is_failed": 1}),
+    "checks_failed": (OPEN, {"is_inprogress": 1}, BOUNCE),
+    "review_approved": (OPEN, {"is_inprogress": 1}, {"is_inprogress": 0, "is_review": 0, "is_complete": 1, "is_failed": 0}),
+    "review_rejected": (OPEN, {"is_inprogress": 1}, BOUNCE),
+    # A remote worker's lease expired; the task goes back to the queue it came from
+    "release": (OPEN, {"is_inprogress": 1}, {"is_inprogress": 0}),
+    # The run crashed; park it in triage rather than leave it in progress
+    "fail": (OPEN, {}, {"is_inprogress": 0, "is_review": 0, "is_failed": 1}),
+    # Drag and drop / edit dialog: any column to any column
+    "move": (OPEN + ("complete",), {}, MOVE),
+}
+
+FLAGS = ("is_inprogress", "is_review", "is_complete", "is_failed")
+
+BOUNCE_LABELS = {"checks_failed": "__CHECK FAILURE", "review_rejected": "__REVIEW FEEDBACK"}
+
+# Events that can change whether a task is complete, and so the project's status
+# and the critical path of what is left
+COMPLETION_EVENTS = {"review_approved", "move"}
+
+class InvalidTransition(ValueError):
+    pass
+
+def max_review_attempts():
+    return int(os.getenv("MAX_REVIEW_ATTEMPTS", 3))
+
+def move_flags(status):
+    if status not in STATUS_FLAGS:
+        raise InvalidTransition(f"Unknown status {status!r}")
+    return dict(zip(FLAGS, STATUS_FLAGS[status]))
+
+def bounce(event, review_count, description, feedback):
+    """
+    Python version of _BOUNCE: returns (flags, review_count, description).
+    """
+    count = (review_count or 0) + 1
+    if count >= max_review_attempts():
+        return move_flags("triage"), count, description
+    text = f"{BOUNCE_LABELS[event]} ({count})__:\n{feedback or ''}\n\n{description or ''}"
+    return move_flags("todo"), count, text
+
+def refused(task_id, event, status, is_inprogress):
+    allowed, guard = TRANSITIONS[event][0], TRANSITIONS[event][1]
+    reason = ""
+    if status in allowed and guard.get("is_inprogress") is not None and guard["is_inprogress"] != is_inprogress:
+        reason = " (already taken)" if is_inprogress else " (not in progress)"
+    return InvalidTransition(f"Task {task_id} can't {event} from {status}{reason}")
+
+def rule(event, params):
+    """
+    (allowed statuses, required flags, flags to set) of `event`, with MOVE
+    resolved from params["status"]. BOUNCE is left to the caller.
+    """
+    if event not in TRANSITIONS:
+        raise InvalidTransition(f"Unknown task event {event!r}")
+    allowed, guard, sets = TRANSITIONS[event]
+    if sets == MOVE:
+        sets = move_flags(params.get("status"))
+    return allowed, guard, sets
+
+def resolve(task, event, params):
+    """
+    Python version of _apply's UPDATE for a task dict: returns the fields the
+    event changes, or raises InvalidTransition like _apply does.
+    """
+    allowed, guard, sets = rule(event, params)
+    status = status_from_flags(task["is_inprogress"], task["is_review"], task["is_complete"], task["is_failed"])
+    if status not in allowed or any(task[name] != value for name, value in guard.items()):
+        raise refused(task["id"], event, status, task["is_inprogress"])
+    if sets == BOUNCE:
+        flags, review_count, description = bounce(event, task["review_count"], task["description"], params.get("feedback"))
+        return {**flags, "review_count": review_count, "description": description}
+    return dict(sets)
+
+def _status_sql(p=""):
+    return STATUS_SQL.format(p=p)
+
+def _apply(conn, task_id, event, params):
+    allowed, guard, sets = rule(event, params)
+    values = {"task_id": int(task_id)}
+
+    if sets == BOUNCE:
+        values.update(max_reviews=max_review_attempts(), label=BOUNCE_LABELS[event], feedback=params.get("feedback") or "")
+        assignments = _BOUNCE
+    else:
+        assignments = ", ".join(f"{name} = {int(value)}" for name, value in sets.items())
+
+    since_id = last_event_id(conn, int(task_id))
+    where = f"({_status_sql()}) IN ({', '.join(repr(s) for s in allowed)})"
+    for name, value in guard.items():
+        where += f" AND {name} = {int(value)}"
+    # fetchall() so the statement is finished before the caller commits
+    rows = conn.execute(f'''
+        UPDATE tasks SET {assignments}
+        WHERE id = :task_id AND {where}
+        RETURNING project_id, review_count, {_status_sql()} AS status
+    ''', values).fetchall()
+
+    if not rows:
+        current = conn.execute(f'SELECT {_status_sql()} AS status, is_inprogress FROM tasks WHERE id = ?', (int(task_id),)).fetchone()
+        if current is None:
+            raise InvalidTransition(f"Task {task_id} not found")
+        raise refused(task_id, event, current[0], current[1])
+
+    project_id, review_count, status = rows[0][0], rows[0][1], rows[0][2]
+    record_event(conn, int(task_id), event, since_id)
+    if event in BOUNCE_LABELS:
+        # Keep the full feedback searchable
+        conn.execute('INSERT INTO task_feedback (task_id, review_number, feedback) VALUES (?, ?, ?)',
+                     (int(task_id), review_count, values["feedback"]))
+        what = "failed checks" if event == "checks_failed" else "failed review"
+        if status == "triage":
+            print(f"Task {task_id} {what} {review_count} times. Marking as FAILED.")
+        else:
+            print(f"Task {task_id} {what} ({review_count}). Returning to TODO.")
+    if params.get("role") is not None:
+        record_run(conn, int(task_id), params["role"], params.get("iterations"))
+
+    return {"success": True, "task_id": int(task_id), "event": event, "status": status,
+            "project_id": project_id, "review_count": review_count}
+
+def refresh_projects(conn, project_ids, task_ids=None):
+    """
+    Sets each project to 'completed' when it has tasks and all are complete,
+    'active' otherwise, and updates the critical path of its open tasks
+    (only what `task_ids` can have changed, if given; see
+    dependencies.update_critical_path). One UPDATE for all projects.
+    Doesn't commit.
+    """
+    project_ids = sorted({p for p in project_ids if p is not None})
+    if not project_ids:
+        return
+    conn.execute(f'''
+        UPDATE projects SET status = CASE
+            WHEN EXISTS (SELECT 1 FROM tasks WHERE project_id = projects.id)
+             AND NOT EXISTS (SELECT 1 FROM tasks WHERE project_id = projects.id AND is_complete = 0)
+            THEN 'completed' ELSE 'active' END
+        WHERE id IN ({",".join("?" for _ in project_ids)})
+    ''', project_ids)
+    for project_id in project_ids:
+        update_critical_path(conn, project_id, task_ids)
+
+def apply_transitions(conn, transitions, strict=False, commit=True):
+    """
+    Applies [(task_id, event, params), ...] in one transaction and returns one
+    result dict per item. Transitions that aren't allowed from the task's
+    current state are skipped and reported ({"success": False, "message": ...}),
+    or with strict=True roll the whole batch back and raise InvalidTransition.
+    Touched projects are refreshed once at the end.
+    """
+    results = []
+    projects, changed = set(), set()
+    try:
+        for item in transitions:
+            task_id, event = item[0], item[1]
+            params = item[2] if len(item) > 2 and item[2] else {}
+            try:
+                result = _apply(conn, task_id, event, params)
+            except InvalidTransition as e:
+                if strict:
+                    raise
+                print(f"DEBUG: {e}")
+                results.append({"success": False, "task_id": task_id, "event": event, "message": str(e)})
+                continue
+            results.append(result)
+            if event in COMPLETION_EVENTS:
+                projects.add(result["project_id"])
+                changed.add(result["task_id"])
+        refresh_projects(conn, projects, changed)
+        if commit:
+            conn.commit()
+    except Exception:
+        if commit:
+            conn.rollback()
+        raise
+    return results
+
+def transition(conn, task_id, event, commit=True, **params):
+    """
+    Applies one event to one task with all its side effects (feedback row, run
+    metrics, project status) and commits. Raises InvalidTransition if the task
+    isn't in a state the event is allowed from.
+    """
+    return apply_transitions(conn, [(task_id, event, params)], strict=True, commit=commit)[0]
+
+def try_transition(conn, task_id, event, **params):
+    # Like transition() but returns the failure dict instead of raising
+    return apply_transitions(conn, [(task_id, event, params)])[0]
@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import SQLiteStorage, MemoryStorage
+
+# Every Storage implementation runs the same tests
+BACKENDS = {"sqlite": SQLiteStorage.open, "memory": MemoryStorage}
+
+@pytest.fixture(params=sorted(BACKENDS))
+def store(request):
+    store = BACKENDS[request.param]()
+    yield store
+    store.close()
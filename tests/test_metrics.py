@@ -0,0 +1,64 @@
+import pytest
+
+import metrics
+import agent_registry
+import storage
+
+@pytest.fixture
+def board(tmp_path):
+    # EventFolder and board_gauges open and close their own connections
+    path = str(tmp_path / "board.db")
+    store = storage.SQLiteStorage.open(path)
+    project_id = store.create_project("p")
+    yield store, project_id, lambda: storage.connect(path)
+    store.close()
+
+def reviews():
+    return {key[0]: value for key, value in metrics.REVIEWS.values.items()}
+
+def test_reviews_counted_from_verdicts(board):
+    store, project_id, get_conn = board
+    fold = metrics.EventFolder(get_conn)
+    fold()
+    before = reviews()
+    a = store.create_task(project_id, "a")
+    b = store.create_task(project_id, "b")
+
+    # Dragged out of Review: not a verdict
+    store.transition(a, "move", status="review")
+    store.transition(a, "move", status="todo")
+    # Rejected by a reviewer, then approved
+    store.transition(a, "move", status="review")
+    store.transition(a, "claim_review")
+    store.transition(a, "review_rejected", feedback="no", role="ReviewerAgent", iterations=1)
+    store.transition(a, "move", status="review")
+    store.transition(a, "claim_review")
+    store.transition(a, "review_approved", role="ReviewerAgent", iterations=1)
+    # A reviewer run by hand on a todo card
+    store.transition(b, "start")
+    store.transition(b, "review_rejected", feedback="no", role="ReviewerAgent", iterations=3)
+    fold()
+
+    after = reviews()
+    assert after.get("approved", 0) - before.get("approved", 0) == 1
+    assert after.get("rejected", 0) - before.get("rejected", 0) == 2
+
+def test_claimed_reviews_count_as_busy(board):
+    store, project_id, get_conn = board
+    coder = store.create_agent("coder")
+    reviewer = store.create_agent("reviewer")
+    store.create_agent("idle")
+    coding = store.create_task(project_id, "coding")
+    review = store.create_task(project_id, "review")
+    store.transition(coding, "claim")
+    store.transition(review, "move", status="review")
+    store.transition(review, "claim_review")
+    agent_registry.started(store.conn, coder, [coding])
+    agent_registry.started(store.conn, reviewer, [review])
+    store.conn.commit()
+
+    metrics.board_gauges(get_conn)()
+
+    assert metrics.AGENTS_ACTIVE.values[()] == 3
+    assert metrics.AGENTS_BUSY.values[()] == 2
+    assert metrics.AGENT_UTILIZATION.values[()] == round(2 / 3, 4)
@@ -0,0 +1,15 @@
+import prompts
+
+TASK = {"title": "t", "description": "d", "success_criteria": "c"}
+
+def test_review_log_capped():
+    log = [f"Iteration {i} Output Snippet: {'x' * 300}..." for i in range(1, 41)]
+    texts = [prompts.review_prompt(TASK, "/work", log[:i], i + 1, 41) for i in range(41)]
+    assert len(texts[-1]) < len(texts[prompts.REVIEW_LOG_ENTRIES]) + 400
+    assert "Iteration 2 Output" not in texts[-1].split("omitted")[1]
+    # The first entries stay put, so the cached prefix covers them
+    keep = texts[prompts.REVIEW_LOG_ENTRIES].index(log[prompts.REVIEW_LOG_ENTRIES - 1])
+    assert all(prompts.shared_prefix_chars(texts[i - 1], texts[i]) >= keep for i in range(prompts.REVIEW_LOG_ENTRIES, 41))
+
+def test_internal_prompts_exist():
+    assert prompts.INTERNAL_PROMPTS <= set(prompts.SYSTEM_PROMPTS)
@@ -0,0 +1,25 @@
+import threading
+
+from rate_limiter import RateLimiter, PRIORITY_AGENT, PRIORITY_INTERACTIVE
+
+def test_interactive_reserve(tmp_path):
+    limiter = RateLimiter(path=str(tmp_path / "limiter.db"), max_inflight=2)
+    session = limiter.acquire(priority=PRIORITY_AGENT)
+    # The last slot is the UI's
+    with limiter.acquire(priority=PRIORITY_INTERACTIVE) as lease:
+        assert lease.lease_id is not None
+
+    acquired = threading.Event()
+    def agent():
+        limiter.acquire(priority=PRIORITY_AGENT).release()
+        acquired.set()
+    thread = threading.Thread(target=agent, daemon=True)
+    thread.start()
+    assert not acquired.wait(0.3)
+    session.release()
+    assert acquired.wait(5)
+
+def test_reserve_leaves_agents_a_slot(tmp_path):
+    limiter = RateLimiter(path=str(tmp_path / "limiter.db"), max_inflight=1, interactive_reserve=3)
+    assert limiter.interactive_reserve == 0
+    limiter.acquire(priority=PRIORITY_AGENT).release()
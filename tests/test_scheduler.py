@@ -0,0 +1,62 @@
+import pytest
+
+from storage import SQLiteStorage
+
+def count_probes(store, queues):
+    statements = []
+    store.conn.set_trace_callback(statements.append)
+    try:
+        task_id = store.pick_next_task(queues)
+    finally:
+        store.conn.set_trace_callback(None)
+    return task_id, len(statements)
+
+def test_weighted_share(store):
+    light = store.create_project("light", weight=1)
+    heavy = store.create_project("heavy", weight=3)
+    for i in range(40):
+        store.create_task(light, f"l{i}")
+        store.create_task(heavy, f"h{i}")
+    picked = [store.get_task(store.claim_next(["todo"]))["project_id"] for _ in range(40)]
+    assert picked.count(heavy) == 30
+
+def test_blocked_pair_skipped(store):
+    blocked = store.create_project("blocked")
+    parent = store.create_task(blocked, "parent")
+    store.transition(parent, "claim")
+    store.create_task(blocked, "child", depends_on=[parent])
+    ready = store.create_project("ready")
+    tasks = [store.create_task(ready, f"r{i}") for i in range(3)]
+    assert [store.claim_next(["todo"]) for _ in range(4)] == tasks + [None]
+
+def test_empty_projects_not_probed():
+    store = SQLiteStorage.open()
+    for i in range(50):
+        store.create_project(f"empty {i}")
+    busy = store.create_project("busy")
+    task_id = store.create_task(busy, "t")
+    # One statement for the pairs with work, one walk of the chosen pair
+    assert count_probes(store, ["todo", "review", "triage"]) == (task_id, 2)
+    store.close()
+
+def test_blocked_pair_not_reprobed_first():
+    store = SQLiteStorage.open()
+    blocked = store.create_project("blocked")
+    parent = store.create_task(blocked, "parent")
+    store.transition(parent, "claim")
+    store.create_task(blocked, "child", depends_on=[parent])
+    ready = store.create_project("ready", weight=3)
+    task_id = store.create_task(ready, "r")
+    picks = [count_probes(store, ["todo"]) for _ in range(8)]
+    assert {t for t, _ in picks} == {task_id}
+    # Charged like a served pair, the blocked one is walked on 3 picks of 8 (about its
+    # share), not on every pick
+    assert sum(n for _, n in picks) == 2 * 8 + 3
+    store.close()
+
+@pytest.mark.parametrize("status", ["completed", "planning"])
+def test_inactive_projects_skipped(store, status):
+    project_id = store.create_project("p")
+    store.create_task(project_id, "t")
+    store.update_project(project_id, status=status)
+    assert store.pick_next_task(["todo"]) is None
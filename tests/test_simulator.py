@@ -0,0 +1,28 @@
+import random
+
+import simulator
+from storage import SQLiteStorage
+
+def test_recorded_outcomes():
+    store = SQLiteStorage.open()
+    project_id = store.create_project("p")
+    task_id = store.create_task(project_id, "t")
+    runs = [("CodingAgent", 4, "success"), ("CodingAgent", 3, "stalled"), ("CodingAgent", 2, "cancelled"),
+            ("ReviewerAgent", 1, "rejected"), ("ReviewerAgent", 1, "cancelled"), ("ReviewerAgent", 1, "preempted")]
+    store.conn.executemany('INSERT INTO task_runs (task_id, role, iterations, outcome) VALUES (?, ?, ?, ?)',
+                           [(task_id, *run) for run in runs])
+    store.transition(task_id, "claim")
+    store.transition(task_id, "checks_failed", role="CodingAgent", iterations=4)
+
+    model = simulator.RunModel.from_db(store.conn)
+    # Runs the board cut short aren't the agent's failures
+    assert model.run_samples == {"CodingAgent": [(4, "success"), (3, "stalled")], "ReviewerAgent": [(1, "rejected")]}
+    assert model.checks_failure_rate == 1.0
+    rng = random.Random(0)
+    assert {model.coding_run(rng)[1:] for _ in range(50)} == {(3, "coding_failed"), (4, "checks_failed")}
+    assert model.review_run(rng)[1:] == (1, "review_rejected")
+    store.close()
+
+def test_stall_rate():
+    model = simulator.RunModel(stall_rate=1.0)
+    assert model.coding_run(random.Random(0))[1:] == (simulator.MAX_STALLED_ITERATIONS, "coding_failed")
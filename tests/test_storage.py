@@ -0,0 +1,145 @@
+import json
+
+import pytest
+
+import dependencies
+import models
+
+# The behaviour every Storage implementation has to share (see storage.py)
+
+@pytest.fixture
+def board(store):
+    p1 = store.create_project("one", weight=1)
+    a = store.create_task(p1, "a", "desc a")
+    b = store.create_task(p1, "b", priority=2)
+    c = store.create_task(p1, "c", depends_on=[a])
+    coder = store.create_agent("coder", target_queues=["todo"])
+    return p1, a, b, c, coder
+
+def test_crud(store, board):
+    p1, a, b, c, coder = board
+    assert store.get_project(p1)["status"] == "active"
+    assert [t["title"] for t in store.list_tasks(p1)] == ["a", "b", "c"]
+    assert store.get_task(b)["status"] == "todo"
+    assert store.get_dependencies(c) == [a]
+    assert (store.get_task(a)["critical_path"], store.get_task(a)["fanout"]) == (2, 1)
+    assert [x["name"] for x in store.list_agents(active_only=True)] == ["coder"]
+    assert json.loads(store.get_agent(coder)["target_queues"]) == ["todo"]
+
+def test_records(store, board):
+    p1, a, b, c, coder = board
+    store.update_project(p1, working_dir="/w")
+    task = store.load_task(c)
+    assert isinstance(task, models.Task)
+    assert (task["title"], task["dependency_id"], task["working_dir"], task.status) == ("c", a, "/w", "todo")
+    agent = store.load_agent(coder)
+    assert isinstance(agent, models.Agent)
+    assert (agent.name, agent.queues) == ("coder", ["todo"])
+    assert store.load_task(999) is None
+    assert store.load_agent(999) is None
+
+def test_projects(store, board):
+    p1, a, b, c, coder = board
+    p2 = store.create_project("two")
+    store.update_project(p2, name="deux", weight=3.0)
+    assert (store.get_project(p2)["name"], store.get_project(p2)["weight"]) == ("deux", 3.0)
+    store.transition(a, "move", status="complete")
+    stats = {p["id"]: (p["total_tasks"], p["completed_tasks"]) for p in store.list_projects(stats=True)}
+    assert stats == {p1: (3, 1), p2: (0, 0)}
+    with pytest.raises(ValueError):
+        store.update_project(p1, id=5)
+
+    store.delete_project(p1)
+    assert store.get_project(p1) is None
+    assert store.list_tasks(p1) == []
+    assert store.task_events(a) == []
+    assert store.pick_next_task(["todo"]) is None
+
+def test_board_tasks(store, board):
+    p1, a, b, c, coder = board
+    done = store.create_project("done")
+    store.transition(store.create_task(done, "x"), "move", status="complete")
+    rows = {t["id"]: t for t in store.board_tasks()}
+    assert sorted(rows) == [a, b, c]
+    assert rows[c]["project_name"] == "one"
+    assert rows[c]["dependencies"] == [{"id": a, "title": "a", "is_complete": 0}]
+    assert rows[a]["dependencies"] == []
+
+def test_dispatch(store, board):
+    p1, a, b, c, coder = board
+    # Priority first, blocked tasks never
+    assert store.pick_next_task(["todo"]) == b
+    assert store.transition(b, "claim")["status"] == "inprogress"
+    assert not store.apply_transitions([(b, "claim")])[0]["success"]
+    assert store.pick_next_task(["todo"]) == a
+    assert store.claim_next(["todo"]) == a
+    assert store.pick_next_task(["todo"]) is None
+
+    # Review loop
+    assert store.transition(b, "coding_succeeded")["status"] == "review"
+    assert store.pick_next_task(["review"]) == b
+    store.transition(b, "claim")
+    rejected = store.transition(b, "review_rejected", feedback="fix it", role="ReviewerAgent", iterations=2)
+    assert (rejected["status"], rejected["review_count"]) == ("todo", 1)
+    assert store.get_task(b)["description"] == "__REVIEW FEEDBACK (1)__:\nfix it\n\n"
+    assert store.task_events(b)[-1] == {"task_id": b, "from_status": "review", "to_status": "todo", "iterations": 2, "role": "ReviewerAgent"}
+
+    # Completing the parent unblocks the child
+    store.transition(a, "coding_succeeded")
+    assert not store.apply_transitions([(a, "review_approved")])[0]["success"]
+    store.transition(a, "claim_review")
+    assert store.transition(a, "review_approved")["status"] == "complete"
+    assert not store.apply_transitions([(a, "review_approved")])[0]["success"]
+    assert store.pick_next_task(["todo"]) == b
+    store.transition(b, "claim")
+    assert store.pick_next_task(["todo"]) == c
+
+    # Batches skip what isn't allowed, apply the rest
+    results = store.apply_transitions([(b, "coding_failed"), (c, "review_approved"), (c, "move", {"status": "complete"})])
+    assert [r["success"] for r in results] == [True, False, True]
+    assert store.pick_next_task(["triage"]) == b
+    store.transition(b, "move", status="complete")
+    assert store.get_project(p1)["status"] == "completed"
+    assert store.pick_next_task(["todo", "review", "triage"]) is None
+    store.transition(b, "move", status="todo")
+    assert store.get_project(p1)["status"] == "active"
+
+def test_dependencies(store):
+    p2 = store.create_project("two")
+    x = store.create_task(p2, "x")
+    y = store.create_task(p2, "y", depends_on=[x])
+    z = store.create_task(p2, "z", depends_on=[y])
+    assert (store.get_task(x)["critical_path"], store.get_task(x)["fanout"]) == (3, 2)
+    with pytest.raises(dependencies.DependencyCycleError):
+        store.add_dependency(x, z)
+    assert store.get_dependencies(x) == []
+    with pytest.raises(dependencies.DependencyCycleError):
+        store.set_dependencies(x, [z])
+    assert store.get_dependencies(x) == []
+
+    # Replacing parents updates the ranks of what is left
+    store.set_dependencies(z, [x])
+    assert store.get_dependencies(z) == [x]
+    assert (store.get_task(x)["critical_path"], store.get_task(x)["fanout"]) == (2, 2)
+    assert store.get_task(z)["dependency_id"] == x
+    store.set_dependencies(z, [])
+    assert (store.get_task(x)["critical_path"], store.get_task(x)["fanout"]) == (2, 1)
+
+def test_updates(store, board):
+    p1, a, b, c, coder = board
+    store.update_task(c, priority=5, title="cc", checks='[{"type": "file_exists", "path": "x"}]')
+    assert (store.get_task(c)["title"], store.get_task(c)["priority"]) == ("cc", 5)
+    assert store.load_task(c)["checks"] == '[{"type": "file_exists", "path": "x"}]'
+    assert not store.apply_transitions([(c, "explode")])[0]["success"]
+    assert not store.apply_transitions([(999, "claim")])[0]["success"]
+    with pytest.raises(ValueError):
+        store.update_task(c, is_complete=1)
+
+    store.update_agent(coder, is_active=0, target_queues='["review"]', name="reviewer")
+    agent = store.load_agent(coder)
+    assert (agent.name, agent.is_active, agent.queues) == ("reviewer", 0, ["review"])
+    with pytest.raises(ValueError):
+        store.update_agent(coder, status="Busy")
+    store.delete_agent(coder)
+    assert store.get_agent(coder) is None
+    assert store.list_agents() == []
@@ -0,0 +1,63 @@
+import pytest
+
+import task_state
+
+# Where each result leaves a task (first bounce: back to todo)
+RESULTS = {
+    "CodingAgent": {"coding_succeeded": "review", "coding_failed": "triage", "checks_failed": "todo"},
+    "ReviewerAgent": {"review_approved": "complete", "review_rejected": "todo"},
+}
+
+# How a task is taken from each column: the scheduler's claims, or a manual run
+ENTRIES = {
+    "todo": ("claim", "start"),
+    "triage": ("claim", "start"),
+    "review": ("claim", "claim_review", "start"),
+}
+
+CASES = [(role, queue, entry, event, expected)
+         for role, events in RESULTS.items()
+         for queue, entries in ENTRIES.items()
+         for entry in entries
+         for event, expected in events.items()]
+
+def task_in(store, queue):
+    project_id = store.create_project("p")
+    store.create_task(project_id, "other")  # keeps the project open once the task completes
+    task_id = store.create_task(project_id, "t")
+    if queue != "todo":
+        store.transition(task_id, "move", status=queue)
+    return task_id
+
+@pytest.mark.parametrize("role,queue,entry,event,expected", CASES)
+def test_result_applies_from_any_queue(store, role, queue, entry, event, expected):
+    task_id = task_in(store, queue)
+    store.transition(task_id, entry)
+
+    result = store.apply_transitions([(task_id, event, {"role": role, "iterations": 1, "feedback": "f"})])[0]
+
+    assert result["success"], result.get("message")
+    task = store.get_task(task_id)
+    assert task["status"] == expected
+    assert task["is_inprogress"] == 0
+    if expected != "complete":
+        # Free for the next agent
+        assert store.apply_transitions([(task_id, "claim")])[0]["success"]
+
+@pytest.mark.parametrize("event", [e for events in RESULTS.values() for e in events])
+def test_result_refused_after_drag(store, event):
+    task_id = task_in(store, "todo")
+    store.transition(task_id, "claim")
+    store.transition(task_id, "move", status="triage")
+
+    result = store.apply_transitions([(task_id, event, {"feedback": "f"})])[0]
+
+    assert not result["success"]
+    assert "not in progress" in result["message"]
+    assert store.get_task(task_id)["status"] == "triage"
+
+def test_claim_refused_while_taken(store):
+    task_id = task_in(store, "review")
+    store.transition(task_id, "claim_review")
+    with pytest.raises(task_state.InvalidTransition, match="already taken"):
+        store.transition(task_id, "claim")
@@ -0,0 +1,38 @@
+import io
+import json
+
+import board_io
+import verification
+from storage import SQLiteStorage
+
+CHECKS = [{"type": "file_exists", "path": "made.txt"},
+          {"type": "command", "cmd": "echo ok > made.txt"},
+          {"type": "test", "cmd": "pytest -q"}]
+
+def test_unreviewed_commands_dropped():
+    assert json.loads(verification.dump_checks(CHECKS, authored=False)) == CHECKS[:1]
+    assert verification.dump_checks(CHECKS[1:], authored=False) is None
+
+def test_authored_commands_use_the_shell():
+    checks = json.loads(verification.dump_checks(CHECKS))
+    assert [c.get("shell") for c in checks] == [None, True, True]
+
+def test_commands_run_without_shell(tmp_path):
+    # Without "shell" the redirect is just two more arguments to echo
+    report = verification.run_checks([CHECKS[1]], str(tmp_path))
+    assert report["passed"]
+    assert not (tmp_path / "made.txt").exists()
+
+    report = verification.run_checks([{**CHECKS[1], "shell": True}], str(tmp_path))
+    assert report["passed"]
+    assert (tmp_path / "made.txt").exists()
+
+def test_import_keeps_file_checks_only():
+    store = SQLiteStorage.open()
+    lines = [{"type": "header", "format": board_io.FORMAT_NAME, "version": board_io.FORMAT_VERSION},
+             {"type": "project", "id": 1, "name": "p"},
+             {"type": "task", "id": 1, "project_id": 1, "title": "t", "checks": json.dumps([{**CHECKS[1], "shell": True}, CHECKS[0]])},
+             {"type": "task", "id": 2, "project_id": 1, "title": "u", "checks": "not json"}]
+    board_io.import_board(store.conn, io.StringIO("\n".join(json.dumps(line) for line in lines)))
+    assert [json.loads(t["checks"]) if t["checks"] else None for t in store.list_tasks()] == [CHECKS[:1], None]
+    store.close()
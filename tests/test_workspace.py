@@ -0,0 +1,20 @@
+import os
+
+from workspace import WorkspaceIndex
+
+def test_touch_is_not_an_edit(tmp_path):
+    (tmp_path / "same.txt").write_text("a")
+    (tmp_path / "edited.txt").write_text("b")
+    index = WorkspaceIndex(str(tmp_path))
+    assert index.scan() is None
+
+    (tmp_path / "same.txt").write_text("a")
+    os.utime(tmp_path / "same.txt", ns=(1, 1))
+    (tmp_path / "edited.txt").write_text("c")
+    os.utime(tmp_path / "edited.txt", ns=(1, 1))
+    (tmp_path / "new.txt").write_text("d")
+    assert index.scan() == {"added": ["new.txt"], "removed": [], "modified": ["edited.txt"]}
+
+    os.utime(tmp_path / "new.txt", ns=(2, 2))
+    (tmp_path / "same.txt").unlink()
+    assert index.scan() == {"added": [], "removed": ["same.txt"], "modified": []}
@@ -0,0 +1,178 @@
+import os
+import re
+import json
+import time
+import shlex
+import subprocess
+from dotenv import load_dotenv
+
+import metrics
+
+load_dotenv()
+
+# Machine-checkable success criteria, run in the working directory after a
+# CodingAgent reports success and before the (expensive) ReviewerAgent.
+#
+# tasks.checks holds a JSON list, e.g.
+#   [{"type": "file_exists", "path": "index.html"},
+#    {"type": "regex", "path": "app.py", "pattern": "def main\\("},
+#    {"type": "command", "cmd": "npm run build"},
+#    {"type": "test", "cmd": "pytest -q"}]
+#
+# command / test checks run on this machine. Only a user adds them (the create
+# and edit dialogs); tasks from the generator or an imported board keep just
+# the file checks. Commands run as an argument list unless marked
+# "shell": true, which dump_checks does for the checks a user saves.
+
+VERIFY_COMMAND_TIMEOUT = int(os.getenv("VERIFY_COMMAND_TIMEOUT", 120))
+VERIFY_TEST_TIMEOUT = int(os.getenv("VERIFY_TEST_TIMEOUT", 600))
+OUTPUT_TAIL_CHARS = 2000
+
+# Cheapest first, so a missing file fails before a test suite runs
+CHECK_ORDER = {"file_exists": 0, "regex": 1, "command": 2, "test": 3}
+# Checks that only read files in the working directory
+FILE_CHECKS = ("file_exists", "regex")
+
+VERIFICATIONS = metrics.registry.counter("ralph_verifications", "Pre-review verification gate results", ("outcome",))
+
+def parse_checks(value):
+    """
+    Returns a validated list of checks from a JSON string / list, or raises ValueError.
+    Empty input means no checks.
+    """
+    if value is None or value == "" or value == []:
+        return []
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Checks must be JSON: {e}")
+    if isinstance(value, dict):
+        value = [value]
+    if not isinstance(value, list):
+        raise ValueError("Checks must be a list")
+
+    checks = []
+    for check in value:
+        if not isinstance(check, dict) or check.get("type") not in CHECK_ORDER:
+            raise ValueError(f"Unknown check {check!r}, expected type one of {sorted(CHECK_ORDER)}")
+        kind = check["type"]
+        if kind in ("file_exists", "regex") and not check.get("path"):
+            raise ValueError(f"{kind} check needs a 'path'")
+        if kind == "regex":
+            if not check.get("pattern"):
+                raise ValueError("regex check needs a 'pattern'")
+            try:
+                re.compile(check["pattern"])
+            except re.error as e:
+                raise ValueError(f"Invalid regex {check['pattern']!r}: {e}")
+        if kind in ("command", "test") and not check.get("cmd"):
+            raise ValueError(f"{kind} check needs a 'cmd'")
+        checks.append(check)
+    return checks
+
+def dump_checks(value, authored=True):
+    """
+    Normalized JSON for the DB, or None. Checks a user `authored` may run
+    shell commands; otherwise (model output, imports) command and test
+    checks are dropped.
+    """
+    checks = parse_checks(value)
+    if authored:
+        checks = [{**c, "shell": True} if c["type"] not in FILE_CHECKS else c for c in checks]
+    else:
+        dropped = [c["cmd"] for c in checks if c["type"] not in FILE_CHECKS]
+        if dropped:
+            print(f"Dropping command checks nobody reviewed: {dropped}")
+        checks = [c for c in checks if c["type"] in FILE_CHECKS]
+    return json.dumps(checks) if checks else None
+
+def _resolve(working_dir, path):
+    # Paths are relative to the working directory and may not leave it
+    root = os.path.realpath(working_dir)
+    full = os.path.realpath(os.path.join(root, path))
+    if full != root and not full.startswith(root + os.sep):
+        raise ValueError(f"{path} is outside the working directory")
+    return full
+
+def _run_command(cmd, working_dir, timeout, shell=False):
+    if not shell:
+        try:
+            cmd = shlex.split(cmd, posix=os.name != "nt")
+        except ValueError as e:
+            return False, f"can't parse command: {e}"
+    try:
+        proc = subprocess.run(
+            cmd, cwd=working_dir, shell=shell, capture_output=True,
+            text=True, encoding='utf-8', errors='replace', timeout=timeout
+        )
+    except subprocess.TimeoutExpired:
+        return False, f"timed out after {timeout}s"
+    output = (proc.stdout or "") + (proc.stderr or "")
+    if proc.returncode == 0:
+        return True, "exit 0"
+    return False, f"exit {proc.returncode}\n{output[-OUTPUT_TAIL_CHARS:]}"
+
+def _run_one(check, working_dir):
+    kind = check["type"]
+    if kind == "file_exists":
+        full = _resolve(working_dir, check["path"])
+        return os.path.exists(full), ("found" if os.path.exists(full) else "not found")
+    if kind == "regex":
+        full = _resolve(working_dir, check["path"])
+        if not os.path.isfile(full):
+            return False, "file not found"
+        with open(full, "r", encoding="utf-8", errors="replace") as f:
+            found = re.search(check["pattern"], f.read(), re.MULTILINE)
+        return bool(found), ("pattern found" if found else f"pattern {check['pattern']!r} not found")
+    default_timeout = VERIFY_TEST_TIMEOUT if kind == "test" else VERIFY_COMMAND_TIMEOUT
+    return _run_command(check["cmd"], working_dir, int(check.get("timeout") or default_timeout), shell=check.get("shell") is True)
+
+def run_checks(checks, working_dir):
+    """
+    Runs checks cheapest-first and stops at the first failure.
+    Returns {"passed", "results": [{check, ok, detail}], "seconds"}.
+    """
+    started = time.perf_counter()
+    results = []
+    passed = True
+    if not working_dir or not os.path.isdir(working_dir):
+        return {"passed": False, "results": [{"check": None, "ok": False, "detail": f"working directory {working_dir!r} not found"}],
+                "seconds": 0.0}
+
+    for check in sorted(checks, key=lambda c: CHECK_ORDER[c["type"]]):
+        try:
+            ok, detail = _run_one(check, working_dir)
+        except Exception as e:
+            ok, detail = False, str(e)
+        results.append({"check": check, "ok": ok, "detail": detail})
+        if not ok:
+            passed = False
+            break
+    return {"passed": passed, "results": results, "seconds": round(time.perf_counter() - started, 3)}
+
+def format_report(report):
+    lines = ["Automated checks failed:"]
+    for r in report["results"]:
+        check = r["check"] or {}
+        target = check.get("path") or check.get("cmd") or ""
+        lines.append(f"- [{'PASS' if r['ok'] else 'FAIL'}] {check.get('type', 'setup')} {target}: {r['detail']}")
+    return "\n".join(lines)
+
+def verify_task(task):
+    """
+    Runs the task's checks, if any. Returns None when there is nothing to
+    check, otherwise the run_checks report.
+    """
+    try:
+        checks = parse_checks(task.get('checks'))
+    except ValueError as e:
+        print(f"Task {task.get('id')} has invalid checks, skipping gate: {e}")
+        return None
+    if not checks:
+        return None
+
+    report = run_checks(checks, task.get('working_dir'))
+    VERIFICATIONS.inc(1, ("passed" if report["passed"] else "failed",))
+    print(f"DEBUG: Task {task.get('id')} checks {'passed' if report['passed'] else 'FAILED'} in {report['seconds']}s")
+    return report
@@ -229,16 +229,19 @@ function openEditModal(task) {
     document.getElementById('editTaskTitle').value = task.title;
     document.getElementById('editTaskDesc').value = task.description || '';
     document.getElementById('editTaskSuccess').value = task.success_criteria || '';
+    document.getElementById('editTaskChecks').value = task.checks || '';
     document.getElementById('editProjectName').innerText = task.project_name || 'Project';
     document.getElementById('editInprogress').checked = !!task.is_inprogress;
     document.getElementById('editReview').checked = !!task.is_review;
     document.getElementById('editComplete').checked = !!task.is_complete;
     document.getElementById('editFailed').checked = !!task.is_failed;
     document.getElementById('editReviewCount').value = task.review_count || 0;
+    document.getElementById('editPriority').value = task.priority || 0;
     document.getElementById('editCreatedAt').value = task.created_at || '';
 
     const depSelect = document.getElementById('editTaskDependency');
-    depSelect.innerHTML = '<option value="">None</option>';
+    depSelect.innerHTML = '';
+    const depIds = task.dependency_ids || [];
 
     // Filter out current task from dependency options
     tasks.forEach(t => {
@@ -246,7 +249,7 @@ function openEditModal(task) {
             const opt = document.createElement('option');
             opt.value = t.id;
             opt.text = `[${t.project_name}] ${t.title}`;
-            if (t.id == task.dependency_id) opt.selected = true;
+            if (depIds.includes(t.id)) opt.selected = true;
             depSelect.appendChild(opt);
         }
     });
@@ -254,9 +257,10 @@ function openEditModal(task) {
     document.getElementById('editTaskTitle').onblur = () => saveTaskDetails();
     document.getElementById('editTaskDesc').onblur = () => saveTaskDetails();
     document.getElementById('editTaskSuccess').onblur = () => saveTaskDetails();
-    document.getElementById('editTaskDependency').onchange = () => saveTaskDetails();
+    document.getElementById('editTaskChecks').onblur = () => saveTaskDetails();
     document.getElementById('editTaskDependency').onchange = () => saveTaskDetails();
     document.getElementById('editReviewCount').onblur = () => saveTaskDetails();
+    document.getElementById('editPriority').onblur = () => saveTaskDetails();
 
     // Mutex Logic for Status Checkboxes
     const statusChecks = [
@@ -293,7 +297,7 @@ async function saveTaskDetails() {
     const title = document.getElementById('editTaskTitle').value;
     const description = document.getElementById('editTaskDesc').value;
     const success_criteria = document.getElementById('editTaskSuccess').value;
-    const depId = document.getElementById('editTaskDependency').value;
+    const depIds = Array.from(document.getElementById('editTaskDependency').selectedOptions).map(o => parseInt(o.value));
     const isInProgress = document.getElementById('editInprogress').checked;
     const isReview = document.getElementById('editReview').checked;
     const isComplete = document.getElementById('editComplete').checked;
@@ -304,18 +308,24 @@ async function saveTaskDetails() {
     statusText.innerText = 'Saving...';
 
     try {
-        await eel.update_task_details(
+        const result = await eel.update_task_details(
             currentEditingTaskId,
             title,
             description,
             success_criteria,
-            depId ? parseInt(depId) : null,
+            depIds,
             isInProgress,
             isReview,
             isComplete,
             isFailed,
-            parseInt(document.getElementById('editReviewCount').value)
+            parseInt(document.getElementById('editReviewCount').value),
+            parseInt(document.getElementById('editPriority').value) || 0,
+            document.getElementById('editTaskChecks').value.trim()
         )();
+        if (result && result.success === false) {
+            statusText.innerText = result.message;
+            return;
+        }
         statusText.innerText = 'Saved!';
 
         // Refresh board
@@ -356,6 +366,7 @@ async function renderAgents() {
         let queues = [];
         try { queues = JSON.parse(agent.target_queues || '[]'); } catch (e) { }
         const queuesStr = queues.join(', ');
+        const activity = agent.activity || {};
 
         card.innerHTML = `
             <button onclick="deleteAgent(${agent.id})" class="absolute top-4 right-4 text-slate-700 hover:text-red-400 opacity-0 group-hover:opacity-100 transition-all p-1 hover:bg-red-500/10 rounded">
@@ -398,12 +409,33 @@ async function renderAgents() {
                     <span class="text-[10px] text-slate-600 uppercase tracking-wider font-bold">Directive</span>
                     <span class="text-slate-500 font-mono text-[10px] truncate max-w-[120px] bg-black/40 px-2 py-0.5 rounded border border-white/5">${agent.system_prompt_key}</span>
                 </div>
+                <div class="flex justify-between text-xs items-center">
+                    <span class="text-[10px] text-slate-600 uppercase tracking-wider font-bold">Activity</span>
+                    <span class="${activity.busy ? 'text-amber-400' : 'text-slate-500'} text-[10px] truncate max-w-[160px]" title="${agent.status || 'Idle'}">${agent.status || 'Idle'}</span>
+                </div>
+                <div class="flex justify-between text-[10px] text-slate-600">
+                    <span>${Math.round((activity.utilization || 0) * 100)}% busy</span>
+                    ${activity.busy ? `<button onclick="stopAgentRuns(${agent.id})" class="text-red-400/80 hover:text-red-400 uppercase tracking-wider font-bold" title="Stop the run and put its task back in its queue">Stop</button>` : ''}
+                    <span>${activity.tasks_per_hour || 0} tasks/h</span>
+                </div>
             </div>
         `;
         grid.appendChild(card);
     });
 }
 
+async function stopAgentRuns(id) {
+    const agent = allAgents.find(a => a.id === id);
+    const runs = (agent && agent.activity && agent.activity.runs) || [];
+    if (!runs.length || !confirm(`Stop ${agent.name} and put its task back in the queue?`)) return;
+
+    for (const run of runs) {
+        const result = await eel.cancel_task(run.task_id)();
+        if (result && !result.success) console.warn(result.message);
+    }
+    renderAgents();
+}
+
 async function toggleAgentActive(id, isActive) {
     const agent = allAgents.find(a => a.id === id);
     if (!agent) return;
@@ -602,8 +634,86 @@ async function deleteAgent(id) {
     }
 }
 
+// Search Logic
+let searchTimer = null;
+let searchPage = 1;
+
+function escapeHtml(text) {
+    const div = document.createElement('div');
+    div.innerText = text || '';
+    return div.innerHTML;
+}
+
+function onSearchInput(query) {
+    clearTimeout(searchTimer);
+    searchPage = 1;
+    searchTimer = setTimeout(() => runSearch(query), 250);
+}
+
+async function runSearch(query, page = 1) {
+    const panel = document.getElementById('searchResults');
+    if (!query || !query.trim()) {
+        panel.classList.add('hidden');
+        return;
+    }
+
+    const data = await eel.search(query, page, 20)();
+    const results = (data && data.results) || [];
+    searchPage = page;
+
+    if (results.length === 0) {
+        panel.innerHTML = '<div class="p-3 text-xs text-slate-600">No matches</div>';
+        panel.classList.remove('hidden');
+        return;
+    }
+
+    // Snippets are escaped, then the highlight marks are restored
+    panel.innerHTML = results.map((r, i) => `
+        <div class="p-3 border-b border-white/5 hover:bg-white/5 cursor-pointer" onclick="openSearchResult(${i})">
+            <div class="flex justify-between items-center mb-1">
+                <span class="text-xs text-white font-medium truncate">${escapeHtml(r.title)}</span>
+                <span class="text-[9px] uppercase tracking-widest text-cyan-400 font-bold ml-2">${r.kind}</span>
+            </div>
+            <div class="text-[11px] text-slate-500 leading-snug">${escapeHtml(r.snippet).replace(/&lt;mark&gt;/g, '<mark>').replace(/&lt;\/mark&gt;/g, '</mark>')}</div>
+        </div>
+    `).join('') + (data.total > page * data.page_size ? `
+        <div class="p-2 text-center text-[10px] uppercase tracking-widest text-cyan-400 font-bold cursor-pointer hover:bg-white/5"
+            onclick="runSearch(document.getElementById('searchInput').value, ${page + 1})">More (${data.total} total)</div>
+    ` : '');
+    panel.searchResults = results;
+    panel.classList.remove('hidden');
+}
+
+function openSearchResult(index) {
+    const panel = document.getElementById('searchResults');
+    const result = panel.searchResults[index];
+    panel.classList.add('hidden');
+    if (!result) return;
+
+    if (result.task_id) {
+        const task = tasks.find(t => t.id === result.task_id);
+        if (task) {
+            switchTab('kanban');
+            openEditModal(task);
+            return;
+        }
+    }
+    switchTab('projects');
+}
+
+document.addEventListener('click', (e) => {
+    const panel = document.getElementById('searchResults');
+    if (panel && !panel.parentElement.contains(e.target)) panel.classList.add('hidden');
+});
+
 // Polling Loop
+// Skipped when the backend schedules agents itself (BACKEND_SCHEDULER or daemon mode)
+let backendScheduling = false;
+eel.get_runtime_info()().then(info => { backendScheduling = !!(info && info.backend_scheduler); });
+
 setInterval(async () => {
+    if (backendScheduling) return;
+
     // Check for work for all active agents
     if (!allAgents || allAgents.length === 0) return;
 
@@ -690,6 +800,48 @@ async function renderProjects() {
         `;
         grid.appendChild(card);
     });
+
+    renderArchivedProjects(grid);
+}
+
+async function renderArchivedProjects(grid) {
+    const archived = await eel.get_archived_projects()();
+    archived.forEach(p => {
+        const card = document.createElement('div');
+        card.className = 'glow-card p-6 flex flex-col gap-4 relative group rounded-xl opacity-40 hover:opacity-80 transition-all';
+        card.innerHTML = `
+            <div class="flex items-center justify-between">
+                <h3 class="font-bold text-white text-lg truncate pr-4">${p.name}</h3>
+                <span class="text-[9px] uppercase tracking-widest border px-2 py-1 rounded text-purple-400 border-purple-500/30 bg-purple-500/10 font-bold">Archived</span>
+            </div>
+            <div class="flex justify-between text-[10px] uppercase tracking-widest text-slate-600 font-bold">
+                <span>${p.completed_tasks} / ${p.total_tasks} tasks</span>
+                <span>${p.archived_at || ''}</span>
+            </div>
+            <button onclick="restoreArchivedProject(${p.id})"
+                class="mt-auto text-xs text-cyan-400 hover:text-cyan-300 uppercase tracking-wider font-bold text-left">Restore</button>
+        `;
+        grid.appendChild(card);
+    });
+}
+
+async function archiveCompletedProjects() {
+    if (!confirm("Move all completed projects to the archive?")) return;
+    const result = await eel.archive_completed_projects()();
+    if (result && result.success) {
+        renderProjects();
+        init();
+    }
+}
+
+async function restoreArchivedProject(id) {
+    const result = await eel.restore_archived_project(id)();
+    if (!result || !result.success) {
+        alert("Error restoring project: " + (result ? result.message : 'unknown'));
+        return;
+    }
+    renderProjects();
+    init();
 }
 
 function openProjectEditModal(project) {
@@ -745,6 +897,49 @@ async function deleteProject() {
     }
 }
 
+async function expandProjectTasks() {
+    const id = parseInt(document.getElementById('editProjectId').value);
+    const openTasks = tasks.filter(t => t.project_id === id && (t.status === 'todo' || t.status === 'backlog'));
+    if (openTasks.length === 0) {
+        alert("No open tasks to expand in this project.");
+        return;
+    }
+    if (!confirm(`Break down ${openTasks.length} open task(s) into subtasks with AI?`)) return;
+
+    const btn = document.getElementById('expandProjectBtn');
+    btn.disabled = true;
+    btn.innerText = `Expanding 0/${openTasks.length}`;
+
+    try {
+        const result = await eel.expand_tasks_with_ai(openTasks.map(t => t.id))();
+        if (!result || !result.success) {
+            alert("Error expanding tasks: " + (result ? result.message : 'unknown'));
+        }
+        renderProjects();
+        init(); // Refresh tasks
+    } catch (e) {
+        console.error(e);
+        alert("Error expanding tasks");
+    } finally {
+        btn.disabled = false;
+        btn.innerText = 'AI Expand';
+    }
+}
+
+eel.expose(expansionProgress);
+function expansionProgress(progress) {
+    const btn = document.getElementById('expandProjectBtn');
+    if (btn) btn.innerText = `Expanding ${progress.done}/${progress.total}`;
+    if (!progress.success) console.warn(`Expansion of task ${progress.task_id} failed:`, progress.message);
+}
+
+eel.expose(generationProgress);
+function generationProgress(progress) {
+    // Large projects are planned epic by epic; show each epic's tasks as they land
+    const btnText = document.getElementById('btn-text');
+    if (btnText) btnText.innerText = `Planning ${progress.done}/${progress.total} epics`;
+    init();
+}
 
 // ================== ADD TASK MODAL ==================
 async function openAddTaskModal() {
@@ -0,0 +1,218 @@
+import os
+import time
+import queue
+import threading
+import multiprocessing
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Pool Configuration
+POOL_SIZE = int(os.getenv("AGENT_POOL_SIZE", 0))  # 0 = disabled, use windows / in-process
+WORKER_MAX_TASKS = int(os.getenv("WORKER_MAX_TASKS", 20))  # Recycle worker after N tasks
+WORKER_MAX_MEMORY_MB = int(os.getenv("WORKER_MAX_MEMORY_MB", 1024))  # Recycle worker above this RSS
+
+def current_rss_mb():
+    """
+    Resident memory of the current process in MB, or None if it can't be read.
+    """
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except Exception:
+        return None
+
+def _worker_main(conn, max_tasks, max_memory_mb):
+    """
+    Long-lived worker: the agent_runner.py logic as a loop.
+    Imports, DB connection and agent objects are created once and reused.
+    """
+    import agent_runner
+
+    db = agent_runner.get_db()
+    agent_cache = {}
+    tasks_done = 0
+    print(f"[Worker {os.getpid()}] Ready.")
+
+    try:
+        while True:
+            try:
+                job = conn.recv()
+            except EOFError:
+                break
+            if job is None:
+                break
+
+            task_id, agent_id = job
+            print(f"[Worker {os.getpid()}] Task {task_id} (Agent {agent_id})")
+            if isinstance(task_id, tuple):
+                # Batch review
+                result = agent_runner.run_review_batch(list(task_id), agent_id, conn=db, agent_cache=agent_cache, show_window=False)
+            else:
+                result = agent_runner.run_task(task_id, agent_id, conn=db, agent_cache=agent_cache, show_window=False)
+            tasks_done += 1
+
+            rss = current_rss_mb()
+            recycle = tasks_done >= max_tasks or (rss is not None and rss > max_memory_mb)
+
+            conn.send({
+                "task_id": task_id,
+                "success": bool(result.get("success")),
+                "message": str(result.get("message", ""))[-2000:],
+                "recycle": recycle
+            })
+            if recycle:
+                print(f"[Worker {os.getpid()}] Recycling after {tasks_done} tasks (RSS: {rss} MB).")
+                break
+    finally:
+        db.close()
+        conn.close()
+
+class WorkerPool:
+    """
+    Supervisor for a pool of pre-warmed agent worker processes.
+
+    Tasks are queued with submit() and handed to idle workers over a Pipe.
+    Each worker slot has a supervisor thread that respawns its process when
+    it crashes or asks to be recycled, so a failing agent never takes the
+    UI process down with it.
+    """
+
+    def __init__(self, size=POOL_SIZE, max_tasks=WORKER_MAX_TASKS, max_memory_mb=WORKER_MAX_MEMORY_MB, on_task_done=None):
+        self.size = size
+        self.max_tasks = max_tasks
+        self.max_memory_mb = max_memory_mb
+        self.on_task_done = on_task_done
+        self.jobs = queue.Queue()
+        # spawn keeps workers clean of the parent's threads and eel/gevent state
+        self.ctx = multiprocessing.get_context("spawn")
+        self.slots = []
+        self.lock = threading.Lock()
+        self.running = False
+
+    def start(self):
+        with self.lock:
+            if self.running:
+                return
+            self.running = True
+            for i in range(self.size):
+                slot = {"index": i, "process": None, "conn": None, "task_id": None, "tasks_done": 0, "restarts": 0}
+                slot["process"], slot["conn"] = self._spawn()
+                thread = threading.Thread(target=self._supervise, args=(slot,))
+                thread.daemon = True
+                slot["thread"] = thread
+                self.slots.append(slot)
+                thread.start()
+        print(f"DEBUG: Worker pool started with {self.size} workers.")
+
+    def _spawn(self):
+        parent_conn, child_conn = self.ctx.Pipe()
+        process = self.ctx.Process(
+            target=_worker_main,
+            args=(child_conn, self.max_tasks, self.max_memory_mb),
+            daemon=True
+        )
+        process.start()
+        child_conn.close()
+        return process, parent_conn
+
+    def _respawn(self, slot):
+        try:
+            slot["conn"].close()
+        except Exception:
+            pass
+        if slot["process"].is_alive():
+            slot["process"].join(timeout=5)
+            if slot["process"].is_alive():
+                slot["process"].terminate()
+        slot["process"], slot["conn"] = self._spawn()
+        slot["tasks_done"] = 0
+        slot["restarts"] += 1
+
+    def _supervise(self, slot):
+        while self.running:
+            job = self.jobs.get()
+            if job is None:
+                break
+
+            task_id, agent_id, submitted_at = job
+            slot["task_id"] = task_id
+            reply = None
+
+            try:
+                slot["conn"].send((task_id, agent_id))
+                while reply is None:
+                    if slot["conn"].poll(1.0):
+                        reply = slot["conn"].recv()
+                    elif not slot["process"].is_alive():
+                        break
+            except (EOFError, OSError) as e:
+                print(f"DEBUG: Worker pipe error: {e}")
+
+            if reply is None:
+                # Worker died mid-task; the task would otherwise hang in progress
+                import agent_runner
+                print(f"DEBUG: Worker {slot['process'].pid} crashed on task {task_id}. Respawning.")
+                for failed_id in (task_id if isinstance(task_id, tuple) else (task_id,)):
+                    agent_runner.mark_task_failed(failed_id)
+                # Its opencode runs in a process group of its own and outlives it
+                agent_runner.stop_orphans(slot["process"].pid)
+                self._respawn(slot)
+            else:
+                slot["tasks_done"] += 1
+                if reply.get("recycle"):
+                    self._respawn(slot)
+
+            slot["task_id"] = None
+            if self.on_task_done:
+                try:
+                    self.on_task_done(task_id, reply, submitted_at)
+                except Exception as e:
+                    print(f"Error in worker pool callback: {e}")
+
+        try:
+            slot["conn"].send(None)
+        except Exception:
+            pass
+
+    def submit(self, task_id, agent_id):
+        # task_id may be a list of ids for a batch review
+        if not self.running:
+            self.start()
+        if isinstance(task_id, (list, tuple)):
+            task_id = tuple(int(t) for t in task_id)
+        else:
+            task_id = int(task_id)
+        # Submit time tells this run's agent activity from a later run of the task
+        self.jobs.put((task_id, int(agent_id), time.time()))
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "queued": self.jobs.qsize(),
+            "workers": [
+                {
+                    "pid": s["process"].pid,
+                    "alive": s["process"].is_alive(),
+                    "task_id": s["task_id"],
+                    "tasks_done": s["tasks_done"],
+                    "restarts": s["restarts"]
+                } for s in self.slots
+            ]
+        }
+
+    def shutdown(self, timeout=5):
+        self.running = False
+        for _ in self.slots:
+            self.jobs.put(None)
+        deadline = time.time() + timeout
+        for s in self.slots:
+            s["thread"].join(timeout=max(0, deadline - time.time()))
+            if s["process"].is_alive():
+                s["process"].terminate()
@@ -0,0 +1,122 @@
+import os
+import fnmatch
+import hashlib
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Directory / file names skipped when fingerprinting a working directory
+DEFAULT_IGNORE = [".git", ".opencode", "node_modules", "__pycache__", ".venv", "venv", ".pytest_cache", ".mypy_cache"]
+WORKSPACE_IGNORE = DEFAULT_IGNORE + [p.strip() for p in os.getenv("WORKSPACE_IGNORE", "").split(",") if p.strip()]
+# Above this many files the scan gives up and every iteration counts as progress
+WORKSPACE_MAX_FILES = int(os.getenv("WORKSPACE_MAX_FILES", 50000))
+HASH_CHUNK = 1 << 20
+
+def _hash_file(path):
+    h = hashlib.blake2b(digest_size=16)
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+                h.update(chunk)
+    except OSError:
+        return None
+    return h.hexdigest()
+
+class WorkspaceIndex:
+    """
+    Incremental fingerprint of a directory tree.
+
+    The first scan hashes every file (up to max_files). Later scans only
+    stat files and hash new ones and those whose mtime or size changed, so
+    a touch or an identical rewrite doesn't count as an edit and unchanged
+    trees cost one stat per file.
+    """
+
+    def __init__(self, root, ignore=None, max_files=WORKSPACE_MAX_FILES):
+        self.root = os.path.abspath(root)
+        self.ignore = list(ignore if ignore is not None else WORKSPACE_IGNORE)
+        self.max_files = max_files
+        # relpath -> (mtime_ns, size, hash or None if unreadable)
+        self.entries = None
+        self.truncated = False
+
+    def _ignored(self, name):
+        return any(fnmatch.fnmatch(name, pattern) for pattern in self.ignore)
+
+    def _walk(self):
+        stack = [self.root]
+        count = 0
+        while stack:
+            current = stack.pop()
+            try:
+                with os.scandir(current) as it:
+                    for entry in it:
+                        if self._ignored(entry.name):
+                            continue
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append(entry.path)
+                            elif entry.is_file(follow_symlinks=False):
+                                count += 1
+                                if count > self.max_files:
+                                    self.truncated = True
+                                    return
+                                st = entry.stat(follow_symlinks=False)
+                                yield os.path.relpath(entry.path, self.root), st.st_mtime_ns, st.st_size
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+
+    def scan(self):
+        """
+        Rescans the tree and returns the changes since the previous scan as
+        {"added": [...], "removed": [...], "modified": [...]}, or None on the
+        first scan (or when the tree is too large to track).
+        """
+        self.truncated = False
+        previous = self.entries
+        current = {}
+        added, modified = [], []
+
+        for rel, mtime_ns, size in self._walk():
+            old = previous.get(rel) if previous is not None else None
+            if old is None:
+                # Hashed now so a later touch isn't mistaken for an edit
+                current[rel] = (mtime_ns, size, _hash_file(os.path.join(self.root, rel)))
+                if previous is not None:
+                    added.append(rel)
+            elif old[0] == mtime_ns and old[1] == size:
+                current[rel] = old
+            else:
+                new_hash = _hash_file(os.path.join(self.root, rel))
+                current[rel] = (mtime_ns, size, new_hash)
+                # Unknown old hash (unreadable) or different content -> modified
+                if old[2] is None or old[2] != new_hash or old[1] != size:
+                    modified.append(rel)
+
+        self.entries = current
+        if previous is None or self.truncated:
+            return None
+        removed = [rel for rel in previous if rel not in current]
+        return {"added": sorted(added), "removed": sorted(removed), "modified": sorted(modified)}
+
+def changed_files(changes):
+    if not changes:
+        return []
+    return changes["added"] + changes["modified"] + changes["removed"]
+
+def describe_changes(changes, limit=10):
+    # One line for prompts and logs
+    if changes is None:
+        return "Workspace changes: unknown"
+    files = changed_files(changes)
+    if not files:
+        return "Workspace changes: none"
+    parts = []
+    for key in ("added", "modified", "removed"):
+        if changes[key]:
+            shown = ", ".join(changes[key][:limit])
+            more = f" (+{len(changes[key]) - limit} more)" if len(changes[key]) > limit else ""
+            parts.append(f"{key}: {shown}{more}")
+    return "Workspace changes: " + "; ".join(parts)